@@ -0,0 +1,132 @@
+import json
+import time
+from types import SimpleNamespace
+
+from kubernetes.client import ApiClient
+
+from version_checker.k8s import list_in_pages
+from version_checker.k8s.records import reduce_pod, reduce_raw_pod
+
+POD_COUNT = 10000
+
+
+def pod_list_response(count: int) -> bytes:
+    """
+    Builds a pod list response body shaped like the API server's, with the metadata, spec and status fields that a
+    real pod carries rather than only the ones the checker reads.
+    """
+    return json.dumps(
+        {
+            "kind": "PodList",
+            "apiVersion": "v1",
+            "metadata": {"resourceVersion": "123456"},
+            "items": [
+                {
+                    "metadata": {
+                        "name": "app-{index}".format(index=index),
+                        "namespace": "namespace-{index}".format(index=index % 50),
+                        "uid": "uid-{index}".format(index=index),
+                        "resourceVersion": str(index),
+                        "creationTimestamp": "2019-08-01T00:00:00Z",
+                        "labels": {"app": "app", "pod-template-hash": "abc123"},
+                        "annotations": {"kubernetes.io/psp": "restricted"},
+                        "ownerReferences": [
+                            {
+                                "apiVersion": "apps/v1",
+                                "kind": "ReplicaSet",
+                                "name": "app-abc123",
+                                "uid": "rs-{index}".format(index=index % 500),
+                                "controller": True,
+                                "blockOwnerDeletion": True,
+                            }
+                        ],
+                    },
+                    "spec": {
+                        "nodeName": "node-{index}".format(index=index % 100),
+                        "restartPolicy": "Always",
+                        "containers": [
+                            {
+                                "name": "app",
+                                "image": "registry.example.com/app:1.2.3",
+                                "ports": [{"containerPort": 8080, "protocol": "TCP"}],
+                                "env": [{"name": "MODE", "value": "production"}],
+                                "resources": {
+                                    "limits": {"cpu": "1", "memory": "512Mi"},
+                                    "requests": {"cpu": "100m", "memory": "128Mi"},
+                                },
+                                "volumeMounts": [
+                                    {
+                                        "name": "token",
+                                        "mountPath": "/var/run/secrets/kubernetes.io/serviceaccount",
+                                        "readOnly": True,
+                                    }
+                                ],
+                            }
+                        ],
+                        "volumes": [
+                            {"name": "token", "secret": {"secretName": "default-token"}}
+                        ],
+                    },
+                    "status": {
+                        "phase": "Running",
+                        "hostIP": "10.0.0.1",
+                        "podIP": "10.1.0.1",
+                        "startTime": "2019-08-01T00:00:00Z",
+                        "conditions": [
+                            {
+                                "type": "Ready",
+                                "status": "True",
+                                "lastTransitionTime": "2019-08-01T00:00:00Z",
+                            }
+                        ],
+                        "containerStatuses": [
+                            {
+                                "name": "app",
+                                "ready": True,
+                                "restartCount": 0,
+                                "image": "registry.example.com/app:1.2.3",
+                                "imageID": "docker-pullable://registry.example.com/app@sha256:{index:064x}".format(
+                                    index=index
+                                ),
+                                "containerID": "docker://{index:064x}".format(
+                                    index=index
+                                ),
+                                "state": {
+                                    "running": {"startedAt": "2019-08-01T00:00:00Z"}
+                                },
+                                "lastState": {},
+                            }
+                        ],
+                    },
+                }
+                for index in range(count)
+            ],
+        }
+    ).encode()
+
+
+def test_raw_pod_listing_matches_and_is_faster_than_model_deserialisation():
+    body = pod_list_response(POD_COUNT)
+    api_client = ApiClient()
+
+    def model_list_fn(limit=None, _continue=None):
+        return api_client.deserialize(SimpleNamespace(data=body), "V1PodList")
+
+    def raw_list_fn(limit=None, _continue=None, _preload_content=True):
+        return SimpleNamespace(data=body)
+
+    start = time.perf_counter()
+    model_records, _ = list_in_pages(model_list_fn, reduce_pod, POD_COUNT)
+    model_duration = time.perf_counter() - start
+
+    start = time.perf_counter()
+    raw_records, _ = list_in_pages(raw_list_fn, reduce_raw_pod, POD_COUNT, raw=True)
+    raw_duration = time.perf_counter() - start
+
+    print(
+        "{count} pods: models {model:.3f}s, raw {raw:.3f}s".format(
+            count=POD_COUNT, model=model_duration, raw=raw_duration
+        )
+    )
+    assert raw_records == model_records
+    assert raw_duration < model_duration
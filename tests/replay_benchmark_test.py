@@ -0,0 +1,196 @@
+import tracemalloc
+
+import pytest
+
+from version_checker.checker import stream_check_resources
+from version_checker.k8s import get_api_functions
+from version_checker.k8s.resources import iter_cluster_resources
+from version_checker.notification import (
+    NewTagNotification,
+    OutOfDateContainerNotification,
+)
+from version_checker.replay import (
+    get_fake_api_client,
+    redirecting_adapter_factory,
+    start_replay,
+)
+from version_checker.sessions import configure_sessions
+
+MANIFEST_TYPE = "application/vnd.docker.distribution.manifest.v2+json"
+WORKLOAD_COUNTS = [100, 1000, pytest.param(10000, marks=pytest.mark.slow)]
+
+
+def owner_reference(api_version: str, kind: str, metadata: dict, uid: str) -> dict:
+    return {
+        "apiVersion": api_version,
+        "kind": kind,
+        "name": metadata["name"],
+        "uid": uid,
+        "controller": True,
+    }
+
+
+def synthetic_fixtures(workload_count: int):
+    """
+    Builds cluster and registry fixtures for the given number of deployments, each with a replica set and a running
+    pod. Deployments share images twenty to one, as they tend to in real clusters, and every tenth image is running an
+    out of date digest.
+    """
+    host = "registry-{count}.example.com".format(count=workload_count)
+    image_count = max(1, workload_count // 20)
+    repositories = {
+        "team/app-{image}".format(image=image): {
+            "tags": ["1.{minor}.0".format(minor=minor) for minor in range(30)]
+            + ["latest"],
+            "manifests": {
+                "1.0.0": {
+                    "digest": "sha256:{image:064x}".format(image=image),
+                    "media_type": MANIFEST_TYPE,
+                }
+            },
+        }
+        for image in range(image_count)
+    }
+    kinds = {
+        "deployments": [],
+        "replica_sets": [],
+        "pods": [],
+        "nodes": [
+            {
+                "metadata": {
+                    "name": "node-{node}".format(node=node),
+                    "uid": "node-{node}".format(node=node),
+                },
+                "status": {
+                    "nodeInfo": {
+                        "operatingSystem": "linux",
+                        "architecture": "amd64",
+                        "osImage": "Ubuntu 18.04.3 LTS",
+                        "kernelVersion": "4.15.0",
+                        "containerRuntimeVersion": "docker://18.9.7",
+                        "kubeletVersion": "v1.15.3",
+                        "kubeProxyVersion": "v1.15.3",
+                        "bootID": "boot-{node}".format(node=node),
+                        "machineID": "machine-{node}".format(node=node),
+                        "systemUUID": "system-{node}".format(node=node),
+                    }
+                },
+            }
+            for node in range(100)
+        ],
+    }
+    for index in range(workload_count):
+        image = index % image_count
+        image_name = "{host}/team/app-{image}:1.0.0".format(host=host, image=image)
+        running_digest = "sha256:{image:064x}".format(
+            image=image + (1 if image % 10 == 0 else 0)
+        )
+        pod_spec = {
+            "nodeName": "node-{node}".format(node=index % 100),
+            "containers": [{"name": "app", "image": image_name}],
+        }
+        metadata = {
+            "name": "app-{index}".format(index=index),
+            "namespace": "namespace-{namespace}".format(namespace=index % 50),
+        }
+        kinds["deployments"].append(
+            {
+                "metadata": {
+                    **metadata,
+                    "uid": "deployment-{index}".format(index=index),
+                },
+                "spec": {
+                    "selector": {"matchLabels": {"app": metadata["name"]}},
+                    "template": {"spec": pod_spec},
+                },
+            }
+        )
+        kinds["replica_sets"].append(
+            {
+                "metadata": {
+                    **metadata,
+                    "uid": "rs-{index}".format(index=index),
+                    "ownerReferences": [
+                        owner_reference(
+                            "apps/v1",
+                            "Deployment",
+                            metadata,
+                            "deployment-{index}".format(index=index),
+                        )
+                    ],
+                }
+            }
+        )
+        kinds["pods"].append(
+            {
+                "metadata": {
+                    **metadata,
+                    "uid": "pod-{index}".format(index=index),
+                    "ownerReferences": [
+                        owner_reference(
+                            "apps/v1",
+                            "ReplicaSet",
+                            metadata,
+                            "rs-{index}".format(index=index),
+                        )
+                    ],
+                },
+                "spec": pod_spec,
+                "status": {
+                    "containerStatuses": [
+                        {
+                            "name": "app",
+                            "ready": True,
+                            "restartCount": 0,
+                            "image": image_name,
+                            "imageID": "docker-pullable://{host}/team/app-{image}@{digest}".format(
+                                host=host, image=image, digest=running_digest
+                            ),
+                        }
+                    ]
+                },
+            }
+        )
+    return kinds, {host: repositories}
+
+
+@pytest.mark.parametrize("workload_count", WORKLOAD_COUNTS)
+def test_end_to_end_replay(benchmark, workload_count):
+    api_server, fake_registry = start_replay(*synthetic_fixtures(workload_count))
+    configure_sessions(8, redirecting_adapter_factory(fake_registry.url))
+
+    def run():
+        clusters = {"": [get_api_functions(api_client=get_fake_api_client(api_server))]}
+        return list(
+            stream_check_resources(
+                iter_cluster_resources(clusters, max_api_requests=3), workers=8
+            )
+        )
+
+    tracemalloc.start()
+    try:
+        checked = benchmark.pedantic(run, rounds=1, iterations=1)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        configure_sessions(4)
+        api_server.stop()
+        fake_registry.stop()
+
+    benchmark.extra_info["peak_memory_bytes"] = peak_memory
+    benchmark.extra_info["api_server_requests"] = dict(api_server.request_counts)
+    benchmark.extra_info["registry_requests"] = dict(fake_registry.request_counts)
+    assert len(checked) == workload_count
+    image_count = max(1, workload_count // 20)
+    assert sum(
+        isinstance(notification, OutOfDateContainerNotification)
+        for _, notifications, _ in checked
+        for notification in notifications
+    ) == sum(1 for index in range(workload_count) if index % image_count % 10 == 0)
+    assert all(
+        any(
+            isinstance(notification, NewTagNotification)
+            for notification in notifications
+        )
+        for _, notifications, _ in checked
+    )
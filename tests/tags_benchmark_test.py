@@ -0,0 +1,68 @@
+import random
+import re
+
+import pytest
+from packaging.version import parse, Version
+
+from version_checker.tags import find_newest_tag, parse_version_tag
+
+TAG_COUNT = 50000
+PATTERNS = ["", "^v.+"]
+
+
+def synthetic_tags(count: int):
+    generator = random.Random(1)
+    tags = []
+    for _ in range(count):
+        major, minor, patch = (generator.randint(0, 40) for _ in range(3))
+        tags.append(
+            generator.choice(
+                [
+                    "{}.{}.{}",
+                    "v{}.{}.{}",
+                    "{}.{}.{}-rc1",
+                    "{}.{}.{}-amd64",
+                    "build-{}{}{}",
+                    "sha-{}{}{}ab",
+                ]
+            ).format(major, minor, patch)
+        )
+    return tags
+
+
+def sorted_newest_tag(tags, match_pattern: str = ""):
+    """
+    The previous implementation, kept as a baseline: every tag is parsed twice and the whole list is sorted.
+    """
+    mapped_tags = sorted(
+        [
+            parse(tag)
+            for tag in tags
+            if isinstance(parse(tag), Version) and re.match(match_pattern, tag)
+        ],
+        reverse=True,
+    )
+    return mapped_tags[0] if mapped_tags else None
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_single_pass_finds_the_same_newest_tag_as_sorting(pattern):
+    tags = synthetic_tags(TAG_COUNT)
+    assert find_newest_tag(tags, pattern) == sorted_newest_tag(tags, pattern)
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+@pytest.mark.parametrize(
+    "newest_tag_fn", [sorted_newest_tag, find_newest_tag], ids=["sorted", "single-pass"]
+)
+def test_newest_of_50k_tags(benchmark, newest_tag_fn, pattern):
+    benchmark.group = "newest of {count} tags matching {pattern!r}".format(
+        count=TAG_COUNT, pattern=pattern
+    )
+    tags = synthetic_tags(TAG_COUNT)
+    benchmark.pedantic(
+        newest_tag_fn,
+        args=(tags, pattern),
+        setup=parse_version_tag.cache_clear,
+        rounds=3,
+    )
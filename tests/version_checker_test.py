@@ -1,13 +1,85 @@
+import json
+import pstats
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import Tuple
 
 import pytest
+from kubernetes.client import (
+    V1Container,
+    V1ContainerStatus,
+    V1ListMeta,
+    V1ObjectMeta,
+    V1OwnerReference,
+    V1Pod,
+    V1PodList,
+    V1PodSpec,
+    V1PodStatus,
+)
+from packaging.version import parse
 from pkg_resources import parse_version
+from requests import Request, Response
+from requests.adapters import HTTPAdapter
 
+from version_checker import (
+    checker,
+    registry,
+    tokens,
+    ratelimit,
+    timing,
+    metrics,
+    mirrors,
+    sharding,
+)
+from version_checker.cache import RegistryCache, configure_cache
+from version_checker.k8s import (
+    get_api_functions,
+    watch as k8s_watch,
+    list_in_pages,
+    VERSION_PATTERN_ANNOTATION,
+)
+from version_checker.k8s.deployments import get_pods_for_deployment
+from version_checker.k8s.resources import (
+    get_top_level_resources,
+    iter_cluster_resources,
+)
+from version_checker.k8s.model import (
+    Resource,
+    Container,
+    ObjectRecord,
+    K8sFetcherFunctions,
+)
+from version_checker.k8s.records import (
+    reduce_pod,
+    reduce_replica_set,
+    reduce_raw_replica_set,
+    reduce_raw_node,
+    reduce_raw_pod,
+)
+from version_checker.k8s.snapshot import (
+    ClusterSnapshot,
+    take_snapshot,
+    configure_listing,
+)
+from version_checker.fakes import FakeApiServer, FakeRegistry
+from version_checker.images import ImageRef, parse_image_ref
+from version_checker.replay import (
+    Recorder,
+    get_fake_api_client,
+    redirecting_adapter_factory,
+)
+from version_checker.sessions import configure_sessions
+from version_checker.state import NotificationState, get_listed_scope
+from version_checker.tags import find_newest_tag, is_versioned_tag
+from version_checker import notification
 from version_checker.notification import (
     NewTagNotification,
     OutOfDateContainerNotification,
+    ResolvedNotification,
 )
-from version_checker.registry import is_versioned_tag, get_registry_host_and_image
+from version_checker.registry import get_registry_host_and_image
 
 
 @pytest.mark.parametrize(
@@ -47,6 +119,55 @@ def test_get_host_and_image(image_name: str, output: Tuple[str, str]):
     assert get_registry_host_and_image(image_name) == output
 
 
+@pytest.mark.parametrize(
+    "image,expected",
+    [
+        ("nginx", ImageRef("registry-1.docker.io", "library/nginx")),
+        (
+            "docker.io/nginx:1.17",
+            ImageRef("registry-1.docker.io", "library/nginx", "1.17"),
+        ),
+        ("registry:5000/team/app:1.2", ImageRef("registry:5000", "team/app", "1.2")),
+        ("localhost/app", ImageRef("localhost", "app")),
+        (
+            "gcr.io/project/team/app:v1@sha256:" + "a" * 64,
+            ImageRef("gcr.io", "project/team/app", "v1", "sha256:" + "a" * 64),
+        ),
+        (
+            "app@sha256:" + "b" * 64,
+            ImageRef("registry-1.docker.io", "library/app", "", "sha256:" + "b" * 64),
+        ),
+    ],
+)
+def test_image_references_are_parsed(image: str, expected: ImageRef):
+    image_ref = parse_image_ref(image)
+    assert image_ref == expected
+    assert parse_image_ref(image) is image_ref
+    assert parse_image_ref(str(image_ref)) == image_ref
+
+
+def test_illegal_image_references_are_rejected():
+    with pytest.raises(Exception):
+        parse_image_ref("Registry.example.com/App:1")
+
+
+def test_lookup_plan_handles_registry_ports_and_pinned_digests():
+    pinned = "registry:5000/app:1.2@sha256:" + "c" * 64
+    resources = {
+        Resource(
+            "Deployment", "a", "1", "", frozenset({"registry:5000/app:1.2", pinned})
+        ): [
+            Container("node-1", "registry:5000/app:1.2", "registry:5000/app@sha256:1"),
+            Container("node-1", pinned, "registry:5000/app@sha256:1"),
+        ]
+    }
+    plan = checker.plan_lookups(resources)
+    app = parse_image_ref("registry:5000/app")
+    assert plan.tag_lookups == {(app, "")}
+    assert plan.digest_lookups == {(app, "1.2")}
+    assert app.host == "registry:5000"
+
+
 def test_new_tag_notification_outputs_correct_string_value():
     assert (
         str(NewTagNotification("testimage", "testtag", "v1"))
@@ -62,3 +183,1683 @@ def test_new_tag_notification_outputs_correct_string_value():
 #                                                                 "for pod " \
 #                                                                 "docker-pullable://repo/image:1@sha256:123123123 on " \
 #                                                                 "server"
+
+
+def _owned_object(cls, uid: str, owner_uid: str = None):
+    return cls(
+        metadata=V1ObjectMeta(
+            uid=uid,
+            owner_references=[
+                V1OwnerReference(
+                    api_version="apps/v1", kind="Owner", name=owner_uid, uid=owner_uid
+                )
+            ]
+            if owner_uid
+            else None,
+        )
+    )
+
+
+def _record(uid: str, owner_uid: str = None) -> ObjectRecord:
+    return ObjectRecord(
+        name=uid,
+        namespace="default",
+        uid=uid,
+        annotations={},
+        owner_uids=(owner_uid,) if owner_uid else (),
+        images=(),
+    )
+
+
+def test_snapshot_joins_pods_to_deployment_through_replica_sets():
+    deployment = _record("deployment-uid")
+    snapshot = ClusterSnapshot(
+        deployments=[deployment],
+        daemon_sets=[],
+        stateful_sets=[],
+        cron_jobs=[],
+        pods=[
+            _record("pod-1", "rs-1"),
+            _record("pod-2", "rs-2"),
+            _record("pod-3", "rs-other"),
+            _record("pod-4"),
+        ],
+        replica_sets=[
+            _record("rs-1", "deployment-uid"),
+            _record("rs-2", "deployment-uid"),
+            _record("rs-other", "other-uid"),
+        ],
+    )
+    assert [pod.uid for pod in get_pods_for_deployment(deployment, snapshot)] == [
+        "pod-1",
+        "pod-2",
+    ]
+
+
+def test_pods_are_listed_in_pages_and_reduced_to_records():
+    pages = {
+        None: V1PodList(
+            metadata=V1ListMeta(_continue="page-2"),
+            items=[
+                V1Pod(
+                    metadata=V1ObjectMeta(
+                        name="pod-1",
+                        namespace="default",
+                        uid="pod-1",
+                        annotations={
+                            VERSION_PATTERN_ANNOTATION: "^v",
+                            "unrelated": "annotation",
+                        },
+                    ),
+                    spec=V1PodSpec(
+                        node_name="node-1",
+                        containers=[V1Container(name="app", image="app:v1")],
+                    ),
+                    status=V1PodStatus(
+                        container_statuses=[
+                            V1ContainerStatus(
+                                name="app",
+                                image="app:v1",
+                                image_id="docker-pullable://app@sha256:1",
+                                ready=True,
+                                restart_count=0,
+                            )
+                        ]
+                    ),
+                )
+            ],
+        ),
+        "page-2": V1PodList(
+            metadata=V1ListMeta(resource_version="10"),
+            items=[
+                V1Pod(
+                    metadata=V1ObjectMeta(name="pod-2", uid="pod-2"),
+                    spec=V1PodSpec(containers=[]),
+                    status=V1PodStatus(),
+                )
+            ],
+        ),
+    }
+    records, resource_version = list_in_pages(
+        lambda limit, _continue=None: pages[_continue], reduce_pod, 1
+    )
+    assert resource_version == "10"
+    assert records[0] == ObjectRecord(
+        name="pod-1",
+        namespace="default",
+        uid="pod-1",
+        annotations={VERSION_PATTERN_ANNOTATION: "^v"},
+        owner_uids=(),
+        images=("app:v1",),
+        containers=(Container("node-1", "app:v1", "docker-pullable://app@sha256:1"),),
+    )
+    assert [record.uid for record in records] == ["pod-1", "pod-2"]
+
+
+def test_check_resources_looks_up_each_image_once_and_preserves_order(monkeypatch):
+    lookups = []
+
+    def fake_get_newest_tag(image: ImageRef, match_pattern: str = ""):
+        lookups.append(str(image))
+        time.sleep(0.01)
+        return parse("2")
+
+    monkeypatch.setattr(checker, "get_newest_tag", fake_get_newest_tag)
+    resources = {
+        Resource("Pod", name, name, "", frozenset({"nginx:1"})): []
+        for name in ["d", "c", "b", "a"]
+    }
+    assert [
+        str(notification)
+        for notification in checker.check_resources(resources, workers=4)
+    ] == ["Newer tag available for nginx:1 -> 2"] * 4
+    assert lookups == ["nginx"]
+
+
+def test_clusters_share_lookups_and_tag_notifications(monkeypatch):
+    lookups = []
+
+    def fake_get_newest_tag(image: ImageRef, match_pattern: str = ""):
+        lookups.append(str(image))
+        return parse("2")
+
+    monkeypatch.setattr(checker, "get_newest_tag", fake_get_newest_tag)
+    resources = {
+        Resource("Pod", "a", cluster, "", frozenset({"nginx:1"}), cluster): []
+        for cluster in ["staging", "production"]
+    }
+    assert [
+        str(notification) for notification in checker.check_resources(resources)
+    ] == [
+        "[production] Newer tag available for nginx:1 -> 2",
+        "[staging] Newer tag available for nginx:1 -> 2",
+    ]
+    assert lookups == ["nginx"]
+
+
+def test_stream_check_resources_emits_before_discovery_finishes(monkeypatch):
+    lookups = []
+    monkeypatch.setattr(
+        checker,
+        "get_newest_tag",
+        lambda image, match_pattern="": lookups.append(str(image)) or parse("2"),
+    )
+    discovered = []
+
+    def discover():
+        for name in ["a", "b", "c"]:
+            discovered.append(name)
+            yield Resource("Pod", name, name, "", frozenset({"nginx:1"})), []
+
+    checked = []
+    for resource, notifications, _ in checker.stream_check_resources(
+        discover(), workers=2, max_pending=1
+    ):
+        checked.append((resource.name, list(discovered)))
+        assert [str(n) for n in notifications] == [
+            "Newer tag available for nginx:1 -> 2"
+        ]
+    assert checked == [("a", ["a"]), ("b", ["a", "b"]), ("c", ["a", "b", "c"])]
+    assert lookups == ["nginx"]
+
+
+def test_lookups_start_before_a_single_cluster_has_been_listed(monkeypatch):
+    monkeypatch.setattr("version_checker.k8s.snapshot._raw_lists", False)
+    events = []
+    looked_up = threading.Event()
+
+    def fake_get_newest_tag(image: ImageRef, match_pattern: str = ""):
+        events.append("looked up {image}".format(image=image))
+        looked_up.set()
+        return parse("2")
+
+    monkeypatch.setattr(checker, "get_newest_tag", fake_get_newest_tag)
+
+    def pod(name: str):
+        return V1Pod(
+            metadata=V1ObjectMeta(name=name, uid=name),
+            spec=V1PodSpec(containers=[V1Container(name="app", image="nginx:1")]),
+            status=V1PodStatus(),
+        )
+
+    def list_pods(limit=None, _continue=None):
+        if _continue is None:
+            return V1PodList(metadata=V1ListMeta(_continue="2"), items=[pod("a")])
+        # The last page only arrives once the first page's pod has been looked up
+        looked_up.wait(timeout=5)
+        events.append("listed pods")
+        return V1PodList(metadata=V1ListMeta(resource_version="1"), items=[pod("b")])
+
+    def empty_list_fn(limit=None, _continue=None):
+        return V1PodList(metadata=V1ListMeta(), items=[])
+
+    clusters = {
+        "": [
+            K8sFetcherFunctions(
+                get_deployment_fn=empty_list_fn,
+                get_pods_fn=list_pods,
+                get_replica_set_fn=empty_list_fn,
+                get_stateful_set_fn=empty_list_fn,
+                get_daemon_set_fn=empty_list_fn,
+                get_cronjob_fn=empty_list_fn,
+            )
+        ]
+    }
+    checked = [
+        resource.name
+        for resource, _, _ in checker.stream_check_resources(
+            iter_cluster_resources(clusters, max_api_requests=2, max_queued=1),
+            workers=2,
+            max_pending=1,
+        )
+    ]
+    assert events == ["looked up nginx", "listed pods"]
+    assert checked == ["a", "b"]
+
+
+def test_lookup_plan_deduplicates_image_references():
+    resources = {
+        Resource("Deployment", "a", "1", "", frozenset({"nginx:1.17", "redis:5"})): [
+            Container("node-1", "nginx:1.17", "docker-pullable://nginx@sha256:1"),
+            Container("node-2", "nginx:1.17", "docker-pullable://nginx@sha256:1"),
+        ],
+        Resource("Deployment", "b", "2", "", frozenset({"nginx:1.17"})): [
+            Container("node-1", "nginx:1.17", "docker-pullable://nginx@sha256:1")
+        ],
+        Resource("Deployment", "c", "3", "^1", frozenset({"nginx:1.17"})): [],
+    }
+    plan = checker.plan_lookups(resources)
+    assert plan.tag_lookups == {
+        (parse_image_ref("nginx"), ""),
+        (parse_image_ref("redis"), ""),
+        (parse_image_ref("nginx"), "^1"),
+    }
+    assert plan.digest_lookups == {(parse_image_ref("nginx"), "1.17")}
+    assert plan.requested_lookup_count == 7
+
+
+def test_bearer_challenge_is_parsed_from_authenticate_header():
+    assert tokens.parse_bearer_challenge(
+        'Bearer realm="https://auth.docker.io/token",service="registry.docker.io",'
+        'scope="repository:library/nginx:pull"'
+    ) == (
+        tokens.BearerChallenge("https://auth.docker.io/token", "registry.docker.io"),
+        "repository:library/nginx:pull",
+    )
+
+
+def test_tokens_are_cached_per_scope_and_widened_to_registered_repositories(
+    monkeypatch
+):
+    requested_scopes = []
+
+    def fake_docker_registry_auth(realm, service, scopes, credentials=None):
+        requested_scopes.append(scopes)
+        return tokens.Token("token", time.time() + 300)
+
+    monkeypatch.setattr(tokens, "docker_registry_auth", fake_docker_registry_auth)
+    monkeypatch.setattr(tokens, "_tokens", {})
+    monkeypatch.setattr(tokens, "_repositories", {})
+    challenge = tokens.BearerChallenge("https://auth.example.com", "example")
+    tokens.register_repositories("registry-1.docker.io", ["library/a", "library/b"])
+
+    for repository in ["library/a", "library/b", "library/a"]:
+        assert (
+            tokens.get_token(
+                "registry-1.docker.io",
+                challenge,
+                tokens.repository_pull_scope(repository),
+            )
+            == "token"
+        )
+    assert requested_scopes == [
+        ["repository:library/a:pull", "repository:library/b:pull"]
+    ]
+
+
+def test_registry_cache_persists_entries_and_evicts_least_recently_used(tmp_path):
+    cache_path = str(tmp_path / "cache.json")
+    cache = RegistryCache(cache_path, default_ttl=60, max_entries=2)
+    cache.put("quay.io", "a", ["1"])
+    cache.put("quay.io", "b", ["2"])
+    assert cache.get("quay.io", "a") == ["1"]
+    cache.put("quay.io", "c", ["3"])
+    cache.save()
+
+    reloaded = RegistryCache(cache_path, default_ttl=60, max_entries=2)
+    reloaded.load()
+    assert reloaded.get("quay.io", "a") == ["1"]
+    assert reloaded.get("quay.io", "b") is None
+    assert reloaded.get("quay.io", "c") == ["3"]
+
+
+def test_registry_cache_honours_per_host_ttl(tmp_path):
+    cache = RegistryCache(
+        str(tmp_path / "cache.json"), default_ttl=60, host_ttls={"quay.io": 0}
+    )
+    cache.put("quay.io", "a", "sha256:1")
+    cache.put("k8s.gcr.io", "b", "sha256:2")
+    assert cache.get("quay.io", "a") is None
+    assert cache.get("k8s.gcr.io", "b") == "sha256:2"
+
+
+def test_registry_cache_keeps_nothing_longer_than_its_max_ttl(tmp_path):
+    cache = RegistryCache(
+        str(tmp_path / "cache.json"),
+        default_ttl=21600,
+        host_ttls={"quay.io": 86400, "k8s.gcr.io": 60},
+        max_ttl=3600,
+    )
+    assert cache.get_ttl("registry-1.docker.io") == 3600
+    assert cache.get_ttl("quay.io") == 3600
+    assert cache.get_ttl("k8s.gcr.io") == 60
+    cache.put("quay.io", "a", "sha256:1")
+    cache._entries["a"]["stored_at"] -= 3601
+    assert cache.get("quay.io", "a") is None
+    assert cache.get_expired("quay.io", "a") == "sha256:1"
+
+
+def _registry_response(method: str, status_code: int, headers: dict) -> Response:
+    response = Response()
+    response.status_code = status_code
+    response.headers.update(headers)
+    response.request = Request(method, "https://registry.example.com").prepare()
+    return response
+
+
+def test_manifest_digest_is_revalidated_with_conditional_head(monkeypatch):
+    requests_made = []
+
+    def fake_request(method, url, headers=None):
+        requests_made.append((method, headers.get("If-None-Match")))
+        return _registry_response(method, 304, {})
+
+    monkeypatch.setattr(registry, "docker_registry_api_request", fake_request)
+    cached_manifest = {"digest": "sha256:1", "etag": '"sha256:1"'}
+    assert (
+        registry.fetch_docker_tag_digest(
+            "registry.example.com", "app", "1.0", cached_manifest
+        )
+        == cached_manifest
+    )
+    assert requests_made == [("HEAD", '"sha256:1"')]
+
+
+def test_manifest_digest_falls_back_to_get_when_head_has_no_digest(monkeypatch):
+    def fake_request(method, url, headers=None):
+        response = _registry_response(
+            method,
+            200,
+            {
+                "Content-Type": "application/vnd.docker.distribution.manifest.list.v2+json",
+                "Docker-Content-Digest": "sha256:2",
+            }
+            if method == "GET"
+            else {},
+        )
+        response._content = b'{"manifests": []}'
+        return response
+
+    monkeypatch.setattr(registry, "docker_registry_api_request", fake_request)
+    monkeypatch.setattr(
+        registry,
+        "docker_registry_api_get",
+        lambda url, headers=None: fake_request("GET", url, headers),
+    )
+    assert registry.fetch_docker_tag_digest("registry.example.com", "app", "1.0") == {
+        "digest": "sha256:2",
+        "etag": '"sha256:2"',
+        "platforms": {},
+    }
+
+
+@pytest.mark.parametrize("content_type", ["", "application/json"])
+def test_manifest_digest_falls_back_to_get_when_head_has_no_manifest_type(
+    monkeypatch, content_type
+):
+    methods = []
+
+    def fake_request(method, url, headers=None):
+        methods.append(method)
+        response = _registry_response(
+            method,
+            200,
+            {"Content-Type": content_type, "Docker-Content-Digest": "sha256:2"},
+        )
+        response._content = b'{"schemaVersion": 2}'
+        return response
+
+    monkeypatch.setattr(registry, "docker_registry_api_request", fake_request)
+    monkeypatch.setattr(
+        registry,
+        "docker_registry_api_get",
+        lambda url, headers=None: fake_request("GET", url, headers),
+    )
+    assert (
+        registry.fetch_docker_tag_digest("registry.example.com", "app", "1.0")["digest"]
+        == "sha256:2"
+    )
+    assert methods == ["HEAD", "GET"]
+
+
+def test_manifest_list_is_fetched_for_the_digest_of_each_platform(monkeypatch):
+    requests_made = []
+
+    def fake_request(method, url, headers=None):
+        requests_made.append(method)
+        response = _registry_response(
+            method,
+            200,
+            {
+                "Content-Type": "application/vnd.oci.image.index.v1+json",
+                "Docker-Content-Digest": "sha256:index",
+            },
+        )
+        response._content = json.dumps(
+            {
+                "manifests": [
+                    {
+                        "digest": "sha256:amd64",
+                        "platform": {"os": "linux", "architecture": "amd64"},
+                    },
+                    {
+                        "digest": "sha256:arm64",
+                        "platform": {
+                            "os": "linux",
+                            "architecture": "arm64",
+                            "variant": "v8",
+                        },
+                    },
+                    {
+                        "digest": "sha256:attestation",
+                        "platform": {"os": "unknown", "architecture": "unknown"},
+                    },
+                ]
+            }
+        ).encode()
+        return response
+
+    monkeypatch.setattr(registry, "docker_registry_api_request", fake_request)
+    monkeypatch.setattr(
+        registry,
+        "docker_registry_api_get",
+        lambda url, headers=None: fake_request("GET", url, headers),
+    )
+    manifest = registry.fetch_docker_tag_digest("registry.example.com", "app", "1.0")
+    assert requests_made == ["HEAD", "GET"]
+    assert manifest["platforms"] == {
+        "linux/amd64": "sha256:amd64",
+        "linux/arm64/v8": "sha256:arm64",
+    }
+
+    tag_digests = registry.TagDigests(manifest["digest"], manifest["platforms"])
+    assert tag_digests.get_platform_digest("linux/arm64") == "sha256:arm64"
+    assert tag_digests.get_platform_digest("") == "sha256:index"
+    assert tag_digests.is_current("sha256:index", "linux/arm64")
+    assert tag_digests.is_current("sha256:arm64", "linux/arm64")
+    assert not tag_digests.is_current("sha256:amd64", "linux/arm64")
+    assert tag_digests.is_current("sha256:amd64")
+
+
+def test_containers_are_compared_with_the_manifest_for_their_node_platform():
+    amd64_digest, arm64_digest, old_digest, index_digest = (
+        "sha256:" + character * 64 for character in "abcd"
+    )
+
+    def pod(name: str, node: str, digest: str) -> ObjectRecord:
+        return ObjectRecord(
+            name=name,
+            namespace="default",
+            uid=name,
+            annotations={},
+            owner_uids=(),
+            images=("app:1.0",),
+            containers=(Container(node, "app:1.0", "docker-pullable://app@" + digest),),
+        )
+
+    def node(name: str, platform: str) -> ObjectRecord:
+        return ObjectRecord(
+            name=name,
+            namespace=None,
+            uid=name,
+            annotations={},
+            owner_uids=(),
+            images=(),
+            platform=platform,
+        )
+
+    snapshot = ClusterSnapshot(
+        deployments=[],
+        daemon_sets=[],
+        stateful_sets=[],
+        cron_jobs=[],
+        pods=[
+            pod("current-amd64", "amd64-node", amd64_digest),
+            pod("current-arm64", "arm64-node", arm64_digest),
+            pod("stale-arm64", "arm64-node", old_digest),
+        ],
+        replica_sets=[],
+        nodes=[node("amd64-node", "linux/amd64"), node("arm64-node", "linux/arm64")],
+    )
+    resources = get_top_level_resources(snapshot)
+    results = checker.LookupResults(
+        newest_tags={(parse_image_ref("app"), ""): parse("1.0")},
+        digests={
+            (parse_image_ref("app"), "1.0"): registry.TagDigests(
+                index_digest,
+                {"linux/amd64": amd64_digest, "linux/arm64/v8": arm64_digest},
+            )
+        },
+    )
+    notifications, _ = checker.compare_resources(resources, results)
+    assert [
+        (
+            notification.owner.name,
+            notification.container.platform,
+            notification.registry_digest,
+        )
+        for notification in notifications
+    ] == [("stale-arm64", "linux/arm64", arm64_digest)]
+
+
+@pytest.mark.parametrize(
+    "image_id,expected",
+    [
+        (
+            "docker-pullable://registry.example.com/app@sha256:" + "a" * 64,
+            ("registry.example.com/app", "sha256:" + "a" * 64),
+        ),
+        (
+            "docker.io/library/nginx@sha256:" + "b" * 64,
+            ("docker.io/library/nginx", "sha256:" + "b" * 64),
+        ),
+        ("docker://sha256:" + "c" * 64, ("", "sha256:" + "c" * 64)),
+        ("sha256:" + "d" * 64, ("", "sha256:" + "d" * 64)),
+        ("e" * 64, ("", "sha256:" + "e" * 64)),
+    ],
+)
+def test_image_ids_of_every_container_runtime_are_parsed(image_id, expected):
+    assert registry.parse_image_id(image_id) == expected
+
+
+def test_pod_containers_include_init_containers_and_skip_those_without_images():
+    status = {
+        "initContainerStatuses": [
+            {"name": "init", "image": "init:1", "imageID": "init@sha256:1"}
+        ],
+        "containerStatuses": [
+            {"name": "app", "image": "app:1", "imageID": ""},
+            {"name": "sidecar", "image": "sidecar:1", "imageID": "sidecar@sha256:2"},
+        ],
+    }
+    pod = {
+        "metadata": {"name": "pod", "uid": "pod"},
+        "spec": {
+            "nodeName": "node-1",
+            "initContainers": [{"name": "init", "image": "init:1"}],
+            "containers": [{"name": "app", "image": "app:1"}],
+        },
+    }
+    record = reduce_raw_pod({**pod, "status": status})
+    assert record.images == ("init:1", "app:1")
+    assert record.containers == (
+        Container("node-1", "sidecar:1", "sidecar@sha256:2"),
+        Container("node-1", "init:1", "init@sha256:1"),
+    )
+    assert reduce_raw_pod({**pod, "status": None}).containers == ()
+    assert (
+        reduce_pod(
+            V1Pod(
+                metadata=V1ObjectMeta(name="pending", uid="pending"),
+                spec=V1PodSpec(containers=[V1Container(name="app", image="app:1")]),
+                status=V1PodStatus(phase="Pending"),
+            )
+        ).containers
+        == ()
+    )
+
+
+def test_one_bad_container_does_not_stop_the_others_being_checked():
+    resource = Resource("Pod", "pod", "pod", "", frozenset())
+    containers = [
+        Container("node-1", "app:1", "not an image id"),
+        Container("node-1", "untagged", "untagged@sha256:" + "0" * 64),
+        Container("node-1", "app:1", "app@sha256:" + "1" * 64),
+    ]
+    results = checker.LookupResults(
+        newest_tags={},
+        digests={
+            (parse_image_ref("app"), "1"): registry.TagDigests("sha256:" + "2" * 64)
+        },
+    )
+    (
+        notifications,
+        unchecked,
+    ) = checker.check_resource_containers_for_updated_image_digests(
+        resource, containers, results
+    )
+    assert [notification.container for notification in notifications] == [containers[2]]
+    assert unchecked == {"out-of-date|app:1|node-1|", "out-of-date|untagged|node-1|"}
+
+
+def test_failed_lookups_are_reported_as_missing_results():
+    def failing_lookup(image: str, tag: str):
+        raise Exception("manifest unknown")
+
+    assert (
+        checker.lookup_within_budget(
+            failing_lookup, parse_image_ref("registry.example.com/app"), "1.0", 1
+        )
+        is None
+    )
+
+
+def test_nodes_are_reduced_to_their_platform():
+    assert (
+        reduce_raw_node(
+            {
+                "metadata": {"name": "node-1", "uid": "node-1"},
+                "status": {
+                    "nodeInfo": {"operatingSystem": "linux", "architecture": "arm64"}
+                },
+            }
+        ).platform
+        == "linux/arm64"
+    )
+    assert reduce_raw_node({"metadata": {"name": "node-2"}}).platform == ""
+
+
+def test_rate_limited_requests_are_retried_after_retry_after(monkeypatch):
+    # Budgets are kept per host for the whole process, so they are put back afterwards
+    monkeypatch.setattr(ratelimit, "_budgets", {})
+    monkeypatch.setattr(ratelimit, "_skipped", {})
+    ratelimit.configure_rate_limits(low_budget=20)
+    responses = [
+        _registry_response("GET", 429, {"Retry-After": "0"}),
+        _registry_response("GET", 200, {"RateLimit-Remaining": "76;w=21600"}),
+    ]
+    sleeps = []
+
+    class FakeSession(object):
+        def request(self, method, url, headers=None):
+            return responses.pop(0)
+
+    monkeypatch.setattr(registry, "get_session", lambda url: FakeSession())
+    monkeypatch.setattr(ratelimit.time, "sleep", sleeps.append)
+    response = registry.send_registry_request(
+        "GET", "https://registry.example.com/v2/app/tags/list", {}
+    )
+    assert response.status_code == 200
+    assert responses == []
+    assert ratelimit.has_budget("registry.example.com")
+    assert ratelimit.parse_rate_limit_header("76;w=21600") == (76, 21600.0)
+
+
+def test_low_budget_skips_images_without_running_containers(monkeypatch):
+    monkeypatch.setattr(ratelimit, "_budgets", {})
+    monkeypatch.setattr(ratelimit, "_skipped", {})
+    ratelimit.configure_rate_limits(low_budget=20)
+    ratelimit.record_response(
+        "registry.example.com",
+        _registry_response("GET", 200, {"RateLimit-Remaining": "5;w=21600"}),
+        attempt=1,
+    )
+    lookups = []
+
+    def fake_get_newest_tag(image: ImageRef, match_pattern: str = ""):
+        lookups.append(str(image))
+        return parse("2")
+
+    monkeypatch.setattr(checker, "get_newest_tag", fake_get_newest_tag)
+    monkeypatch.setattr(
+        checker,
+        "get_docker_tag_digests",
+        lambda image, tag: registry.TagDigests("sha256:1"),
+    )
+    resources = {
+        Resource(
+            "CronJob", "idle", "1", "", frozenset({"registry.example.com/idle:1"})
+        ): [],
+        Resource(
+            "Pod", "running", "2", "", frozenset({"registry.example.com/running:1"})
+        ): [
+            Container(
+                "node-1",
+                "registry.example.com/running:1",
+                "docker-pullable://registry.example.com/running@sha256:1",
+            )
+        ],
+    }
+    results = checker.resolve_lookups(resources)
+    assert lookups == ["registry.example.com/running"]
+    assert (
+        results.newest_tags[(parse_image_ref("registry.example.com/idle"), "")] is None
+    )
+    assert ratelimit._skipped == {"registry.example.com": ["registry.example.com/idle"]}
+
+
+@pytest.mark.parametrize("remaining", ["5", "500"])
+def test_streamed_lookups_skipped_for_idle_resources_are_made_for_running_ones(
+    monkeypatch, remaining
+):
+    monkeypatch.setattr(ratelimit, "_budgets", {})
+    monkeypatch.setattr(ratelimit, "_skipped", {})
+    ratelimit.configure_rate_limits(low_budget=20)
+    ratelimit.record_response(
+        "registry.example.com",
+        _registry_response("GET", 200, {"RateLimit-Remaining": remaining + ";w=21600"}),
+        attempt=1,
+    )
+    tag_lookups = []
+
+    def fake_get_newest_tag(image: ImageRef, match_pattern: str = ""):
+        tag_lookups.append(str(image))
+        return parse("2")
+
+    monkeypatch.setattr(checker, "get_newest_tag", fake_get_newest_tag)
+    monkeypatch.setattr(
+        checker,
+        "get_docker_tag_digests",
+        lambda image, tag: registry.TagDigests("sha256:1"),
+    )
+    image = "registry.example.com/app:1"
+    # The cron job arrives first, so the tag lookup is started without priority
+    resources = [
+        (Resource("CronJob", "idle", "1", "", frozenset({image})), []),
+        (
+            Resource("Pod", "running", "2", "", frozenset({image})),
+            [
+                Container(
+                    "node-1",
+                    image,
+                    "docker-pullable://registry.example.com/app@sha256:1",
+                )
+            ],
+        ),
+    ]
+    checked = list(checker.stream_check_resources(iter(resources), workers=1))
+    # Whether or not it was skipped for the cron job, the tag is only looked up once
+    assert tag_lookups == ["registry.example.com/app"]
+    assert [
+        [str(notification) for notification in notifications]
+        for _, notifications, _ in checked
+    ][1] == ["Newer tag available for registry.example.com/app:1 -> 2"]
+
+
+def test_timing_report_summarises_latency_percentiles(tmpdir):
+    timing.reset_timings()
+    for milliseconds in range(1, 101):
+        timing.record_timing("registry", "quay.io manifests", milliseconds / 1000)
+    with timing.timed("phases", "k8s listing"):
+        pass
+    report_path = str(tmpdir.join("report.json"))
+    timing.write_run_report(report_path, {"notifications": 0})
+    with open(report_path) as report_file:
+        report = json.load(report_file)
+    assert report["notifications"] == 0
+    assert report["timings"]["registry"]["quay.io manifests"] == {
+        "count": 100,
+        "total_seconds": pytest.approx(5.05),
+        "p50_seconds": 0.05,
+        "p95_seconds": 0.095,
+    }
+    assert report["timings"]["phases"]["k8s listing"]["count"] == 1
+    assert (
+        registry.get_request_timing_name("https://quay.io/v2/org/app/manifests/1.0")
+        == "quay.io manifests"
+    )
+
+
+def _profiled_worker_function():
+    return sum(range(1000))
+
+
+def test_profiler_includes_worker_threads(tmpdir):
+    profile_path = str(tmpdir.join("profile.out"))
+    profiler = timing.ThreadProfiler()
+    profiler.start()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert (
+            list(executor.map(lambda _: _profiled_worker_function(), range(4)))
+            == [499500] * 4
+        )
+    profiler.stop(profile_path)
+    assert any(
+        function_name == "_profiled_worker_function"
+        for _, _, function_name in pstats.Stats(profile_path).stats
+    )
+
+
+def test_profiler_leaves_out_threads_still_running_when_it_stops(tmpdir):
+    profile_path = str(tmpdir.join("profile.out"))
+    profiler = timing.ThreadProfiler()
+    profiler.start()
+    stopped = threading.Event()
+
+    def run_after_stop():
+        stopped.wait()
+        _profiled_worker_function()
+
+    thread = threading.Thread(target=run_after_stop)
+    thread.start()
+    try:
+        profiler.stop(profile_path)
+    finally:
+        stopped.set()
+        thread.join()
+    assert not any(
+        function_name in ("run_after_stop", "_profiled_worker_function")
+        for _, _, function_name in pstats.Stats(profile_path).stats
+    )
+
+
+def test_resource_metrics_are_updated_only_for_checked_resources():
+    stale = Resource(
+        "Deployment", "web", "metrics-1", "", frozenset({"nginx:1"}), "", "default"
+    )
+    current = Resource(
+        "Deployment", "api", "metrics-2", "", frozenset({"app:1"}), "", "default"
+    )
+    container = Container("node-1", "app:1", "docker-pullable://app@sha256:1")
+
+    def sample(gauge: str, resource: Resource, image: str):
+        return metrics.REGISTRY.get_sample_value(
+            gauge,
+            {
+                "cluster": "",
+                "namespace": "default",
+                "kind": "Deployment",
+                "resource": resource.name,
+                "image": image,
+            },
+        )
+
+    metrics.update_resource_metrics(
+        [stale, current],
+        [
+            NewTagNotification("nginx", "1", parse("2"), owner=stale),
+            OutOfDateContainerNotification(current, container, "sha256:2"),
+            OutOfDateContainerNotification(current, container, "sha256:2"),
+        ],
+    )
+    assert sample("version_checker_newer_tag_available", stale, "nginx:1") == 1
+    assert sample("version_checker_out_of_date_containers", current, "app:1") == 2
+
+    metrics.update_resource_metrics([current], [])
+    assert sample("version_checker_newer_tag_available", stale, "nginx:1") == 1
+    assert sample("version_checker_out_of_date_containers", current, "app:1") is None
+
+    metrics.remove_missing_resources([current])
+    assert sample("version_checker_newer_tag_available", stale, "nginx:1") is None
+
+
+def test_notification_state_only_reports_new_and_resolved_findings(tmpdir):
+    web = Resource("Deployment", "web", "state-1", "", frozenset({"nginx:1"}))
+    api = Resource("Deployment", "api", "state-2", "", frozenset({"app:1"}))
+    container = Container("node-1", "app:1", "docker-pullable://app@sha256:1")
+    new_tag = NewTagNotification("nginx", "1", parse("2"), owner=web)
+    out_of_date = OutOfDateContainerNotification(api, container, "sha256:2")
+    state_path = str(tmpdir.join("state.json"))
+
+    state = NotificationState(state_path)
+    state.load()
+    assert state.diff([web, api], [new_tag, out_of_date]) == [new_tag, out_of_date]
+    state.save()
+
+    state = NotificationState(state_path)
+    state.load()
+    assert state.diff([web, api], [new_tag, out_of_date]) == []
+    assert [str(notification) for notification in state.diff([api], [])] == [
+        "Resolved: {finding}".format(finding=out_of_date)
+    ]
+    assert [str(notification) for notification in state.resolve_missing([api])] == [
+        "Resolved: Newer tag available for nginx:1 -> 2"
+    ]
+
+
+def test_notification_state_only_resolves_missing_resources_that_were_listed(tmpdir):
+    def deployment(cluster, namespace):
+        return Resource(
+            "Deployment",
+            "web",
+            "{cluster}-{namespace}".format(cluster=cluster, namespace=namespace),
+            "",
+            frozenset({"nginx:1"}),
+            cluster,
+            namespace,
+        )
+
+    resources = [
+        deployment("prod", "a"),
+        deployment("prod", "b"),
+        deployment("staging", "a"),
+    ]
+    state_path = str(tmpdir.join("state.json"))
+    state = NotificationState(state_path)
+    state.diff(
+        resources,
+        [
+            NewTagNotification("nginx", "1", parse("2"), resource.cluster, resource)
+            for resource in resources
+        ],
+    )
+    state.save()
+
+    state = NotificationState(state_path)
+    state.load()
+    # Only namespace a of prod was listed, and its deployment is still there
+    assert state.resolve_missing(resources[:1], get_listed_scope({"prod": ["a"]})) == []
+    assert [
+        notification.description
+        for notification in state.resolve_missing(
+            resources[:1], get_listed_scope({"prod": [], "dev": []})
+        )
+    ] == ["[prod] Newer tag available for nginx:1 -> 2"]
+    assert len(state.resolve_missing([])) == 2
+
+
+def test_notification_state_keeps_findings_whose_lookups_failed(tmpdir):
+    web = Resource("Deployment", "web", "state-1", "", frozenset({"nginx:1"}))
+    container = Container("node-1", "app:1", "app@sha256:" + "1" * 64)
+    state_path = str(tmpdir.join("state.json"))
+    found = checker.LookupResults(
+        newest_tags={(parse_image_ref("nginx"), ""): parse("2")},
+        digests={
+            (parse_image_ref("app"), "1"): registry.TagDigests("sha256:" + "2" * 64)
+        },
+    )
+    failed = checker.LookupResults(
+        newest_tags={(parse_image_ref("nginx"), ""): None},
+        digests={(parse_image_ref("app"), "1"): None},
+    )
+
+    state = NotificationState(state_path)
+    notifications, unchecked = checker.compare_resources({web: [container]}, found)
+    assert len(state.diff([web], notifications, unchecked)) == 2
+    state.save()
+
+    state = NotificationState(state_path)
+    state.load()
+    notifications, unchecked = checker.compare_resources({web: [container]}, failed)
+    assert notifications == []
+    assert state.diff([web], notifications, unchecked) == []
+    state.save()
+
+    state = NotificationState(state_path)
+    state.load()
+    notifications, unchecked = checker.compare_resources({web: [container]}, found)
+    assert state.diff([web], notifications, unchecked) == []
+
+
+def test_dispatcher_batches_retries_and_bounds_notifications(monkeypatch):
+    monkeypatch.setattr(notification, "batch_linger_seconds", 0.05)
+    monkeypatch.setattr(notification, "delivery_backoff_seconds", 0)
+    batches = []
+
+    class FlakySink(notification.NotificationSink):
+        failures = 1
+
+        def send(self, notifications):
+            if self.failures:
+                self.failures -= 1
+                raise Exception("Webhook unavailable")
+            batches.append([str(n) for n in notifications])
+
+    dispatcher = notification.NotificationDispatcher(
+        [FlakySink()], batch_size=2, max_queued=3
+    )
+    dispatcher.submit(
+        [NewTagNotification("nginx", str(tag), parse("9")) for tag in range(4)]
+    )
+    dispatcher.start()
+    dispatcher.close(timeout=5)
+    assert batches == [
+        [
+            "Newer tag available for nginx:0 -> 9",
+            "Newer tag available for nginx:1 -> 9",
+        ],
+        ["Newer tag available for nginx:2 -> 9"],
+    ]
+    assert dispatcher.dropped == 1
+
+
+def test_dispatcher_counts_drops_from_every_checking_thread():
+    dispatcher = notification.NotificationDispatcher([], max_queued=1)
+    notifications = [NewTagNotification("nginx", "1", parse("2"))] * 1000
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for _ in range(8):
+            executor.submit(dispatcher.submit, notifications)
+    assert dispatcher.dropped == 8 * 1000 - 1
+
+
+def test_webhooks_are_not_sent_through_registry_sessions():
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(
+                json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            )
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    registry_requests = []
+
+    class RegistryAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            registry_requests.append(request.url)
+            return super().send(request, **kwargs)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # As under --record or --replay, where registry sessions record or redirect what they send
+        configure_sessions(2, RegistryAdapter)
+        notification.WebhookSink(
+            "http://127.0.0.1:{port}/hook".format(port=server.server_address[1])
+        ).send([NewTagNotification("nginx", "1", "2")])
+    finally:
+        configure_sessions(4)
+        server.shutdown()
+        server.server_close()
+    assert received[0]["notifications"][0]["message"] == (
+        "Newer tag available for nginx:1 -> 2"
+    )
+    assert registry_requests == []
+
+
+def test_notifications_and_sinks_must_implement_their_abstract_methods():
+    with pytest.raises(TypeError):
+        notification.NotificationSink()
+    with pytest.raises(TypeError):
+        notification.Notification()
+
+
+def test_newest_tag_is_found_in_one_pass_over_matching_tags():
+    assert find_newest_tag(
+        iter(["1.2", "latest", "1.10", "v2.0-amd64", "1.9"]), "^1"
+    ) == parse("1.10")
+
+
+def test_tag_listing_follows_link_and_last_pagination(monkeypatch):
+    pages = {
+        "https://r.example.com/v2/app/tags/list?n=2": (
+            ["1", "2"],
+            {"Link": '</v2/app/tags/list?n=2&last=2>; rel="next"'},
+        ),
+        "https://r.example.com/v2/app/tags/list?n=2&last=2": (["3", "4"], {}),
+        "https://r.example.com/v2/app/tags/list?n=2&last=4": (["5"], {}),
+    }
+
+    def fake_get(url, headers=None):
+        tags, headers = pages[url]
+        response = _registry_response("GET", 200, headers)
+        response._content = json.dumps({"tags": tags}).encode()
+        return response
+
+    monkeypatch.setattr(registry, "docker_registry_api_get", fake_get)
+    assert list(registry.iter_docker_registry_tags("r.example.com", "app", 2)) == [
+        "1",
+        "2",
+        "3",
+        "4",
+        "5",
+    ]
+
+
+def test_tag_listing_continues_after_a_full_page_without_a_link(monkeypatch):
+    pages = {
+        "https://r.example.com/v2/app/tags/list?n=2": ["1", "2"],
+        "https://r.example.com/v2/app/tags/list?n=2&last=2": ["3", "4"],
+        "https://r.example.com/v2/app/tags/list?n=2&last=4": [],
+    }
+    requested_urls = []
+
+    def fake_get(url, headers=None):
+        requested_urls.append(url)
+        response = _registry_response("GET", 200, {})
+        response._content = json.dumps({"tags": pages[url]}).encode()
+        return response
+
+    monkeypatch.setattr(registry, "docker_registry_api_get", fake_get)
+    assert list(registry.iter_docker_registry_tags("r.example.com", "app", 2)) == [
+        "1",
+        "2",
+        "3",
+        "4",
+    ]
+    assert requested_urls == list(pages)
+
+
+def test_tag_listing_stops_when_registry_ignores_pagination(monkeypatch):
+    requested_urls = []
+
+    def fake_get(url, headers=None):
+        requested_urls.append(url)
+        response = _registry_response("GET", 200, {})
+        response._content = json.dumps({"tags": ["1", "2"]}).encode()
+        return response
+
+    monkeypatch.setattr(registry, "docker_registry_api_get", fake_get)
+    assert list(registry.iter_docker_registry_tags("r.example.com", "app", 2)) == [
+        "1",
+        "2",
+    ]
+    assert len(requested_urls) == 2
+
+
+def test_kind_watcher_applies_watch_events_and_relists_when_expired(monkeypatch):
+    list_responses = [
+        V1PodList(
+            metadata=V1ListMeta(resource_version="1"),
+            items=[_owned_object(V1Pod, "pod-1"), _owned_object(V1Pod, "pod-2")],
+        ),
+        V1PodList(
+            metadata=V1ListMeta(resource_version="5"),
+            items=[_owned_object(V1Pod, "pod-3")],
+        ),
+    ]
+    streamed_from = []
+
+    class FakeWatch(object):
+        def __init__(self, return_type=None):
+            pass
+
+        def stream(self, func, resource_version=None, timeout_seconds=None):
+            streamed_from.append(resource_version)
+            if resource_version == "1":
+                added = _owned_object(V1Pod, "pod-4")
+                added.metadata.resource_version = "2"
+                deleted = _owned_object(V1Pod, "pod-1")
+                deleted.metadata.resource_version = "3"
+                yield {"type": "ADDED", "object": added, "raw_object": {}}
+                yield {"type": "DELETED", "object": deleted, "raw_object": {}}
+            else:
+                assert [pod.uid for pod in watcher.items()] == ["pod-2", "pod-4"]
+                yield {"type": "ERROR", "object": None, "raw_object": {"code": 410}}
+
+        def stop(self):
+            pass
+
+    monkeypatch.setattr(k8s_watch.watch, "Watch", FakeWatch)
+    watcher = k8s_watch.KindWatcher(
+        "pods",
+        lambda **kwargs: list_responses.pop(0),
+        "V1Pod",
+        reduce_replica_set,
+        reduce_raw_replica_set,
+        threading.Event(),
+    )
+    watcher._watch_from(watcher._list())
+    assert streamed_from == ["1", "3"]
+    watcher._list()
+    assert [pod.uid for pod in watcher.items()] == ["pod-3"]
+    assert watcher.changed.is_set()
+
+
+def test_snapshot_lists_every_namespace_concurrently_within_request_cap():
+    in_flight = []
+    peak_in_flight = []
+    lock = threading.Lock()
+
+    def fake_list_fn(namespace: str):
+        def list_fn(limit=None, _continue=None):
+            with lock:
+                in_flight.append(namespace)
+                peak_in_flight.append(len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.remove(namespace)
+            return V1PodList(
+                metadata=V1ListMeta(resource_version="1"),
+                items=[
+                    V1Pod(
+                        metadata=V1ObjectMeta(uid=namespace),
+                        spec=V1PodSpec(containers=[]),
+                        status=V1PodStatus(),
+                    )
+                ],
+            )
+
+        return list_fn
+
+    namespaces = ["a", "b", "c"]
+
+    def empty_list_fn(limit=None, _continue=None):
+        return V1PodList(metadata=V1ListMeta(), items=[])
+
+    snapshot = take_snapshot(
+        [
+            K8sFetcherFunctions(
+                get_deployment_fn=empty_list_fn,
+                get_pods_fn=fake_list_fn(namespace),
+                get_replica_set_fn=empty_list_fn,
+                get_stateful_set_fn=empty_list_fn,
+                get_daemon_set_fn=empty_list_fn,
+                get_cronjob_fn=empty_list_fn,
+            )
+            for namespace in namespaces
+        ],
+        max_api_requests=2,
+    )
+    assert [pod.uid for pod in snapshot.pods] == namespaces
+    assert max(peak_in_flight) <= 2
+
+
+def test_registry_lookups_against_fake_registry():
+    manifest_type = "application/vnd.docker.distribution.manifest.v2+json"
+    fake_registry = FakeRegistry(
+        {
+            "registry.example.com": {
+                "app": {
+                    "tags": ["1.0", "1.1", "latest", "2.0", "1.2"],
+                    "manifests": {
+                        "1.0": {"digest": "sha256:10", "media_type": manifest_type}
+                    },
+                }
+            }
+        }
+    )
+    fake_registry.start()
+    try:
+        configure_sessions(2, redirecting_adapter_factory(fake_registry.url))
+        assert registry.get_newest_tag(
+            parse_image_ref("registry.example.com/app")
+        ) == parse("2.0")
+        assert list(
+            registry.iter_docker_registry_tags("registry.example.com", "app", 2)
+        ) == ["1.0", "1.1", "latest", "2.0", "1.2"]
+        assert (
+            registry.get_docker_tag_digest(
+                parse_image_ref("registry.example.com/app"), "1.0"
+            )
+            == "sha256:10"
+        )
+    finally:
+        configure_sessions(4)
+        fake_registry.stop()
+    # One unauthenticated request, then one for all the tags and three for pages of two
+    assert fake_registry.request_counts["registry.example.com tags"] == 5
+    assert fake_registry.request_counts["registry.example.com auth"] == 1
+
+
+def test_lookups_go_through_mirrors_and_fall_back_to_upstream(monkeypatch):
+    # Challenges and tokens from other fake registries don't apply to this one
+    monkeypatch.setattr(tokens, "_challenges", {})
+    monkeypatch.setattr(tokens, "_tokens", {})
+    manifest_type = "application/vnd.docker.distribution.manifest.v2+json"
+    digest = "sha256:{digest}".format(digest="a" * 64)
+    fake_registry = FakeRegistry(
+        {
+            "mirror.example.com": {
+                "hub/library/nginx": {
+                    "tags": ["1.16", "1.17"],
+                    "manifests": {
+                        "1.17": {"digest": digest, "media_type": manifest_type}
+                    },
+                }
+            },
+            "registry-1.docker.io": {
+                "library/redis": {"tags": ["5.0"], "manifests": {}},
+                "library/nginx": {"tags": ["1.16", "1.17"], "manifests": {}},
+            },
+        }
+    )
+    fake_registry.start()
+    try:
+        configure_sessions(2, redirecting_adapter_factory(fake_registry.url))
+        mirrors.configure_mirrors({"docker.io": ["mirror.example.com/hub"]})
+        assert registry.get_newest_tag(parse_image_ref("nginx")) == parse("1.17")
+        assert (
+            registry.get_docker_tag_digest(parse_image_ref("nginx"), "1.17") == digest
+        )
+        # The mirror doesn't have redis, so it is looked up upstream
+        assert registry.get_newest_tag(parse_image_ref("redis")) == parse("5.0")
+        assert mirrors.get_source_report() == {
+            "registry-1.docker.io": {
+                "mirror.example.com/hub": 2,
+                "registry-1.docker.io": 1,
+            }
+        }
+    finally:
+        configure_sessions(4)
+        mirrors.configure_mirrors({})
+        fake_registry.stop()
+    assert fake_registry.request_counts["registry-1.docker.io tags"] == 2
+    assert fake_registry.request_counts["registry-1.docker.io manifests"] == 0
+
+
+def test_stale_mirror_results_are_confirmed_upstream(monkeypatch, tmp_path):
+    monkeypatch.setattr(tokens, "_challenges", {})
+    monkeypatch.setattr(tokens, "_tokens", {})
+    manifest_type = "application/vnd.docker.distribution.manifest.v2+json"
+    current_digest = "sha256:{digest}".format(digest="a" * 64)
+    stale_digest = "sha256:{digest}".format(digest="b" * 64)
+    fake_registry = FakeRegistry(
+        {
+            "mirror.example.com": {
+                "library/nginx": {
+                    "tags": ["1.16"],
+                    "manifests": {
+                        "1.16": {"digest": stale_digest, "media_type": manifest_type}
+                    },
+                }
+            },
+            "registry-1.docker.io": {
+                "library/nginx": {
+                    "tags": ["1.16", "1.17"],
+                    "manifests": {
+                        "1.16": {"digest": current_digest, "media_type": manifest_type}
+                    },
+                }
+            },
+        }
+    )
+    cache = RegistryCache(str(tmp_path / "cache.json"), default_ttl=60)
+    cache.put(
+        "registry-1.docker.io", "newest:registry-1.docker.io/library/nginx:", "1.17"
+    )
+    cache.put(
+        "registry-1.docker.io",
+        "digest:registry-1.docker.io/library/nginx:1.16",
+        {"digest": current_digest, "etag": '"{digest}"'.format(digest=current_digest)},
+    )
+    # Expire the cached results, so that they are revalidated
+    for entry in cache._entries.values():
+        entry["stored_at"] = 0
+    fake_registry.start()
+    try:
+        configure_sessions(2, redirecting_adapter_factory(fake_registry.url))
+        configure_cache(cache)
+        mirrors.configure_mirrors({"registry-1.docker.io": ["mirror.example.com"]})
+        assert registry.get_newest_tag(parse_image_ref("nginx")) == parse("1.17")
+        assert (
+            registry.get_docker_tag_digest(parse_image_ref("nginx"), "1.16")
+            == current_digest
+        )
+        assert mirrors.get_source_report() == {
+            "registry-1.docker.io": {"registry-1.docker.io": 2}
+        }
+    finally:
+        configure_sessions(4)
+        configure_cache(None)
+        mirrors.configure_mirrors({})
+        fake_registry.stop()
+
+
+@pytest.mark.parametrize(
+    "newest_tag, previous_tag, current",
+    [
+        ("1.2", None, True),
+        ("1.2", "1.1", True),
+        ("1.2", "1.2", True),
+        ("1.1", "1.2", False),
+        ("", None, False),
+        ("1.1", "latest", True),
+    ],
+)
+def test_mirror_newest_tags_older_than_before_are_stale(
+    newest_tag, previous_tag, current
+):
+    assert registry.is_newest_tag_current(newest_tag, previous_tag) == current
+
+
+def test_registry_credentials_are_read_from_docker_config(tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(
+        json.dumps(
+            {
+                "auths": {
+                    "https://index.docker.io/v1/": {"auth": "dXNlcjpwYXNzOndvcmQ="},
+                    "mirror.example.com": {"username": "robot", "password": "secret"},
+                }
+            }
+        )
+    )
+    assert tokens.load_docker_credentials(str(config_path)) == {
+        "registry-1.docker.io": ("user", "pass:word"),
+        "mirror.example.com": ("robot", "secret"),
+    }
+
+
+def test_basic_auth_challenges_are_answered_with_credentials(monkeypatch):
+    requests_made = []
+
+    def fake_send(method, url, headers):
+        requests_made.append(headers.get("authorization"))
+        if headers.get("authorization"):
+            return _registry_response(method, 200, {})
+        return _registry_response(
+            method, 401, {"WWW-Authenticate": 'Basic realm="mirror"'}
+        )
+
+    monkeypatch.setattr(registry, "send_registry_request", fake_send)
+    tokens.configure_credentials({"mirror.example.com": ("robot", "secret")})
+    try:
+        for _ in range(2):
+            response = registry.docker_registry_api_get(
+                "https://mirror.example.com/v2/library/nginx/tags/list"
+            )
+            assert response.status_code == 200
+    finally:
+        tokens.configure_credentials({})
+    # Once challenged, the host is sent credentials up front
+    assert requests_made == [None, "Basic cm9ib3Q6c2VjcmV0", "Basic cm9ib3Q6c2VjcmV0"]
+
+
+def test_recorder_builds_registry_fixture_from_responses():
+    recorder = Recorder()
+    tags_response = _registry_response("GET", 200, {})
+    tags_response.request.url = "https://quay.io/v2/org/app/tags/list?n=2"
+    tags_response._content = json.dumps({"tags": ["1.0", "1.1"]}).encode()
+    manifest_response = _registry_response(
+        "HEAD",
+        200,
+        {
+            "Content-Type": "application/vnd.oci.image.index.v1+json",
+            "Docker-Content-Digest": "sha256:1",
+        },
+    )
+    manifest_response.request.url = "https://quay.io/v2/org/app/manifests/1.0"
+    recorder.record_registry_response(tags_response)
+    recorder.record_registry_response(manifest_response)
+    recorder.record_object("pods", {"metadata": {"uid": "pod-1"}})
+    assert recorder.hosts == {
+        "quay.io": {
+            "org/app": {
+                "tags": ["1.0", "1.1"],
+                "manifests": {
+                    "1.0": {
+                        "digest": "sha256:1",
+                        "media_type": "application/vnd.oci.image.index.v1+json",
+                    }
+                },
+            }
+        }
+    }
+    assert recorder.kinds["pods"] == {"pod-1": {"metadata": {"uid": "pod-1"}}}
+
+
+@pytest.mark.parametrize("raw", [True, False])
+def test_snapshot_is_listed_from_fake_api_server_in_pages(raw):
+    kinds = {
+        "pods": [
+            {
+                "metadata": {
+                    "name": "pod-{index}".format(index=index),
+                    "namespace": "default",
+                    "uid": "pod-{index}".format(index=index),
+                },
+                "spec": {
+                    "nodeName": "node-1",
+                    "containers": [{"name": "app", "image": "app:1"}],
+                },
+                "status": {
+                    "containerStatuses": [
+                        {
+                            "name": "app",
+                            "image": "app:1",
+                            "imageID": "docker-pullable://app@sha256:1",
+                            "ready": True,
+                            "restartCount": 0,
+                        }
+                    ]
+                },
+            }
+            for index in range(5)
+        ]
+    }
+    api_server = FakeApiServer(kinds)
+    api_server.start()
+    try:
+        configure_listing(2, raw)
+        snapshot = take_snapshot(
+            [get_api_functions(api_client=get_fake_api_client(api_server))]
+        )
+    finally:
+        configure_listing(500, False)
+        api_server.stop()
+    assert [pod.uid for pod in snapshot.pods] == [
+        "pod-{index}".format(index=index) for index in range(5)
+    ]
+    assert snapshot.pods[0].containers == (
+        Container("node-1", "app:1", "docker-pullable://app@sha256:1"),
+    )
+    assert api_server.request_counts["list pods"] == 3
+
+
+def test_shards_split_keys_evenly_and_consistently():
+    keys = ["namespace-{index}".format(index=index) for index in range(1000)]
+    four_shards = {key: sharding.get_shard_index(key, 4) for key in keys}
+    assert all(
+        150 < list(four_shards.values()).count(index) < 350 for index in range(4)
+    )
+    assert [key for key in keys if sharding.Shard(1, 4).owns(key)] == [
+        key for key, index in four_shards.items() if index == 1
+    ]
+    # Adding a shard only moves keys to the new shard
+    five_shards = {key: sharding.get_shard_index(key, 5) for key in keys}
+    assert {
+        five_shards[key] for key in keys if five_shards[key] != four_shards[key]
+    } == {4}
+
+
+def test_namespace_shards_only_list_their_own_namespaces():
+    kinds = {
+        "pods": [
+            {
+                "metadata": {
+                    "name": "pod",
+                    "namespace": "namespace-{index}".format(index=index),
+                    "uid": "pod-{index}".format(index=index),
+                }
+            }
+            for index in range(20)
+        ]
+    }
+    api_server = FakeApiServer(kinds)
+    api_server.start()
+    try:
+        api_client = get_fake_api_client(api_server)
+        shard_namespaces = [
+            sharding.get_shard_namespaces(sharding.Shard(index, 3), "", api_client)
+            for index in range(3)
+        ]
+    finally:
+        api_server.stop()
+    assert sorted(sum(shard_namespaces, [])) == sorted(
+        "namespace-{index}".format(index=index) for index in range(20)
+    )
+    assert all(shard_namespaces)
+    assert sharding.get_shard_namespaces(
+        sharding.Shard(0, 3), "", None, ["namespace-1", "namespace-2"]
+    ) == [
+        namespace
+        for namespace in ["namespace-1", "namespace-2"]
+        if namespace in shard_namespaces[0]
+    ]
+
+
+def test_image_shards_keep_resources_with_the_same_images_together():
+    resources = [
+        (
+            Resource(
+                "Deployment",
+                "app-{index}".format(index=index),
+                "app-{index}".format(index=index),
+                "",
+                frozenset({"docker.io/library/nginx:1.17", "quay.io/org/app:1"}),
+            ),
+            [],
+        )
+        for index in range(10)
+    ]
+    checked = [
+        [
+            resource.name
+            for resource, _ in sharding.iter_shard_resources(
+                iter(resources), sharding.Shard(index, 2)
+            )
+        ]
+        for index in range(2)
+    ]
+    assert sorted(map(len, checked)) == [0, 10]
+
+
+def test_image_shards_only_resolve_their_own_missing_resources(tmpdir):
+    resources = [
+        Resource(
+            "Deployment",
+            "app-{index}".format(index=index),
+            "app-{index}".format(index=index),
+            "",
+            frozenset({"app-{index}:1".format(index=index)}),
+        )
+        for index in range(20)
+    ]
+    state_path = str(tmpdir.join("state.json"))
+    state = NotificationState(state_path)
+    state.diff(
+        resources,
+        [
+            NewTagNotification(
+                "app-{index}".format(index=index), "1", parse("2"), owner=resource
+            )
+            for index, resource in enumerate(resources)
+        ],
+    )
+    state.save()
+
+    # Each shard of a check split by image finds all its resources, and leaves the others' alone
+    for index in range(2):
+        shard = sharding.Shard(index, 2)
+        state = NotificationState(state_path)
+        state.load()
+        assert (
+            state.resolve_missing(
+                [
+                    resource
+                    for resource in resources
+                    if sharding.is_shard_resource(shard, resource)
+                ],
+                sharding.get_shard_scope(shard, get_listed_scope({"": []})),
+            )
+            == []
+        )
+        state.save()
+
+    state = NotificationState(state_path)
+    state.load()
+    resolved = state.resolve_missing(
+        [], sharding.get_shard_scope(sharding.Shard(0, 2), get_listed_scope({"": []}))
+    )
+    assert 0 < len(resolved) < 20
+    assert len(state.resolve_missing([])) == 20 - len(resolved)
+
+
+def test_shard_findings_are_merged_into_one_report(tmpdir):
+    web = Resource("Deployment", "web", "web", "", frozenset({"nginx:1"}))
+    api = Resource("Deployment", "api", "api", "", frozenset({"nginx:1"}))
+    shard_notifications = [
+        [NewTagNotification("nginx", "1", "2", owner=web)],
+        [
+            NewTagNotification("nginx", "1", "2", owner=api),
+            ResolvedNotification("Newer tag available for redis:5 -> 6"),
+        ],
+    ]
+    paths = []
+    for index, notifications in enumerate(shard_notifications):
+        path = str(tmpdir.join("shard-{index}.json".format(index=index)))
+        sharding.write_findings(path, sharding.Shard(index, 3), 1, notifications)
+        paths.append(path)
+    # A retried shard's findings are only counted once
+    sharding.write_findings(
+        str(tmpdir.join("shard-1-retry.json")),
+        sharding.Shard(1, 3),
+        1,
+        shard_notifications[1],
+    )
+    paths.append(str(tmpdir.join("shard-1-retry.json")))
+
+    merged = sharding.merge_findings(paths)
+    assert merged["shards"] == [0, 1]
+    assert merged["missing_shards"] == [2]
+    assert merged["resources"] == 2
+    recorded = [
+        notification.RecordedNotification(finding)
+        for finding in merged["notifications"]
+    ]
+    assert [str(recorded_notification) for recorded_notification in recorded] == [
+        str(shard_notification)
+        for notifications in shard_notifications
+        for shard_notification in notifications
+    ]
+    assert recorded[0].to_dict() == shard_notifications[0][0].to_dict()
+
+    sharding.write_findings(str(tmpdir.join("other.json")), sharding.Shard(0, 2), 1, [])
+    with pytest.raises(Exception):
+        sharding.merge_findings(paths + [str(tmpdir.join("other.json"))])
@@ -1,30 +1,66 @@
 import logging
-from typing import List, Dict
+import os
+import time
+from typing import Dict, Tuple, List, Optional
 
 import click
 import coloredlogs
 from kubernetes import config
-from packaging.version import parse
+from kubernetes.client import ApiClient
 
+from version_checker.cache import RegistryCache, configure_cache
+from version_checker.checker import stream_check_resources
+from version_checker.daemon import run_daemon
 from version_checker.k8s import get_api_functions
-from version_checker.k8s.cronjobs import get_top_level_cronjobs
-from version_checker.k8s.daemon_sets import get_top_level_daemon_sets
-from version_checker.k8s.deployments import get_top_level_deployments
-from version_checker.k8s.model import Resource, Container
-from version_checker.k8s.pods import get_top_level_pods
-from version_checker.k8s.stateful_sets import get_top_level_stateful_sets
+from version_checker.k8s.model import K8sFetcherFunctions
+from version_checker.k8s.resources import iter_cluster_resources
+from version_checker.k8s.snapshot import configure_listing, configure_recording
+from version_checker.metrics import (
+    configure_metrics,
+    update_resource_metrics,
+    record_run,
+    write_metrics_textfile,
+)
+from version_checker.mirrors import (
+    configure_mirrors,
+    get_source_report,
+    log_source_summary,
+)
 from version_checker.notification import (
-    NewTagNotification,
     log_notifications,
-    Notification,
-    OutOfDateContainerNotification,
+    configure_dispatcher,
+    NotificationDispatcher,
+    WebhookSink,
+    SlackSink,
+    KubernetesEventSink,
+    NotificationSink,
+    RecordedNotification,
+)
+from version_checker.ratelimit import configure_rate_limits, log_rate_limit_summary
+from version_checker.replay import (
+    Recorder,
+    get_fake_api_client,
+    load_fixtures,
+    recording_adapter_factory,
+    redirecting_adapter_factory,
+    start_replay,
 )
-from version_checker.registry import (
-    is_versioned_tag,
-    get_newest_tag,
-    get_docker_tag_digest,
-    get_digest_from_image_status,
+from version_checker.sessions import configure_sessions
+from version_checker.sharding import (
+    SHARD_BY_IMAGE,
+    SHARD_BY_NAMESPACE,
+    Shard,
+    get_shard_namespaces,
+    get_shard_scope,
+    iter_shard_resources,
+    merge_findings,
+    write_findings,
+    write_merged_findings,
 )
+from version_checker.state import NotificationState, get_listed_scope
+from version_checker.tags import parse_version_tag
+from version_checker.timing import write_run_report, log_timing_report, ThreadProfiler
+from version_checker.tokens import configure_credentials, load_docker_credentials
 
 logger = logging.getLogger(__name__)
 
@@ -34,14 +70,279 @@ logger = logging.getLogger(__name__)
     context_settings=dict(help_option_names=["-h", "--help"]),
 )
 @click.option("--debug", is_flag=True, default=False, help="Enable debug logging")
-@click.option("--namespace", help="Only look in this namespace")
-def main(debug: bool, namespace: str) -> None:
+@click.option(
+    "--namespace",
+    multiple=True,
+    callback=lambda ctx, param, value: parse_comma_separated(value),
+    help="Only look in this namespace. Can be given more than once, or as a comma separated list",
+)
+@click.option(
+    "--context",
+    multiple=True,
+    callback=lambda ctx, param, value: parse_comma_separated(value),
+    help="Check the cluster of this kubeconfig context. Can be given more than once, or as a comma separated list, to check several clusters in one run",
+)
+@click.option(
+    "--max-api-requests",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of kubernetes list requests in flight at once",
+)
+@click.option(
+    "--workers",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of resources to check against registries concurrently",
+)
+@click.option(
+    "--max-pending-resources",
+    default=100,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of resources held waiting for their registry lookups at once, and of listed resources waiting to be checked",
+)
+@click.option(
+    "--max-connections-per-host",
+    default=4,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of pooled connections kept open to each registry host",
+)
+@click.option(
+    "--registry-low-budget",
+    default=20,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Remaining rate limit budget at which a registry's requests are spread out and only images with running containers are checked",
+)
+@click.option(
+    "--registry-mirror",
+    multiple=True,
+    callback=lambda ctx, param, value: parse_host_mirrors(value),
+    metavar="HOST=MIRROR",
+    help="Look up a registry host's images on this mirror first, e.g. docker.io=mirror.example.com or docker.io=harbor.example.com/dockerhub-proxy, falling back to the host itself. Can be given more than once, and mirrors are tried in the order given",
+)
+@click.option(
+    "--registry-credentials",
+    envvar="VERSION_CHECKER_REGISTRY_CREDENTIALS",
+    type=click.Path(dir_okay=False, exists=True),
+    help="Authenticate to registries and mirrors with the credentials in this docker config.json file",
+)
+@click.option(
+    "--cache-file",
+    envvar="VERSION_CHECKER_CACHE_FILE",
+    type=click.Path(dir_okay=False),
+    help="Persist registry lookup results in this file between runs",
+)
+@click.option(
+    "--state-file",
+    envvar="VERSION_CHECKER_STATE_FILE",
+    type=click.Path(dir_okay=False),
+    help="Remember reported findings in this file, and only report findings that are new or resolved since the last run",
+)
+@click.option(
+    "--cache-ttl",
+    default=21600,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Seconds that cached registry results stay fresh",
+)
+@click.option(
+    "--registry-cache-ttl",
+    multiple=True,
+    callback=lambda ctx, param, value: parse_host_ttls(value),
+    metavar="HOST=SECONDS",
+    help="Override the cache TTL for a registry host. Can be given more than once",
+)
+@click.option(
+    "--cache-max-entries",
+    default=10000,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of cached registry results before the least recently used are evicted",
+)
+@click.option(
+    "--no-cache", is_flag=True, default=False, help="Bypass the registry cache"
+)
+@click.option(
+    "--clear-cache",
+    is_flag=True,
+    default=False,
+    help="Empty the registry cache before running",
+)
+@click.option(
+    "--daemon",
+    is_flag=True,
+    default=False,
+    help="Keep running, watching the cluster and checking resources as they change",
+)
+@click.option(
+    "--registry-interval",
+    default=3600,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="In daemon mode, seconds between re-checking every image against its registry. Cached registry results are kept for at most this long",
+)
+@click.option(
+    "--list-page-size",
+    default=500,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of kubernetes objects to fetch in each page of a list request",
+)
+@click.option(
+    "--raw-k8s-lists/--no-raw-k8s-lists",
+    default=True,
+    show_default=True,
+    help="Parse kubernetes list responses as plain JSON instead of through the client's models",
+)
+@click.option(
+    "--report-file",
+    type=click.Path(dir_okay=False),
+    help="Write a JSON report of the run, with call counts and latencies for each phase, registry host and kubernetes API call",
+)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False),
+    help="Profile the run with cProfile and write the stats to this file, for reading with pstats",
+)
+@click.option(
+    "--metrics-port",
+    type=click.IntRange(min=1, max=65535),
+    help="Serve Prometheus metrics on /metrics on this port",
+)
+@click.option(
+    "--metrics-textfile",
+    type=click.Path(dir_okay=False),
+    help="Write Prometheus metrics to this file at the end of the run, e.g. for the node exporter's textfile collector",
+)
+@click.option(
+    "--webhook-url",
+    multiple=True,
+    help="POST notifications as JSON to this URL. Can be given more than once",
+)
+@click.option(
+    "--slack-webhook-url",
+    multiple=True,
+    help="Post notifications to this Slack incoming webhook. Can be given more than once",
+)
+@click.option(
+    "--kubernetes-events",
+    is_flag=True,
+    default=False,
+    help="Record notifications as kubernetes Events on the resources they are about",
+)
+@click.option(
+    "--notification-batch-size",
+    default=50,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of notifications sent to a sink in one request",
+)
+@click.option(
+    "--notification-queue-size",
+    default=1000,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of notifications waiting to be delivered, beyond which new ones are dropped",
+)
+@click.option(
+    "--notification-timeout",
+    default=30,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Seconds to wait at the end of a run for queued notifications to be delivered",
+)
+@click.option(
+    "--record",
+    type=click.Path(file_okay=False),
+    help="Record the objects listed from the cluster and the registry responses into fixtures in this directory",
+)
+@click.option(
+    "--replay",
+    type=click.Path(file_okay=False, exists=True),
+    help="Run offline against fixtures recorded with --record, served by a local fake API server and registry",
+)
+@click.option(
+    "--shard",
+    envvar="VERSION_CHECKER_SHARD",
+    callback=lambda ctx, param, value: parse_shard(value),
+    metavar="INDEX/COUNT",
+    help="Only check this shard's part of the cluster, e.g. 0/4 for the first of four shards",
+)
+@click.option(
+    "--shard-count",
+    envvar="VERSION_CHECKER_SHARD_COUNT",
+    type=click.IntRange(min=1),
+    help="Split the check into this many shards, taking this run's shard from JOB_COMPLETION_INDEX as set for the pods of an Indexed Job",
+)
+@click.option(
+    "--shard-by",
+    default=SHARD_BY_NAMESPACE,
+    show_default=True,
+    type=click.Choice([SHARD_BY_NAMESPACE, SHARD_BY_IMAGE]),
+    help="Split the check between shards by namespace, so each shard only lists its own namespaces, or by each resource's images, so each image is mostly only looked up by one shard",
+)
+@click.option(
+    "--findings-file",
+    type=click.Path(dir_okay=False),
+    help="Write the findings reported by the run to this JSON file, or the merged findings with --merge-findings",
+)
+@click.option(
+    "--merge-findings",
+    multiple=True,
+    type=click.Path(dir_okay=False, exists=True),
+    help="Instead of checking a cluster, combine the findings files written by each shard and report them. Can be given more than once",
+)
+def main(
+    debug: bool,
+    namespace: List[str],
+    context: List[str],
+    max_api_requests: int,
+    workers: int,
+    max_pending_resources: int,
+    max_connections_per_host: int,
+    registry_low_budget: int,
+    registry_mirror: Dict[str, List[str]],
+    registry_credentials: str,
+    cache_file: str,
+    state_file: str,
+    cache_ttl: int,
+    registry_cache_ttl: Dict[str, int],
+    cache_max_entries: int,
+    no_cache: bool,
+    clear_cache: bool,
+    daemon: bool,
+    registry_interval: int,
+    list_page_size: int,
+    raw_k8s_lists: bool,
+    report_file: str,
+    profile: str,
+    metrics_port: int,
+    metrics_textfile: str,
+    webhook_url: List[str],
+    slack_webhook_url: List[str],
+    kubernetes_events: bool,
+    notification_batch_size: int,
+    notification_queue_size: int,
+    notification_timeout: int,
+    record: str,
+    replay: str,
+    shard: Optional[Shard],
+    shard_count: Optional[int],
+    shard_by: str,
+    findings_file: str,
+    merge_findings: List[str],
+) -> None:
     """
     Checks a kubernetes cluster to see if any running pods, cron jobs or deployments have updated image tags or image
     digests on their repositories.
 
     Can be run either external to a cluster (requires `~/.kube/config` to be setup correctly) or within a cluster as
-    a pod. In the latter case, notifications about available updates will be posted to a webhook.
+    a pod. Notifications about available updates are logged, and can also be posted to webhooks or recorded as
+    kubernetes Events.
 
     This script can be figured using annotations on the pods themselves. Pods can be ignored with:
 
@@ -53,95 +354,348 @@ def main(debug: bool, namespace: str) -> None:
     """
     if debug:
         coloredlogs.set_level("DEBUG")
-    try:
-        config.load_incluster_config()
-    except config.config_exception.ConfigException:
-        config.load_kube_config()
+    if daemon and (record or replay):
+        raise click.UsageError("--record and --replay can't be used with --daemon")
+    if record and len(context) > 1:
+        raise click.UsageError("--record can only record one --context")
+    shard = get_shard(shard, shard_count)
+    if daemon and (shard or merge_findings):
+        raise click.UsageError(
+            "--shard, --shard-count and --merge-findings can't be used with --daemon"
+        )
 
-    images = get_top_level_resources(namespace)
+    if merge_findings:
+        dispatcher = start_dispatcher(
+            [WebhookSink(url) for url in webhook_url]
+            + [SlackSink(url) for url in slack_webhook_url],
+            notification_batch_size,
+            notification_queue_size,
+        )
+        try:
+            report_merged_findings(merge_findings, findings_file, report_file)
+        finally:
+            if dispatcher:
+                dispatcher.close(notification_timeout)
+        return
 
-    notifications = []
+    recorder = None
+    if replay:
+        api_server, fake_registry = start_replay(*load_fixtures(replay))
+        api_clients = {"": get_fake_api_client(api_server)}
+        configure_sessions(
+            max_connections_per_host, redirecting_adapter_factory(fake_registry.url)
+        )
+    else:
+        if not context:
+            try:
+                config.load_incluster_config()
+            except config.config_exception.ConfigException:
+                config.load_kube_config()
+        api_clients = get_api_clients(context)
+        if record:
+            recorder = Recorder()
+            configure_recording(recorder.record_object)
+            configure_sessions(
+                max_connections_per_host, recording_adapter_factory(recorder)
+            )
+        else:
+            configure_sessions(max_connections_per_host)
+    configure_rate_limits(registry_low_budget)
+    configure_mirrors(registry_mirror)
+    configure_credentials(
+        load_docker_credentials(registry_credentials) if registry_credentials else {}
+    )
 
-    for resource, containers in sorted(images.items()):
+    cache = None
+    # Recording needs every response to come from the registry, rather than from the cache or a 304
+    if cache_file and not no_cache and not record:
+        # In daemon mode every image is re-checked each registry interval, so nothing is cached for longer
+        cache = RegistryCache(
+            cache_file,
+            cache_ttl,
+            registry_cache_ttl,
+            cache_max_entries,
+            registry_interval if daemon else None,
+        )
+        if clear_cache:
+            cache.clear()
+        else:
+            cache.load()
+    configure_cache(cache)
+    if metrics_port or metrics_textfile:
+        configure_metrics(metrics_port, cache)
+
+    state = None
+    if state_file:
+        state = NotificationState(state_file)
+        state.load()
+
+    configure_listing(list_page_size, raw_k8s_lists)
+    cluster_namespaces = get_cluster_namespaces(
+        api_clients, namespace, shard if shard_by == SHARD_BY_NAMESPACE else None
+    )
+    clusters = get_cluster_fetcher_functions(api_clients, cluster_namespaces)
+    if shard:
         logger.info(
-            "Considering {kind}: {name} ({container_count} running containers)".format(
-                kind=resource.kind, name=resource.name, container_count=len(containers)
+            "Checking shard {shard}, split by {shard_by}".format(
+                shard=shard, shard_by=shard_by
             )
         )
-        notifications.extend(check_resouce_for_new_image_tags(resource))
-        notifications.extend(
-            check_resource_containers_for_updated_image_digests(resource, containers)
+
+    sinks = [WebhookSink(url) for url in webhook_url] + [
+        SlackSink(url) for url in slack_webhook_url
+    ]
+    if kubernetes_events:
+        sinks.append(KubernetesEventSink(api_clients))
+    dispatcher = start_dispatcher(
+        sinks, notification_batch_size, notification_queue_size
+    )
+
+    profiler = None
+    if profile:
+        profiler = ThreadProfiler()
+        profiler.start()
+    try:
+        if daemon:
+            run_daemon(
+                clusters,
+                workers,
+                registry_interval,
+                cache,
+                report_file,
+                state,
+                get_listed_scope(cluster_namespaces),
+            )
+            return
+
+        started_at = time.time()
+        resource_count = 0
+        notification_count = 0
+        # Only kept when needed to find the resources that have gone since the last run
+        checked_resources = []
+        # Only kept when they are to be written to a findings file
+        reported_notifications = []
+        resources = (
+            iter_cluster_resources(clusters, max_api_requests, max_pending_resources)
+            if clusters
+            else iter([])
         )
+        if shard and shard_by == SHARD_BY_IMAGE:
+            resources = iter_shard_resources(resources, shard)
+        for resource, notifications, unchecked in stream_check_resources(
+            resources, workers, max_pending_resources
+        ):
+            resource_count += 1
+            notification_count += len(notifications)
+            update_resource_metrics([resource], notifications)
+            if state:
+                checked_resources.append(resource)
+                notifications = state.diff(
+                    [resource], notifications, {resource: unchecked}
+                )
+            log_notifications(notifications)
+            if findings_file:
+                reported_notifications.extend(notifications)
+        if state:
+            # A cluster that can't be listed stops the run before this, so every cluster here was listed in full
+            in_scope = get_listed_scope(cluster_namespaces)
+            if shard and shard_by == SHARD_BY_IMAGE:
+                # The other shards' resources were listed too, but only this shard's were checked
+                in_scope = get_shard_scope(shard, in_scope)
+            resolved_notifications = state.resolve_missing(checked_resources, in_scope)
+            log_notifications(resolved_notifications)
+            if findings_file:
+                reported_notifications.extend(resolved_notifications)
+            state.save()
+        log_rate_limit_summary()
+        log_source_summary()
+        log_timing_report()
+        record_run(time.time() - started_at)
+
+        if cache:
+            cache.save()
+        if recorder:
+            recorder.save(record)
+        if metrics_textfile:
+            write_metrics_textfile(metrics_textfile)
+        if findings_file:
+            write_findings(findings_file, shard, resource_count, reported_notifications)
+        if report_file:
+            write_run_report(
+                report_file,
+                {
+                    "started_at": started_at,
+                    "duration_seconds": time.time() - started_at,
+                    "resources": resource_count,
+                    "notifications": notification_count,
+                    "cache": {"hits": cache.hits, "misses": cache.misses}
+                    if cache
+                    else None,
+                    "tag_parse_cache": parse_version_tag.cache_info()._asdict(),
+                    "registry_sources": get_source_report(),
+                    "shard": str(shard) if shard else None,
+                },
+            )
+    finally:
+        if dispatcher:
+            dispatcher.close(notification_timeout)
+        if profiler:
+            profiler.stop(profile)
 
-    log_notifications(notifications)
+
+def parse_comma_separated(values: Tuple[str]) -> List[str]:
+    return [
+        item.strip() for value in values for item in value.split(",") if item.strip()
+    ]
+
+
+def get_api_clients(contexts: List[str]) -> Dict[str, Optional[ApiClient]]:
+    """
+    Builds an API client for each cluster, keyed by kubeconfig context. Without any contexts the already loaded default
+    configuration is used, under an empty cluster name.
+    """
+    return {
+        single_context: config.new_client_from_config(context=single_context)
+        for single_context in contexts
+    } or {"": None}
+
+
+def get_cluster_namespaces(
+    api_clients: Dict[str, Optional[ApiClient]],
+    namespaces: List[str],
+    shard: Optional[Shard] = None,
+) -> Dict[str, List[str]]:
+    """
+    The namespaces to list of each cluster, where no namespaces means all of them. With a shard, only the namespaces
+    that belong to it are listed, out of those given or otherwise all of the cluster's, and clusters with none of them
+    are left out.
+    """
+    cluster_namespaces = {}
+    for cluster, api_client in api_clients.items():
+        cluster_namespaces[cluster] = namespaces
+        if shard:
+            cluster_namespaces[cluster] = get_shard_namespaces(
+                shard, cluster, api_client, namespaces
+            )
+            if not cluster_namespaces[cluster]:
+                del cluster_namespaces[cluster]
+    return cluster_namespaces
 
 
-def get_top_level_resources(namespace: str) -> Dict[Resource, Container]:
-    k8s_fetcher_functions = get_api_functions(namespace)
+def get_cluster_fetcher_functions(
+    api_clients: Dict[str, Optional[ApiClient]],
+    cluster_namespaces: Dict[str, List[str]],
+) -> Dict[str, List[K8sFetcherFunctions]]:
+    """
+    Builds the fetcher functions for each namespace to be listed of each cluster.
+    """
     return {
-        **get_top_level_deployments(k8s_fetcher_functions),
-        **get_top_level_daemon_sets(k8s_fetcher_functions),
-        **get_top_level_stateful_sets(k8s_fetcher_functions),
-        **get_top_level_pods(k8s_fetcher_functions),
-        **get_top_level_cronjobs(k8s_fetcher_functions),
+        cluster: [
+            get_api_functions(single_namespace, api_clients[cluster])
+            for single_namespace in namespaces
+        ]
+        or [get_api_functions(api_client=api_clients[cluster])]
+        for cluster, namespaces in cluster_namespaces.items()
     }
 
 
-def check_resource_containers_for_updated_image_digests(
-    resource: Resource, containers: List[Container]
-) -> List[Notification]:
-    notifications = []
+def start_dispatcher(
+    sinks: List[NotificationSink], batch_size: int, queue_size: int
+) -> Optional[NotificationDispatcher]:
+    dispatcher = None
+    if sinks:
+        dispatcher = NotificationDispatcher(sinks, batch_size, queue_size)
+        dispatcher.start()
+    configure_dispatcher(dispatcher)
+    return dispatcher
 
-    if len(containers) == 0:
-        return notifications
 
-    for container in containers:
-        logger.info(
-            "Container spec'd with is {image} running {image_id}".format(
-                image=container.image, image_id=container.image_id
-            )
+def report_merged_findings(
+    paths: List[str], findings_file: Optional[str], report_file: Optional[str]
+) -> None:
+    """
+    Combines the findings of each shard of a sharded check, and reports them as if they came from a single run.
+    """
+    merged = merge_findings(paths)
+    log_notifications(
+        [RecordedNotification(finding) for finding in merged["notifications"]]
+    )
+    logger.info(
+        "Merged {notifications} findings on {resources} resources from {shards} of {count} shards".format(
+            notifications=len(merged["notifications"]),
+            resources=merged["resources"],
+            shards=len(merged["shards"]),
+            count=merged["shard_count"],
         )
-        image_name, tag = container.image.split(":", 1)
-        registry_digest = get_docker_tag_digest(image_name, tag)
-        if not registry_digest:
-            logger.warning(
-                "No registry digest found for {image}:{tag}".format(
-                    image=image_name, tag=tag
-                )
-            )
-            continue
-        logger.info(
-            "Digest on registry for this image: {digest}".format(digest=registry_digest)
+    )
+    if findings_file:
+        write_merged_findings(findings_file, merged)
+    if report_file:
+        write_run_report(
+            report_file,
+            {
+                "resources": merged["resources"],
+                "notifications": len(merged["notifications"]),
+                "shards": merged["shards"],
+                "missing_shards": merged["missing_shards"],
+            },
         )
-        if registry_digest != get_digest_from_image_status(container.image_id):
-            notifications.append(
-                OutOfDateContainerNotification(resource, container, registry_digest)
+
+
+def parse_host_ttls(values: Tuple[str]) -> Dict[str, int]:
+    host_ttls = {}
+    for value in values:
+        host, _, ttl = value.partition("=")
+        if not host or not ttl.isdigit():
+            raise click.BadParameter(
+                "{value} is not of the form HOST=SECONDS".format(value=value)
             )
-    return notifications
+        host_ttls[host] = int(ttl)
+    return host_ttls
 
 
-def check_resouce_for_new_image_tags(resource: Resource) -> List[Notification]:
-    notifications = []
-    for image in resource.image_spec:
-        logger.info(
-            "{kind} has image defined: {image}".format(kind=resource.kind, image=image)
+def parse_host_mirrors(values: Tuple[str]) -> Dict[str, List[str]]:
+    host_mirrors = {}
+    for value in values:
+        host, _, mirror = value.partition("=")
+        if not host or not mirror:
+            raise click.BadParameter(
+                "{value} is not of the form HOST=MIRROR".format(value=value)
+            )
+        host_mirrors.setdefault(host, []).append(mirror)
+    return host_mirrors
+
+
+def parse_shard(value: Optional[str]) -> Optional[Shard]:
+    if not value:
+        return None
+    index, _, count = value.partition("/")
+    if not (index.isdigit() and count.isdigit() and int(index) < int(count)):
+        raise click.BadParameter(
+            "{value} is not of the form INDEX/COUNT, with INDEX less than COUNT".format(
+                value=value
+            )
         )
-        image_name, tag = image.split(":", 1)
-        if is_versioned_tag(tag):
-            newest_tag = get_newest_tag(
-                image_name, resource.tag_version_pattern_annotation
+    return Shard(int(index), int(count))
+
+
+def get_shard(shard: Optional[Shard], shard_count: Optional[int]) -> Optional[Shard]:
+    """
+    The shard to check, given either with `--shard` or, for the pods of an Indexed Job, with `--shard-count` and the
+    job's completion index.
+    """
+    if not shard_count:
+        return shard
+    if shard:
+        raise click.UsageError("--shard and --shard-count can't be used together")
+    job_completion_index = os.environ.get("JOB_COMPLETION_INDEX", "")
+    if not job_completion_index.isdigit() or int(job_completion_index) >= shard_count:
+        raise click.UsageError(
+            "--shard-count needs JOB_COMPLETION_INDEX to be set to a shard index below {count}".format(
+                count=shard_count
             )
-            if newest_tag:
-                logger.info("Newest tag for this image is {tag}".format(tag=newest_tag))
-                if newest_tag != "" and newest_tag > parse(tag):
-                    notifications.append(
-                        NewTagNotification(image_name, tag, newest_tag)
-                    )
-            else:
-                logger.warning(
-                    "No eligable tags found for {image}".format(image=image_name)
-                )
-    return notifications
+        )
+    return Shard(int(job_completion_index), shard_count)
 
 
 coloredlogs.install(milliseconds=True, level="INFO")
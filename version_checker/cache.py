@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Callable, Any
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT_VERSION = 3
+
+
+class RegistryCache(object):
+    """
+    A persistent cache of registry lookup results, such as newest tags and manifest digests, stored as a JSON file so
+    that it survives between runs. Entries expire after a per-registry TTL and the least recently used entries are
+    evicted once the cache holds more than `max_entries`. No entry is kept fresh for longer than `max_ttl`, if given, so
+    that a daemon polling registries on an interval isn't answered from the cache on every poll.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        default_ttl: int,
+        host_ttls: Dict[str, int] = None,
+        max_entries: int = 10000,
+        max_ttl: Optional[int] = None,
+    ):
+        self.path = path
+        self.default_ttl = default_ttl
+        self.host_ttls = host_ttls or {}
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as cache_file:
+                contents = json.load(cache_file)
+        except (OSError, ValueError):
+            logger.warning(
+                "Ignoring unreadable registry cache at {path}".format(path=self.path)
+            )
+            return
+        if contents.get("version") != CACHE_FORMAT_VERSION:
+            logger.info("Ignoring registry cache written in an older format")
+            return
+        with self._lock:
+            self._entries = OrderedDict(
+                (entry["key"], entry) for entry in contents["entries"]
+            )
+        logger.info(
+            "Loaded {count} registry cache entries from {path}".format(
+                count=len(self._entries), path=self.path
+            )
+        )
+
+    def save(self) -> None:
+        with self._lock:
+            contents = {
+                "version": CACHE_FORMAT_VERSION,
+                "entries": list(self._entries.values()),
+            }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temporary_path = "{path}.tmp".format(path=self.path)
+        with open(temporary_path, "w") as cache_file:
+            json.dump(contents, cache_file)
+        os.replace(temporary_path, self.path)
+        logger.info(
+            "Saved {count} registry cache entries to {path} ({hits} hits, {misses} misses)".format(
+                count=len(contents["entries"]),
+                path=self.path,
+                hits=self.hits,
+                misses=self.misses,
+            )
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def get_ttl(self, host: str) -> int:
+        ttl = self.host_ttls.get(host, self.default_ttl)
+        if self.max_ttl is not None:
+            return min(ttl, self.max_ttl)
+        return ttl
+
+    def get(self, host: str, key: str) -> Optional[Any]:
+        """
+        Returns the cached value for the key if it has not yet expired, marking it as recently used.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry["stored_at"] > self.get_ttl(host):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"]
+
+    def get_expired(self, host: str, key: str) -> Optional[Any]:
+        """
+        Returns the cached value for the key even if it has expired, so that it can be revalidated with the registry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry["value"] if entry else None
+
+    def put(self, host: str, key: str, value: Any) -> None:
+        if self.get_ttl(host) <= 0:
+            return
+        with self._lock:
+            self._entries[key] = {"key": key, "value": value, "stored_at": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_cache: Optional[RegistryCache] = None
+
+
+def configure_cache(cache: Optional[RegistryCache]) -> None:
+    global _cache
+    _cache = cache
+
+
+def get_or_revalidate(
+    host: str, key: str, revalidate: Callable[[Optional[Any]], Any]
+) -> Any:
+    """
+    Returns the cached value for the key if it is fresh. Otherwise `revalidate` is called with the expired value, if
+    there is one, so that the registry can be asked whether it has changed rather than for the whole value again, and
+    its result is cached. When no cache has been configured `revalidate` is simply called with `None`.
+    """
+    if _cache is None:
+        return revalidate(None)
+    value = _cache.get(host, key)
+    if value is None:
+        value = revalidate(_cache.get_expired(host, key))
+        _cache.put(host, key, value)
+    return value
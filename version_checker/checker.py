@@ -0,0 +1,514 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import (
+    List,
+    Dict,
+    FrozenSet,
+    Tuple,
+    Optional,
+    Callable,
+    Any,
+    Iterable,
+    Iterator,
+    Set,
+)
+
+import attr
+from attr import dataclass
+from packaging.version import Version
+
+from version_checker.images import ImageRef, parse_image_ref
+from version_checker.k8s.model import Resource, Container
+from version_checker.notification import (
+    NewTagNotification,
+    Notification,
+    OutOfDateContainerNotification,
+)
+from version_checker.mirrors import get_sources
+from version_checker.ratelimit import has_budget, record_skipped
+from version_checker.registry import (
+    get_newest_tag,
+    get_docker_tag_digests,
+    get_digest_from_image_status,
+    register_images,
+    TagDigests,
+)
+from version_checker.tags import is_versioned_tag, parse_version_tag
+from version_checker.timing import timed
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class LookupPlan:
+    """
+    The unique registry lookups needed to check a set of resources. `tag_lookups` holds (image, tag pattern) pairs for
+    newest tag searches and `digest_lookups` holds (image, tag) pairs for manifest digests, where each image is the
+    `ImageRef` of its repository. `priorities` holds the number of running containers of each image, so that the
+    images that matter most are looked up first.
+    """
+
+    tag_lookups: FrozenSet[Tuple[ImageRef, str]]
+    digest_lookups: FrozenSet[Tuple[ImageRef, str]]
+    requested_lookup_count: int
+    priorities: Dict[ImageRef, int] = attr.ib(factory=dict)
+
+    @property
+    def lookup_count(self) -> int:
+        return len(self.tag_lookups) + len(self.digest_lookups)
+
+    def excluding(self, results: "LookupResults") -> "LookupPlan":
+        return LookupPlan(
+            tag_lookups=frozenset(self.tag_lookups - results.newest_tags.keys()),
+            digest_lookups=frozenset(self.digest_lookups - results.digests.keys()),
+            requested_lookup_count=self.requested_lookup_count,
+            priorities=self.priorities,
+        )
+
+    def by_priority(
+        self, lookups: List[Tuple[Callable, Tuple[ImageRef, str]]]
+    ) -> List[Tuple[Callable, Tuple[ImageRef, str]]]:
+        """
+        Orders (lookup function, lookup) pairs so that the images with the most running containers come first.
+        """
+        return sorted(
+            lookups,
+            key=lambda lookup: (-self.priorities.get(lookup[1][0], 0), lookup[1]),
+        )
+
+
+@dataclass(frozen=True)
+class LookupResults:
+    newest_tags: Dict[Tuple[ImageRef, str], Optional[Version]]
+    digests: Dict[Tuple[ImageRef, str], Optional[TagDigests]]
+
+    def merge(self, other: "LookupResults") -> "LookupResults":
+        return LookupResults(
+            newest_tags={**self.newest_tags, **other.newest_tags},
+            digests={**self.digests, **other.digests},
+        )
+
+
+def check_resources(
+    resources: Dict[Resource, List[Container]], workers: int = 1
+) -> List[Notification]:
+    """
+    Plans the unique registry lookups needed for the given resources, performs each one exactly once using a pool of
+    `workers` threads, and then checks every resource against the results. Notifications are returned in the same
+    order as a serial check over the sorted resources would produce them.
+    """
+    return compare_resources(resources, resolve_lookups(resources, workers))[0]
+
+
+def resolve_lookups(
+    resources: Dict[Resource, List[Container]],
+    workers: int = 1,
+    known_results: LookupResults = None,
+) -> LookupResults:
+    """
+    Performs the registry lookups needed for the given resources, skipping any that are already in `known_results`.
+    The returned results include the known ones.
+    """
+    with timed("phases", "plan lookups"):
+        plan = plan_lookups(resources)
+    if known_results:
+        plan = plan.excluding(known_results)
+    logger.info(
+        "Planned {lookups} registry lookups for {requested} image references ({saved} saved by deduplication)".format(
+            lookups=plan.lookup_count,
+            requested=plan.requested_lookup_count,
+            saved=plan.requested_lookup_count - plan.lookup_count,
+        )
+    )
+    with timed("phases", "registry lookups"):
+        results = execute_plan(plan, workers)
+    if known_results:
+        return known_results.merge(results)
+    return results
+
+
+def stream_check_resources(
+    resources: Iterable[Tuple[Resource, List[Container]]],
+    workers: int = 1,
+    max_pending: int = 100,
+) -> Iterator[Tuple[Resource, List[Notification], Set[str]]]:
+    """
+    Checks resources as they arrive, yielding each resource with its notifications, and the key prefixes of the
+    findings that couldn't be evaluated, as soon as its lookups are done.
+    Registry lookups for a resource are started when it arrives, unless an earlier resource has already started the
+    same lookup, and at most `max_pending` resources are held waiting for their lookups at once. Resources are
+    yielded in the order they arrive.
+
+    As resources aren't all known up front, lookups are started in the order resources arrive rather than by how many
+    running containers each image has. A lookup that was started for a resource without running containers, and then
+    skipped because its registry was low on budget, is made again for the first later resource with running
+    containers that needs it.
+    """
+    newest_tag_futures: Dict[Tuple[ImageRef, str], Future] = {}
+    digest_futures: Dict[Tuple[ImageRef, str], Future] = {}
+    # Lookups that were started for resources without running containers, and so may be skipped
+    unprioritised = set()
+    pending = deque()
+    requested_lookup_count = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for resource, containers in resources:
+            plan = plan_lookups({resource: containers})
+            requested_lookup_count += plan.requested_lookup_count
+            register_images(
+                {image for image, _ in plan.tag_lookups}
+                | {image for image, _ in plan.digest_lookups}
+            )
+            for lookup_fn, futures, lookups in [
+                (get_newest_tag, newest_tag_futures, plan.tag_lookups),
+                (get_docker_tag_digests, digest_futures, plan.digest_lookups),
+            ]:
+                for lookup in lookups:
+                    priority = plan.priorities.get(lookup[0], 0)
+                    if lookup not in futures:
+                        futures[lookup] = executor.submit(
+                            lookup_or_skip, lookup_fn, *lookup, priority
+                        )
+                    elif priority and (lookup_fn, lookup) in unprioritised:
+                        futures[lookup] = executor.submit(
+                            repeat_if_skipped,
+                            futures[lookup],
+                            lookup_fn,
+                            *lookup,
+                            priority
+                        )
+                    else:
+                        continue
+                    if priority:
+                        unprioritised.discard((lookup_fn, lookup))
+                    else:
+                        unprioritised.add((lookup_fn, lookup))
+            pending.append((resource, containers, plan))
+            if len(pending) >= max_pending:
+                yield _check_pending(
+                    *pending.popleft(), newest_tag_futures, digest_futures
+                )
+        while pending:
+            yield _check_pending(*pending.popleft(), newest_tag_futures, digest_futures)
+    logger.info(
+        "Made {lookups} registry lookups for {requested} image references ({saved} saved by deduplication)".format(
+            lookups=len(newest_tag_futures) + len(digest_futures),
+            requested=requested_lookup_count,
+            saved=requested_lookup_count
+            - len(newest_tag_futures)
+            - len(digest_futures),
+        )
+    )
+
+
+def repeat_if_skipped(
+    previous: Future,
+    lookup_fn: Callable[[ImageRef, str], Any],
+    image: ImageRef,
+    argument: str,
+    priority: int,
+) -> Tuple[Optional[Any], bool]:
+    """
+    Waits for a lookup that was started without priority, and makes it again with the given priority if it was skipped.
+    """
+    result, skipped = previous.result()
+    if not skipped:
+        return result, False
+    return lookup_or_skip(lookup_fn, image, argument, priority)
+
+
+def _check_pending(
+    resource: Resource,
+    containers: List[Container],
+    plan: LookupPlan,
+    newest_tag_futures: Dict[Tuple[ImageRef, str], Future],
+    digest_futures: Dict[Tuple[ImageRef, str], Future],
+) -> Tuple[Resource, List[Notification], Set[str]]:
+    results = LookupResults(
+        newest_tags={
+            lookup: newest_tag_futures[lookup].result()[0]
+            for lookup in plan.tag_lookups
+        },
+        digests={
+            lookup: digest_futures[lookup].result()[0] for lookup in plan.digest_lookups
+        },
+    )
+    notifications, unchecked = check_resource(resource, containers, results)
+    return resource, notifications, unchecked
+
+
+def compare_resources(
+    resources: Dict[Resource, List[Container]], results: LookupResults
+) -> Tuple[List[Notification], Dict[Resource, Set[str]]]:
+    """
+    Checks every resource against the lookup results, returning their notifications along with the key prefixes of
+    the findings that couldn't be evaluated for each resource.
+    """
+    notifications = []
+    unchecked = {}
+    with timed("phases", "compare resources"):
+        for resource, containers in sorted(resources.items()):
+            resource_notifications, unchecked[resource] = check_resource(
+                resource, containers, results
+            )
+            notifications.extend(resource_notifications)
+    return notifications, unchecked
+
+
+def plan_lookups(resources: Dict[Resource, List[Container]]) -> LookupPlan:
+    tag_lookups = []
+    digest_lookups = []
+    priorities = {}
+    for resource, containers in resources.items():
+        for image in resource.image_spec:
+            image_ref = get_image_ref(image, resource)
+            # Images without a tag have no version to compare
+            if image_ref and is_versioned_tag(image_ref.tag):
+                tag_lookups.append(
+                    (image_ref.repository_ref, resource.tag_version_pattern_annotation)
+                )
+        for container in containers:
+            image_ref = get_image_ref(container.image, resource)
+            # Containers pinned to a digest can't have been updated on the registry
+            if not image_ref or image_ref.digest:
+                continue
+            digest_lookups.append((image_ref.repository_ref, image_ref.pull_tag))
+            priorities[image_ref.repository_ref] = (
+                priorities.get(image_ref.repository_ref, 0) + 1
+            )
+    return LookupPlan(
+        tag_lookups=frozenset(tag_lookups),
+        digest_lookups=frozenset(digest_lookups),
+        requested_lookup_count=len(tag_lookups) + len(digest_lookups),
+        priorities=priorities,
+    )
+
+
+def get_image_ref(image: str, resource: Resource) -> Optional[ImageRef]:
+    try:
+        return parse_image_ref(image)
+    except Exception as e:
+        logger.warning(
+            "Not checking {image} of {resource}: {error}".format(
+                image=image, resource=resource, error=e
+            )
+        )
+        return None
+
+
+def execute_plan(plan: LookupPlan, workers: int = 1) -> LookupResults:
+    """
+    Performs the planned lookups, those for the images with the most running containers first. Once a registry's rate
+    limit budget runs low, lookups for images that have no running containers are skipped.
+    """
+    register_images(
+        {image for image, _ in plan.tag_lookups}
+        | {image for image, _ in plan.digest_lookups}
+    )
+    lookups = plan.by_priority(
+        [(get_newest_tag, lookup) for lookup in plan.tag_lookups]
+        + [(get_docker_tag_digests, lookup) for lookup in plan.digest_lookups]
+    )
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            (
+                lookup_fn,
+                lookup,
+                executor.submit(
+                    lookup_within_budget,
+                    lookup_fn,
+                    *lookup,
+                    plan.priorities.get(lookup[0], 0)
+                ),
+            )
+            for lookup_fn, lookup in lookups
+        ]
+        return LookupResults(
+            newest_tags={
+                lookup: future.result()
+                for lookup_fn, lookup, future in futures
+                if lookup_fn is get_newest_tag
+            },
+            digests={
+                lookup: future.result()
+                for lookup_fn, lookup, future in futures
+                if lookup_fn is get_docker_tag_digests
+            },
+        )
+
+
+def lookup_within_budget(
+    lookup_fn: Callable[[ImageRef, str], Any],
+    image: ImageRef,
+    argument: str,
+    priority: int,
+) -> Optional[Any]:
+    return lookup_or_skip(lookup_fn, image, argument, priority)[0]
+
+
+def lookup_or_skip(
+    lookup_fn: Callable[[ImageRef, str], Any],
+    image: ImageRef,
+    argument: str,
+    priority: int,
+) -> Tuple[Optional[Any], bool]:
+    """
+    Makes a lookup, returning its result and whether it was skipped because it has no priority and its registry is
+    low on budget.
+    """
+    host = image.host
+    if not priority and not any(
+        has_budget(source.host) for source in get_sources(host)
+    ):
+        record_skipped(host, str(image))
+        return None, True
+    # A failed lookup only affects the containers and resources using the image, which are reported as unchecked
+    try:
+        return lookup_fn(image, argument), False
+    except Exception as e:
+        logger.warning(
+            "Could not look up {image} ({argument}) on {host}: {error}".format(
+                image=image, argument=argument, host=host, error=e
+            )
+        )
+        return None, False
+
+
+def check_resource(
+    resource: Resource, containers: List[Container], results: LookupResults
+) -> Tuple[List[Notification], Set[str]]:
+    """
+    Checks a resource against the lookup results, returning its notifications along with the key prefixes of the
+    findings that couldn't be evaluated, e.g. because a lookup failed or was skipped. Earlier findings with those
+    prefixes are neither confirmed nor resolved by the check.
+    """
+    logger.info(
+        "Considering {kind}: {name} ({container_count} running containers)".format(
+            kind=resource.kind, name=resource.name, container_count=len(containers)
+        )
+    )
+    tag_notifications, unchecked_tags = check_resouce_for_new_image_tags(
+        resource, results
+    )
+    (
+        container_notifications,
+        unchecked_containers,
+    ) = check_resource_containers_for_updated_image_digests(
+        resource, containers, results
+    )
+    return (
+        tag_notifications + container_notifications,
+        unchecked_tags | unchecked_containers,
+    )
+
+
+def check_resource_containers_for_updated_image_digests(
+    resource: Resource, containers: List[Container], results: LookupResults
+) -> Tuple[List[Notification], Set[str]]:
+    notifications = []
+    unchecked = set()
+
+    for container in containers:
+        # A container that can't be checked, e.g. because of an image ID we don't understand, is skipped rather than
+        # failing the whole run
+        try:
+            notification = check_container_for_updated_image_digest(
+                resource, container, results
+            )
+        except Exception as e:
+            logger.warning(
+                "Could not check container running {image} ({image_id}) of {resource}: {error}".format(
+                    image=container.image,
+                    image_id=container.image_id,
+                    resource=resource,
+                    error=e,
+                )
+            )
+            unchecked.add(OutOfDateContainerNotification.get_key_prefix(container))
+            continue
+        if notification:
+            notifications.append(notification)
+    return notifications, unchecked
+
+
+def check_container_for_updated_image_digest(
+    resource: Resource, container: Container, results: LookupResults
+) -> Optional[Notification]:
+    """
+    Returns a notification if the container isn't running the registry's image for its tag, and raises if that can't
+    be told.
+    """
+    logger.info(
+        "Container spec'd with is {image} running {image_id}".format(
+            image=container.image, image_id=container.image_id
+        )
+    )
+    image_ref = parse_image_ref(container.image)
+    if image_ref.digest:
+        return None
+    tag_digests = results.digests[(image_ref.repository_ref, image_ref.pull_tag)]
+    if not tag_digests or not tag_digests.digest:
+        raise Exception(
+            "No registry digest found for {image}:{tag}".format(
+                image=image_ref.name, tag=image_ref.pull_tag
+            )
+        )
+    running_digest = get_digest_from_image_status(container.image_id)
+    if not running_digest:
+        raise Exception(
+            "Container runtime reported an image ID rather than a digest: {image_id}".format(
+                image_id=container.image_id
+            )
+        )
+    registry_digest = tag_digests.get_platform_digest(container.platform)
+    logger.info(
+        "Digest on registry for this image{on_platform}: {digest}".format(
+            on_platform=" on {platform}".format(platform=container.platform)
+            if container.platform
+            else "",
+            digest=registry_digest,
+        )
+    )
+    if tag_digests.is_current(running_digest, container.platform):
+        return None
+    return OutOfDateContainerNotification(resource, container, registry_digest)
+
+
+def check_resouce_for_new_image_tags(
+    resource: Resource, results: LookupResults
+) -> Tuple[List[Notification], Set[str]]:
+    notifications = []
+    unchecked = set()
+    for image in resource.image_spec:
+        logger.info(
+            "{kind} has image defined: {image}".format(kind=resource.kind, image=image)
+        )
+        try:
+            image_ref = parse_image_ref(image)
+        except Exception:
+            # Images that can't be parsed were reported when the lookups were planned
+            continue
+        if is_versioned_tag(image_ref.tag):
+            newest_tag = results.newest_tags[
+                (image_ref.repository_ref, resource.tag_version_pattern_annotation)
+            ]
+            if newest_tag:
+                logger.info("Newest tag for this image is {tag}".format(tag=newest_tag))
+                if newest_tag != "" and newest_tag > parse_version_tag(image_ref.tag):
+                    notifications.append(
+                        NewTagNotification(
+                            image_ref.name,
+                            image_ref.tag,
+                            newest_tag,
+                            resource.cluster,
+                            resource,
+                        )
+                    )
+            else:
+                logger.warning(
+                    "No eligable tags found for {image}".format(image=image_ref.name)
+                )
+                unchecked.add(
+                    NewTagNotification.get_key_prefix(image_ref.name, image_ref.tag)
+                )
+    return notifications, unchecked
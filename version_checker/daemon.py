@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from typing import Optional, List, Dict, Callable
+
+from version_checker.cache import RegistryCache
+from version_checker.checker import LookupResults, resolve_lookups, compare_resources
+from version_checker.k8s.model import K8sFetcherFunctions, Resource
+from version_checker.k8s.resources import get_top_level_resources
+from version_checker.k8s.watch import ClusterModel
+from version_checker.metrics import (
+    update_resource_metrics,
+    remove_missing_resources,
+    record_run,
+)
+from version_checker.mirrors import log_source_summary, get_source_report, reset_sources
+from version_checker.notification import log_notifications
+from version_checker.ratelimit import log_rate_limit_summary
+from version_checker.state import NotificationState
+from version_checker.timing import write_run_report, log_timing_report, reset_timings
+
+logger = logging.getLogger(__name__)
+
+# How long to wait after a change for others to arrive, so that a rollout is checked once rather than per pod
+settle_seconds = 5
+
+
+def run_daemon(
+    clusters: Dict[str, List[K8sFetcherFunctions]],
+    workers: int,
+    registry_interval: int,
+    cache: Optional[RegistryCache] = None,
+    report_file: Optional[str] = None,
+    state: Optional[NotificationState] = None,
+    in_scope: Optional[Callable[[Resource], bool]] = None,
+) -> None:
+    """
+    Watches each cluster and checks resources as they change. Only resources whose image spec or running containers
+    have changed are checked, and registry lookups are reused for images that have already been looked up, whichever
+    cluster they were first seen in. Every `registry_interval` seconds all resources are checked again against fresh
+    registry lookups, after which the timings gathered since the last poll are logged and written to the run report.
+
+    With a notification state, only findings that are new or have been resolved are logged. Findings of resources that
+    have gone are only resolved if they are `in_scope`, e.g. in one of the namespaces being watched.
+    """
+    changed = threading.Event()
+    models = [
+        ClusterModel(k8s_fetcher_functions, cluster, changed)
+        for cluster, k8s_fetcher_functions in clusters.items()
+    ]
+    for model in models:
+        model.start()
+    for model in models:
+        model.wait_until_synced()
+    logger.info("Cluster models synced, watching for changes")
+
+    checked_resources = {}
+    results = LookupResults(newest_tags={}, digests={})
+    next_registry_poll = time.monotonic()
+    while True:
+        registry_poll_due = time.monotonic() >= next_registry_poll
+        if registry_poll_due or changed.is_set():
+            changed.clear()
+            resources = {
+                resource: containers
+                for model in models
+                for resource, containers in get_top_level_resources(
+                    model.snapshot()
+                ).items()
+            }
+            if registry_poll_due:
+                logger.info("Polling registries for all images")
+                poll_started_at = time.monotonic()
+                resources_to_check = resources
+                results = resolve_lookups(resources, workers)
+                next_registry_poll = time.monotonic() + registry_interval
+                record_run(time.monotonic() - poll_started_at)
+                log_rate_limit_summary()
+                log_source_summary()
+                log_timing_report()
+                if report_file:
+                    write_run_report(
+                        report_file, {"registry_sources": get_source_report()}
+                    )
+                reset_timings()
+                reset_sources()
+                if cache:
+                    cache.save()
+            else:
+                resources_to_check = {
+                    resource: containers
+                    for resource, containers in resources.items()
+                    if checked_resources.get(resource) != containers
+                }
+                if resources_to_check:
+                    logger.info(
+                        "{count} resources changed".format(
+                            count=len(resources_to_check)
+                        )
+                    )
+                    results = resolve_lookups(resources_to_check, workers, results)
+            notifications, unchecked = compare_resources(resources_to_check, results)
+            update_resource_metrics(resources_to_check, notifications)
+            remove_missing_resources(resources)
+            if state:
+                log_notifications(
+                    state.diff(resources_to_check, notifications, unchecked)
+                    + state.resolve_missing(resources, in_scope)
+                )
+                state.save()
+            else:
+                log_notifications(notifications)
+            checked_resources = resources
+        if changed.wait(timeout=max(0, next_registry_poll - time.monotonic())):
+            time.sleep(settle_seconds)
@@ -0,0 +1,239 @@
+import abc
+import datetime
+import json
+import logging
+import re
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Tuple, Optional
+from urllib.parse import urlparse, parse_qs, urlencode
+
+logger = logging.getLogger(__name__)
+
+FAKE_TOKEN = "fake-registry-token"
+
+REGISTRY_PATH = re.compile(r"^/([^/]+)/v2/(.+)/(tags/list|manifests/[^/]+)$")
+TOKEN_PATH = re.compile(r"^/([^/]+)/token$")
+
+# The API paths of each kind of object listed into a snapshot, as (API group prefix, plural) pairs
+API_SERVER_KINDS = {
+    "pods": ("/api/v1", "pods"),
+    "deployments": ("/apis/apps/v1", "deployments"),
+    "replica_sets": ("/apis/apps/v1", "replicasets"),
+    "stateful_sets": ("/apis/apps/v1", "statefulsets"),
+    "daemon_sets": ("/apis/apps/v1", "daemonsets"),
+    "cron_jobs": ("/apis/batch/v1beta1", "cronjobs"),
+    "nodes": ("/api/v1", "nodes"),
+}
+API_SERVER_PATH = re.compile(
+    r"^(/api/v1|/apis/apps/v1|/apis/batch/v1beta1)(?:/namespaces/([^/]+))?/([a-z]+)$"
+)
+
+
+class FakeServer(abc.ABC):
+    """
+    A local HTTP server running on its own thread, on a free port. Subclasses handle requests with `handle`, which
+    returns the status, headers and body of the response. Requests are counted by the name `handle` gives them.
+    """
+
+    def __init__(self):
+        self.request_counts = Counter()
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._respond(include_body=True)
+
+            def do_HEAD(self):
+                self._respond(include_body=False)
+
+            def _respond(self, include_body: bool):
+                name, status, headers, body = server.handle(
+                    self.command, self.path, self.headers
+                )
+                with server._lock:
+                    server.request_counts[name] += 1
+                self.send_response(status)
+                for header, value in headers.items():
+                    self.send_header(header, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if include_body:
+                    self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name=type(self).__name__, daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:{port}".format(port=self._server.server_address[1])
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    @abc.abstractmethod
+    def handle(
+        self, method: str, path: str, headers
+    ) -> Tuple[str, int, Dict[str, str], bytes]:
+        pass
+
+
+class FakeRegistry(FakeServer):
+    """
+    Serves the parts of the docker registry v2 API that the checker uses, for any number of registry hosts. Requests
+    for `https://{host}/{path}` are expected at `/{host}/{path}`. Repositories are protected by bearer token auth, with
+    the token service served by the fake too, and tag lists are paginated with `n`/`last` and `Link` headers.
+
+    `hosts` maps each host to its repositories, each of which is a dictionary with its `tags` and `manifests`. Each
+    manifest is a dictionary with its `digest`, `media_type` and, optionally, its `body`.
+    """
+
+    def __init__(self, hosts: Dict[str, Dict[str, dict]]):
+        super().__init__()
+        self.hosts = hosts
+
+    def handle(self, method: str, path: str, headers):
+        parsed_path = urlparse(path)
+        token_match = TOKEN_PATH.match(parsed_path.path)
+        if token_match:
+            return (
+                "{host} auth".format(host=token_match.group(1)),
+                200,
+                {"Content-Type": "application/json"},
+                json.dumps(
+                    {
+                        "token": FAKE_TOKEN,
+                        "expires_in": 300,
+                        "issued_at": datetime.datetime.now(
+                            datetime.timezone.utc
+                        ).isoformat(),
+                    }
+                ).encode(),
+            )
+
+        match = REGISTRY_PATH.match(parsed_path.path)
+        if not match:
+            return "other", 404, {}, b""
+        host, repository, operation = match.groups()
+        name = "{host} {operation}".format(host=host, operation=operation.split("/")[0])
+        if headers.get("Authorization") != "Bearer {token}".format(token=FAKE_TOKEN):
+            return (
+                name,
+                401,
+                {
+                    "WWW-Authenticate": 'Bearer realm="{url}/{host}/token",service="{host}",'
+                    'scope="repository:{repository}:pull"'.format(
+                        url=self.url, host=host, repository=repository
+                    )
+                },
+                b"",
+            )
+        repository_fixture = self.hosts.get(host, {}).get(repository)
+        if repository_fixture is None:
+            return name, 404, {}, b""
+        if operation == "tags/list":
+            return (name,) + self._tags_page(
+                repository, repository_fixture["tags"], parse_qs(parsed_path.query)
+            )
+        return (name,) + self._manifest(
+            method,
+            repository_fixture["manifests"].get(operation.split("/", 1)[1]),
+            headers.get("If-None-Match"),
+        )
+
+    def _tags_page(
+        self, repository: str, tags: List[str], query: Dict[str, List[str]]
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        page_size = int(query.get("n", [len(tags) or 1])[0])
+        start = tags.index(query["last"][0]) + 1 if "last" in query else 0
+        page = tags[start : start + page_size]
+        headers = {"Content-Type": "application/json"}
+        if start + page_size < len(tags):
+            headers["Link"] = '</v2/{repository}/tags/list?{query}>; rel="next"'.format(
+                repository=repository,
+                query=urlencode({"n": page_size, "last": page[-1]}),
+            )
+        return (200, headers, json.dumps({"name": repository, "tags": page}).encode())
+
+    def _manifest(
+        self, method: str, manifest: Optional[dict], if_none_match: Optional[str]
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        if manifest is None:
+            return 404, {}, b""
+        etag = '"{digest}"'.format(digest=manifest["digest"])
+        headers = {
+            "Content-Type": manifest["media_type"],
+            "Docker-Content-Digest": manifest["digest"],
+            "ETag": etag,
+        }
+        if if_none_match == etag:
+            return 304, headers, b""
+        body = manifest.get("body") or {"schemaVersion": 2}
+        return 200, headers, json.dumps(body).encode()
+
+
+class FakeApiServer(FakeServer):
+    """
+    Serves list requests for the kinds of object that go into a `ClusterSnapshot`, across all namespaces or in one, and
+    for the namespaces themselves, with `limit`/`continue` pagination. `kinds` maps each snapshot kind (e.g.
+    `replica_sets`) to its objects, as the API server would return them in JSON.
+    """
+
+    def __init__(self, kinds: Dict[str, List[dict]]):
+        super().__init__()
+        self.kinds_by_path = {
+            (prefix, plural): kinds.get(kind, [])
+            for kind, (prefix, plural) in API_SERVER_KINDS.items()
+        }
+        # Namespaces are served from those of the objects, as recordings don't include them
+        self.kinds_by_path[("/api/v1", "namespaces")] = [
+            {"metadata": {"name": namespace, "uid": namespace}}
+            for namespace in sorted(
+                {
+                    item["metadata"]["namespace"]
+                    for items in kinds.values()
+                    for item in items
+                    if item["metadata"].get("namespace")
+                }
+            )
+        ]
+
+    def handle(self, method: str, path: str, headers):
+        parsed_path = urlparse(path)
+        match = API_SERVER_PATH.match(parsed_path.path)
+        if not match or (match.group(1), match.group(3)) not in self.kinds_by_path:
+            return "other", 404, {}, b""
+        prefix, namespace, plural = match.groups()
+        items = self.kinds_by_path[(prefix, plural)]
+        if namespace:
+            items = [
+                item for item in items if item["metadata"].get("namespace") == namespace
+            ]
+        query = parse_qs(parsed_path.query)
+        start = int(query.get("continue", ["0"])[0])
+        limit = int(query.get("limit", [len(items) or 1])[0])
+        metadata = {"resourceVersion": "1"}
+        if start + limit < len(items):
+            metadata["continue"] = str(start + limit)
+        return (
+            "list {plural}".format(plural=plural),
+            200,
+            {"Content-Type": "application/json"},
+            json.dumps(
+                {"metadata": metadata, "items": items[start : start + limit]}
+            ).encode(),
+        )
@@ -0,0 +1,103 @@
+import functools
+import re
+
+from attr import dataclass
+
+DOCKER_HUB_HOST = "registry-1.docker.io"
+
+# Names that image references use for Docker Hub, which is served from `DOCKER_HUB_HOST`
+DOCKER_HUB_ALIASES = {"docker.io", "index.docker.io", DOCKER_HUB_HOST}
+
+REPOSITORY = re.compile(
+    r"^[a-z0-9]+(?:(?:[._]|__|-+)[a-z0-9]+)*(?:/[a-z0-9]+(?:(?:[._]|__|-+)[a-z0-9]+)*)*$"
+)
+TAG = re.compile(r"^[\w][\w.-]{0,127}$")
+DIGEST = re.compile(r"^[a-z0-9]+(?:[.+_-][a-z0-9]+)*:[a-fA-F0-9]{32,}$")
+
+
+@dataclass(frozen=True)
+class ImageRef:
+    """
+    An image reference, as given in a pod spec, split into the registry host, the repository on that registry and the
+    tag and digest, either of which may be empty. Images on Docker Hub are given their full repository name, e.g.
+    `library/nginx`.
+    """
+
+    host: str
+    repository: str
+    tag: str = ""
+    digest: str = ""
+
+    @property
+    def name(self) -> str:
+        """
+        The image without its tag or digest, written as short as it can be, e.g. `nginx` or `quay.io/org/app`.
+        """
+        if self.host != DOCKER_HUB_HOST:
+            return "{host}/{repository}".format(
+                host=self.host, repository=self.repository
+            )
+        if self.repository.startswith("library/") and self.repository.count("/") == 1:
+            return self.repository[len("library/") :]
+        return self.repository
+
+    @property
+    def repository_ref(self) -> "ImageRef":
+        """
+        The reference without its tag or digest, which registry lookups for any tag of the image share.
+        """
+        if not (self.tag or self.digest):
+            return self
+        return get_repository_ref(self.host, self.repository)
+
+    @property
+    def pull_tag(self) -> str:
+        """
+        The tag that is pulled for this reference, which is `latest` if none is given.
+        """
+        return self.tag or "latest"
+
+    def __str__(self):
+        return "{name}{tag}{digest}".format(
+            name=self.name,
+            tag=":" + self.tag if self.tag else "",
+            digest="@" + self.digest if self.digest else "",
+        )
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_image_ref(image: str) -> ImageRef:
+    """
+    Parses an image reference such as `nginx:1.17`, `registry:5000/team/app:1.2` or `app@sha256:...`. Each image string
+    is only parsed once, and every use of it shares the same `ImageRef`.
+    """
+    name, _, digest = image.partition("@")
+    last_slash = name.rfind("/")
+    tag = ""
+    if name.rfind(":") > last_slash:
+        name, tag = name.rsplit(":", 1)
+    first_component, _, rest = name.partition("/")
+    if rest and (
+        "." in first_component
+        or ":" in first_component
+        or first_component == "localhost"
+    ):
+        host, repository = first_component, rest
+    else:
+        host, repository = DOCKER_HUB_HOST, name
+    if host in DOCKER_HUB_ALIASES:
+        host = DOCKER_HUB_HOST
+        if "/" not in repository:
+            repository = "library/{repository}".format(repository=repository)
+    if (
+        not REPOSITORY.match(repository)
+        or (tag and not TAG.match(tag))
+        or (digest and not DIGEST.match(digest))
+    ):
+        raise Exception("Illegal docker image name: {image}".format(image=image))
+    return ImageRef(host, repository, tag, digest)
+
+
+@functools.lru_cache(maxsize=65536)
+def get_repository_ref(host: str, repository: str) -> ImageRef:
+    return ImageRef(host, repository)
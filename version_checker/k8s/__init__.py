@@ -1,22 +1,31 @@
+import json
+import logging
 from functools import partial
-from typing import Tuple, Dict
+from typing import Callable, List, Tuple, Iterator, Optional
 
 from kubernetes import client
+from kubernetes.client.rest import ApiException
 
-from version_checker.k8s.model import Container, K8sFetcherFunctions
+from version_checker.k8s.model import (
+    Container,
+    K8sFetcherFunctions,
+    ObjectRecord,
+    Resource,
+)
+from version_checker.timing import timed
+
+logger = logging.getLogger(__name__)
 
 IGNORE_ANNOTATION = "growse.com/k8s-version-checker-ignore"
 VERSION_PATTERN_ANNOTATION = "growse.com/k8s-version-checker-tag-regex"
 
 
-def get_label_selector_from_dict(labels: Dict[str, str]) -> str:
-    return ",".join(["{k}={v}".format(k=key, v=val) for key, val in labels.items()])
-
-
-def get_api_functions(namespace: str = None) -> K8sFetcherFunctions:
-    v1apps = client.AppsV1Api()
-    v1core = client.CoreV1Api()
-    v1batch = client.BatchV1beta1Api()
+def get_api_functions(
+    namespace: str = None, api_client: client.ApiClient = None
+) -> K8sFetcherFunctions:
+    v1apps = client.AppsV1Api(api_client)
+    v1core = client.CoreV1Api(api_client)
+    v1batch = client.BatchV1beta1Api(api_client)
     if namespace:
         get_replica_set_fn = partial(v1apps.list_namespaced_replica_set, namespace)
         get_pod_fn = partial(v1core.list_namespaced_pod, namespace)
@@ -38,14 +47,143 @@ def get_api_functions(namespace: str = None) -> K8sFetcherFunctions:
         get_stateful_set_fn,
         get_daemon_set_fn,
         get_cronjob_fn,
+        partial(v1core.list_node),
     )
 
 
+def get_namespaces(api_client: client.ApiClient = None) -> List[str]:
+    return [
+        namespace.metadata.name
+        for namespace in client.CoreV1Api(api_client).list_namespace().items
+    ]
+
+
 def get_container_from_status(node_name: str, container_status) -> Container:
     return Container(node_name, container_status.image, container_status.image_id)
 
 
-def top_level_not_ignored_resource(item) -> bool:
-    return not item.metadata.owner_references and not item.metadata.annotations.get(
+def get_containers_from_pod_status(node_name: str, pod_status) -> List[Container]:
+    """
+    The containers of a pod that have an image, including its init containers and any ephemeral (debug) containers.
+    Pending pods may have no statuses yet, and containers still waiting for their image to be pulled have no image ID.
+    """
+    if pod_status is None:
+        return []
+    return [
+        get_container_from_status(node_name, container_status)
+        for container_statuses in (
+            pod_status.container_statuses,
+            pod_status.init_container_statuses,
+            # Only clients for kubernetes 1.16 and later have ephemeral containers
+            getattr(pod_status, "ephemeral_container_statuses", None),
+        )
+        for container_status in container_statuses or []
+        if container_status.image_id
+    ]
+
+
+def get_containers_from_raw_pod_status(
+    node_name: str, pod_status: dict
+) -> List[Container]:
+    return [
+        Container(node_name, container_status["image"], container_status["imageID"])
+        for statuses_key in (
+            "containerStatuses",
+            "initContainerStatuses",
+            "ephemeralContainerStatuses",
+        )
+        for container_status in (pod_status or {}).get(statuses_key) or []
+        if container_status.get("imageID")
+    ]
+
+
+def get_platform(operating_system: str, architecture: str) -> str:
+    if not (operating_system and architecture):
+        return ""
+    return "{os}/{architecture}".format(os=operating_system, architecture=architecture)
+
+
+def top_level_not_ignored_resource(record: ObjectRecord) -> bool:
+    return not record.owner_uids and not record.annotations.get(
         IGNORE_ANNOTATION, False
     )
+
+
+def get_resource(kind: str, record: ObjectRecord, cluster: str = "") -> Resource:
+    return Resource(
+        kind=kind,
+        name=record.name,
+        uid=record.uid,
+        tag_version_pattern_annotation=record.annotations.get(
+            VERSION_PATTERN_ANNOTATION, ""
+        ),
+        image_spec=frozenset(record.images),
+        cluster=cluster,
+        namespace=record.namespace,
+    )
+
+
+def list_in_pages(
+    list_fn: partial,
+    reduce_fn: Callable[[object], ObjectRecord],
+    page_size: int,
+    raw: bool = False,
+) -> Tuple[List[ObjectRecord], str]:
+    """
+    Lists every object using `limit`/`continue` pagination, reducing each page to records before the next is fetched
+    so that only one page of full API models is in memory at a time. Returns the records and the resource version of
+    the list.
+    """
+    records = {}
+    resource_version = None
+    for page, resource_version in iter_pages(list_fn, reduce_fn, page_size, raw):
+        records.update((record.uid, record) for record in page)
+    return list(records.values()), resource_version
+
+
+def iter_pages(
+    list_fn: partial,
+    reduce_fn: Callable[[object], ObjectRecord],
+    page_size: int,
+    raw: bool = False,
+) -> Iterator[Tuple[List[ObjectRecord], Optional[str]]]:
+    """
+    Lists every object using `limit`/`continue` pagination, yielding each page as records as soon as it arrives, along
+    with the resource version of the list once the last page has. If the continue token expires part way through, the
+    listing starts again, so objects from the earlier pages are yielded again.
+
+    When `raw` is set, the client's model deserialisation is skipped: each page's JSON is parsed once and `reduce_fn`
+    is given the plain dictionaries.
+    """
+    continue_token = None
+    timing_name = getattr(list_fn, "func", list_fn).__name__
+    while True:
+        # The client sends `continue` whenever it is passed, even as None, so it is only passed once there is a token
+        continue_kwargs = {"_continue": continue_token} if continue_token else {}
+        try:
+            if raw:
+                with timed("k8s", timing_name):
+                    response = list_fn(
+                        limit=page_size, _preload_content=False, **continue_kwargs
+                    )
+                page = json.loads(response.data)
+                items = page["items"] or []
+                continue_token = page["metadata"].get("continue")
+                resource_version = page["metadata"].get("resourceVersion")
+            else:
+                with timed("k8s", timing_name):
+                    response = list_fn(limit=page_size, **continue_kwargs)
+                items = response.items
+                continue_token = response.metadata._continue
+                resource_version = response.metadata.resource_version
+        except ApiException as e:
+            if e.status != 410 or continue_token is None:
+                raise
+            logger.info("List continue token expired, listing again from the start")
+            continue_token = None
+            continue
+        records = [reduce_fn(item) for item in items]
+        if not continue_token:
+            yield records, resource_version
+            return
+        yield records, None
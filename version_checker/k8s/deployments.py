@@ -1,50 +1,23 @@
-from functools import partial
 from typing import Dict, List
 
-from kubernetes.client import V1Deployment, V1Pod
+from version_checker.k8s import top_level_not_ignored_resource, get_resource
+from version_checker.k8s.model import Resource, Container, ObjectRecord
+from version_checker.k8s.snapshot import ClusterSnapshot
 
-from version_checker.k8s import (
-    top_level_not_ignored_resource,
-    get_container_from_status,
-    VERSION_PATTERN_ANNOTATION,
-    get_label_selector_from_dict,
-)
-from version_checker.k8s.model import Resource, Container, K8sFetcherFunctions
 
+def get_top_level_deployments(snapshot: ClusterSnapshot) -> Dict[Resource, Container]:
 
-def get_top_level_deployments(
-    k8s_fetcher_functions: K8sFetcherFunctions
-) -> Dict[Resource, Container]:
-
-    k8s_deployment_response = k8s_fetcher_functions.get_deployment_fn()
     top_level_not_ignored_deployments = [
         deployment
-        for deployment in k8s_deployment_response.items
+        for deployment in snapshot.deployments
         if top_level_not_ignored_resource(deployment)
     ]
 
     top_level_deployments = {
-        Resource(
-            kind="Deployment",
-            name=deployment.metadata.name,
-            uid=deployment.metadata.uid,
-            tag_version_pattern_annotation=deployment.metadata.annotations.get(
-                VERSION_PATTERN_ANNOTATION, ""
-            ),
-            image_spec=frozenset(
-                {
-                    str(container_spec.image)
-                    for container_spec in deployment.spec.template.spec.containers
-                }
-            ),
-        ): [
-            get_container_from_status(pod.spec.node_name, container)
-            for pod in get_pods_for_deployment(
-                deployment,
-                k8s_fetcher_functions.get_replica_set_fn,
-                k8s_fetcher_functions.get_pods_fn,
-            )
-            for container in pod.status.container_statuses
+        get_resource("Deployment", deployment, snapshot.cluster): [
+            container
+            for pod in get_pods_for_deployment(deployment, snapshot)
+            for container in pod.containers
         ]
         for deployment in top_level_not_ignored_deployments
     }
@@ -53,17 +26,10 @@ def get_top_level_deployments(
 
 
 def get_pods_for_deployment(
-    deployment: V1Deployment, get_replica_sets: partial, get_pods: partial
-) -> List[V1Pod]:
-    replica_set_labels = deployment.spec.template.metadata.labels
-
-    replica_set_label_selector = get_label_selector_from_dict(replica_set_labels)
-    replica_sets = get_replica_sets(label_selector=replica_set_label_selector)
-    pod_label_specs: List[Dict[str, str]] = [
-        item.spec.template.metadata.labels for item in replica_sets.items
-    ]
+    deployment: ObjectRecord, snapshot: ClusterSnapshot
+) -> List[ObjectRecord]:
     return [
         pod
-        for labels in pod_label_specs
-        for pod in get_pods(label_selector=get_label_selector_from_dict(labels)).items
+        for replica_set in snapshot.get_replica_sets_for_owner(deployment.uid)
+        for pod in snapshot.get_pods_for_owner(replica_set.uid)
     ]
@@ -1,5 +1,5 @@
 from functools import partial
-from typing import Tuple, Optional, Set, FrozenSet
+from typing import Tuple, Optional, FrozenSet, Dict
 
 from attr import dataclass
 
@@ -11,6 +11,8 @@ class Resource:
     uid: str
     tag_version_pattern_annotation: str
     image_spec: FrozenSet[str]
+    cluster: str = ""
+    namespace: str = ""
 
     def __str__(self):
         return "{kind}: {name} ({uid})".format(
@@ -23,6 +25,25 @@ class Container:
     server: str
     image: str
     image_id: str
+    platform: str = ""
+
+
+@dataclass(frozen=True, slots=True)
+class ObjectRecord:
+    """
+    The few fields of a kubernetes object that the checker uses. Listed objects are reduced to these as soon as each
+    page arrives, so the full API models never have to be held for the whole cluster. Nodes are reduced to their name
+    and `platform`, as `os/architecture`.
+    """
+
+    name: str
+    namespace: str
+    uid: str
+    annotations: Dict[str, str]
+    owner_uids: Tuple[str, ...]
+    images: Tuple[str, ...]
+    containers: Tuple[Container, ...] = ()
+    platform: str = ""
 
 
 @dataclass(frozen=True)
@@ -33,3 +54,4 @@ class K8sFetcherFunctions:
     get_stateful_set_fn: partial
     get_daemon_set_fn: partial
     get_cronjob_fn: partial
+    get_nodes_fn: Optional[partial] = None
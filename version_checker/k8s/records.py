@@ -0,0 +1,149 @@
+from typing import Union
+
+from kubernetes.client import (
+    V1Pod,
+    V1ReplicaSet,
+    V1Deployment,
+    V1DaemonSet,
+    V1StatefulSet,
+    V1beta1CronJob,
+    V1PodSpec,
+    V1Node,
+)
+
+from version_checker.k8s import (
+    IGNORE_ANNOTATION,
+    VERSION_PATTERN_ANNOTATION,
+    get_containers_from_pod_status,
+    get_containers_from_raw_pod_status,
+    get_platform,
+)
+from version_checker.k8s.model import ObjectRecord
+
+
+def reduce_object(item, pod_spec: V1PodSpec = None, containers=()) -> ObjectRecord:
+    annotations = item.metadata.annotations or {}
+    return ObjectRecord(
+        name=item.metadata.name,
+        namespace=item.metadata.namespace,
+        uid=item.metadata.uid,
+        annotations={
+            key: annotations[key]
+            for key in (IGNORE_ANNOTATION, VERSION_PATTERN_ANNOTATION)
+            if key in annotations
+        },
+        owner_uids=tuple(
+            owner_reference.uid
+            for owner_reference in item.metadata.owner_references or []
+        ),
+        images=tuple(
+            str(container.image)
+            for container in (pod_spec.init_containers or []) + pod_spec.containers
+        )
+        if pod_spec
+        else (),
+        containers=tuple(containers),
+    )
+
+
+def reduce_workload(
+    item: Union[V1Deployment, V1DaemonSet, V1StatefulSet]
+) -> ObjectRecord:
+    return reduce_object(item, item.spec.template.spec)
+
+
+def reduce_cron_job(item: V1beta1CronJob) -> ObjectRecord:
+    return reduce_object(item, item.spec.job_template.spec.template.spec)
+
+
+def reduce_replica_set(item: V1ReplicaSet) -> ObjectRecord:
+    return reduce_object(item)
+
+
+def reduce_pod(item: V1Pod) -> ObjectRecord:
+    return reduce_object(
+        item,
+        item.spec,
+        get_containers_from_pod_status(item.spec.node_name, item.status),
+    )
+
+
+def reduce_node(item: V1Node) -> ObjectRecord:
+    node_info = item.status.node_info if item.status else None
+    return ObjectRecord(
+        name=item.metadata.name,
+        namespace=None,
+        uid=item.metadata.uid,
+        annotations={},
+        owner_uids=(),
+        images=(),
+        platform=get_platform(node_info.operating_system, node_info.architecture)
+        if node_info
+        else "",
+    )
+
+
+def reduce_raw_object(item: dict, pod_spec: dict = None, containers=()) -> ObjectRecord:
+    metadata = item["metadata"]
+    annotations = metadata.get("annotations") or {}
+    return ObjectRecord(
+        name=metadata.get("name"),
+        namespace=metadata.get("namespace"),
+        uid=metadata.get("uid"),
+        annotations={
+            key: annotations[key]
+            for key in (IGNORE_ANNOTATION, VERSION_PATTERN_ANNOTATION)
+            if key in annotations
+        },
+        owner_uids=tuple(
+            owner_reference["uid"]
+            for owner_reference in metadata.get("ownerReferences") or []
+        ),
+        images=tuple(
+            str(container.get("image"))
+            for container in (pod_spec.get("initContainers") or [])
+            + pod_spec["containers"]
+        )
+        if pod_spec
+        else (),
+        containers=tuple(containers),
+    )
+
+
+def reduce_raw_workload(item: dict) -> ObjectRecord:
+    return reduce_raw_object(item, item["spec"]["template"]["spec"])
+
+
+def reduce_raw_cron_job(item: dict) -> ObjectRecord:
+    return reduce_raw_object(
+        item, item["spec"]["jobTemplate"]["spec"]["template"]["spec"]
+    )
+
+
+def reduce_raw_replica_set(item: dict) -> ObjectRecord:
+    return reduce_raw_object(item)
+
+
+def reduce_raw_pod(item: dict) -> ObjectRecord:
+    return reduce_raw_object(
+        item,
+        item["spec"],
+        get_containers_from_raw_pod_status(
+            item["spec"].get("nodeName"), item.get("status")
+        ),
+    )
+
+
+def reduce_raw_node(item: dict) -> ObjectRecord:
+    node_info = (item.get("status") or {}).get("nodeInfo") or {}
+    return ObjectRecord(
+        name=item["metadata"].get("name"),
+        namespace=None,
+        uid=item["metadata"].get("uid"),
+        annotations={},
+        owner_uids=(),
+        images=(),
+        platform=get_platform(
+            node_info.get("operatingSystem"), node_info.get("architecture")
+        ),
+    )
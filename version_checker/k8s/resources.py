@@ -0,0 +1,221 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Iterator, Tuple, Callable
+
+from attr import dataclass
+
+from version_checker.k8s.cronjobs import get_top_level_cronjobs
+from version_checker.k8s.daemon_sets import get_top_level_daemon_sets
+from version_checker.k8s.deployments import get_top_level_deployments
+from version_checker.k8s.model import (
+    Resource,
+    Container,
+    K8sFetcherFunctions,
+    ObjectRecord,
+)
+from version_checker.k8s.pods import get_top_level_pods
+from version_checker.k8s.snapshot import (
+    ClusterSnapshot,
+    SNAPSHOT_KINDS,
+    iter_listings,
+    iter_record_pages,
+    list_records,
+)
+from version_checker.k8s.stateful_sets import get_top_level_stateful_sets
+from version_checker.timing import timed
+
+logger = logging.getLogger(__name__)
+
+TOP_LEVEL_RESOURCE_FUNCTIONS = [
+    get_top_level_deployments,
+    get_top_level_daemon_sets,
+    get_top_level_stateful_sets,
+    get_top_level_pods,
+    get_top_level_cronjobs,
+]
+
+# Top level resources that are built from a single object, and so can be checked as soon as its page has been listed
+STREAMED_RESOURCE_FUNCTIONS = {
+    "pods": get_top_level_pods,
+    "cron_jobs": get_top_level_cronjobs,
+}
+# Top level resources that are joined to the pods they own, and so can only be checked once every pod has been listed
+JOINED_RESOURCE_FUNCTIONS = [
+    get_top_level_deployments,
+    get_top_level_daemon_sets,
+    get_top_level_stateful_sets,
+]
+
+# How long a listing waits for room in the queue of listed resources before checking that they are still wanted
+queue_poll_seconds = 0.1
+
+
+@dataclass(frozen=True)
+class _ClusterListed:
+    cluster: str
+
+
+def get_top_level_resources(
+    snapshot: ClusterSnapshot
+) -> Dict[Resource, List[Container]]:
+    return {
+        resource: containers
+        for get_top_level_fn in TOP_LEVEL_RESOURCE_FUNCTIONS
+        for resource, containers in get_top_level_fn(snapshot).items()
+    }
+
+
+def iter_cluster_resources(
+    clusters: Dict[str, List[K8sFetcherFunctions]],
+    max_api_requests: int = 1,
+    max_queued: int = 100,
+) -> Iterator[Tuple[Resource, List[Container]]]:
+    """
+    Lists each cluster concurrently, yielding each top level resource as soon as it can be built, whichever cluster it
+    is in. Each cluster is allowed `max_api_requests` list requests in flight, since they are served by different API
+    servers. At most `max_queued` listed resources wait to be taken, beyond which listing pauses until they are.
+    """
+    resource_queue = queue.Queue(maxsize=max_queued)
+    stopped = threading.Event()
+
+    def put(item) -> None:
+        while not stopped.is_set():
+            try:
+                resource_queue.put(item, timeout=queue_poll_seconds)
+                return
+            except queue.Full:
+                continue
+        raise Exception("Listed resources are no longer wanted")
+
+    def list_cluster(cluster: str, k8s_fetcher_functions: List[K8sFetcherFunctions]):
+        try:
+            stream_cluster_resources(
+                k8s_fetcher_functions, max_api_requests, cluster, put
+            )
+        finally:
+            put(_ClusterListed(cluster))
+
+    with ThreadPoolExecutor(max_workers=len(clusters)) as executor:
+        try:
+            futures = {
+                cluster: executor.submit(list_cluster, cluster, k8s_fetcher_functions)
+                for cluster, k8s_fetcher_functions in clusters.items()
+            }
+            listing = len(futures)
+            while listing:
+                item = resource_queue.get()
+                if isinstance(item, _ClusterListed):
+                    # Raises if the cluster couldn't be listed
+                    futures[item.cluster].result()
+                    listing -= 1
+                else:
+                    yield item
+        finally:
+            # Lets listings blocked on a full queue give up, if the resources stop being taken part way through
+            stopped.set()
+
+
+def stream_cluster_resources(
+    k8s_fetcher_functions: List[K8sFetcherFunctions],
+    max_api_requests: int,
+    cluster: str,
+    emit: Callable[[Tuple[Resource, List[Container]]], None],
+) -> None:
+    """
+    Lists every kind of object in each namespace's fetcher functions, passing each top level resource to `emit` as
+    soon as it can be built. Nodes are listed first, for the platforms of the containers on them. Pods and cron jobs
+    that have no owner are then passed on as each page of them arrives, while the workloads are held, along with the
+    pods and replica sets that have owners, until everything has been listed and they can be joined. Listings are run
+    concurrently, with at most `max_api_requests` of them in flight at once.
+    """
+    listings = [
+        (kind, list_fn, reduce_fn, reduce_raw_fn)
+        for kind, list_fn, _, reduce_fn, reduce_raw_fn in iter_listings(
+            k8s_fetcher_functions
+        )
+    ]
+    nodes = [
+        node
+        for kind, list_fn, reduce_fn, reduce_raw_fn in listings
+        if kind == "nodes"
+        for node in list_records(kind, list_fn, reduce_fn, reduce_raw_fn)[0]
+    ]
+    # Held by UID, as a listing that has to start again part way through lists some objects twice
+    held: Dict[str, Dict[str, ObjectRecord]] = {
+        kind: {} for kind in SNAPSHOT_KINDS if kind != "nodes"
+    }
+    streamed = set()
+    lock = threading.Lock()
+
+    def list_kind(kind, list_fn, reduce_fn, reduce_raw_fn) -> None:
+        get_top_level_fn = STREAMED_RESOURCE_FUNCTIONS.get(kind)
+        for records in iter_record_pages(kind, list_fn, reduce_fn, reduce_raw_fn):
+            with lock:
+                held[kind].update(
+                    (record.uid, record)
+                    for record in records
+                    if not get_top_level_fn or record.owner_uids
+                )
+                if get_top_level_fn:
+                    page_snapshot = _get_snapshot({kind: records}, nodes, cluster)
+                    resources = [
+                        (resource, containers)
+                        for resource, containers in get_top_level_fn(
+                            page_snapshot
+                        ).items()
+                        if (resource.kind, resource.uid) not in streamed
+                    ]
+                    streamed.update(
+                        (resource.kind, resource.uid) for resource, _ in resources
+                    )
+                else:
+                    resources = []
+            for resource_containers in resources:
+                emit(resource_containers)
+
+    with timed("phases", "k8s listing"), ThreadPoolExecutor(
+        max_workers=max_api_requests
+    ) as executor:
+        futures = [
+            executor.submit(list_kind, *listing)
+            for listing in listings
+            if listing[0] != "nodes"
+        ]
+        for future in futures:
+            future.result()
+    snapshot = _get_snapshot(
+        {kind: list(records.values()) for kind, records in held.items()}, nodes, cluster
+    )
+    logger.info(
+        "Listed{of_cluster}: {streamed} pods and cron jobs already passed on, {pod_count} pods and {replica_set_count} "
+        "replica sets to join to their owners".format(
+            of_cluster=" {cluster}".format(cluster=cluster) if cluster else "",
+            streamed=len(streamed),
+            pod_count=len(snapshot.pods),
+            replica_set_count=len(snapshot.replica_sets),
+        )
+    )
+    for get_top_level_fn in JOINED_RESOURCE_FUNCTIONS:
+        for resource_containers in get_top_level_fn(snapshot).items():
+            emit(resource_containers)
+
+
+def _get_snapshot(
+    records_by_kind: Dict[str, List[ObjectRecord]],
+    nodes: List[ObjectRecord],
+    cluster: str,
+) -> ClusterSnapshot:
+    """
+    A snapshot of some of the objects of a cluster, with none of the kinds that aren't given.
+    """
+    return ClusterSnapshot(
+        **{
+            kind: records_by_kind.get(kind, [])
+            for kind in SNAPSHOT_KINDS
+            if kind != "nodes"
+        },
+        nodes=nodes,
+        cluster=cluster
+    )
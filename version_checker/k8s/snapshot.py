@@ -0,0 +1,284 @@
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Callable, Tuple, Optional, Iterator, Any
+
+import attr
+from kubernetes.client.rest import ApiException
+
+from version_checker.k8s import list_in_pages, iter_pages
+from version_checker.k8s.model import K8sFetcherFunctions, ObjectRecord
+from version_checker.k8s.records import (
+    reduce_workload,
+    reduce_cron_job,
+    reduce_pod,
+    reduce_replica_set,
+    reduce_node,
+    reduce_raw_workload,
+    reduce_raw_cron_job,
+    reduce_raw_pod,
+    reduce_raw_replica_set,
+    reduce_raw_node,
+)
+from version_checker.timing import timed
+
+logger = logging.getLogger(__name__)
+
+# Number of objects to ask for in each page of a list request
+_list_page_size = 500
+# Whether list responses are parsed as plain JSON rather than deserialised into the client's models
+_raw_lists = False
+# Called with the kind and JSON of every object listed, when the listing is being recorded
+_record_object_fn: Optional[Callable[[str, dict], None]] = None
+
+# The fetcher function, model type and reducers (for models and for raw JSON) that each list in a snapshot is built
+# from
+SNAPSHOT_KINDS = {
+    "deployments": (
+        "get_deployment_fn",
+        "V1Deployment",
+        reduce_workload,
+        reduce_raw_workload,
+    ),
+    "daemon_sets": (
+        "get_daemon_set_fn",
+        "V1DaemonSet",
+        reduce_workload,
+        reduce_raw_workload,
+    ),
+    "stateful_sets": (
+        "get_stateful_set_fn",
+        "V1StatefulSet",
+        reduce_workload,
+        reduce_raw_workload,
+    ),
+    "cron_jobs": (
+        "get_cronjob_fn",
+        "V1beta1CronJob",
+        reduce_cron_job,
+        reduce_raw_cron_job,
+    ),
+    "pods": ("get_pods_fn", "V1Pod", reduce_pod, reduce_raw_pod),
+    "replica_sets": (
+        "get_replica_set_fn",
+        "V1ReplicaSet",
+        reduce_replica_set,
+        reduce_raw_replica_set,
+    ),
+    "nodes": ("get_nodes_fn", "V1Node", reduce_node, reduce_raw_node),
+}
+
+# Kinds that aren't namespaced, so they are only listed once however many namespaces are being checked
+CLUSTER_SCOPED_KINDS = {"nodes"}
+
+# Kinds that a check can do without, so that listing them being forbidden (e.g. to a user who can only read some
+# namespaces) doesn't stop the check
+OPTIONAL_KINDS = {"nodes"}
+
+
+def configure_listing(page_size: int, raw: bool) -> None:
+    global _list_page_size, _raw_lists
+    _list_page_size = page_size
+    _raw_lists = raw
+
+
+def configure_recording(
+    record_object_fn: Optional[Callable[[str, dict], None]]
+) -> None:
+    global _record_object_fn
+    _record_object_fn = record_object_fn
+
+
+def list_records(
+    kind: str,
+    list_fn: partial,
+    reduce_fn: Callable[[object], ObjectRecord],
+    reduce_raw_fn: Callable[[dict], ObjectRecord],
+) -> Tuple[List[ObjectRecord], Optional[str]]:
+    """
+    Lists every object of a kind, returning the records and the resource version of the list. Optional kinds that
+    can't be listed give no records and no resource version.
+    """
+    try:
+        return _list_records(kind, list_fn, reduce_fn, reduce_raw_fn)
+    except ApiException as e:
+        if e.status != 403 or kind not in OPTIONAL_KINDS:
+            raise
+        logger.warning(
+            "Not allowed to list {kind}, continuing without them".format(kind=kind)
+        )
+        return [], None
+
+
+def _list_records(
+    kind: str,
+    list_fn: partial,
+    reduce_fn: Callable[[object], ObjectRecord],
+    reduce_raw_fn: Callable[[dict], ObjectRecord],
+) -> Tuple[List[ObjectRecord], str]:
+    reducer, raw = _get_reducer(kind, reduce_fn, reduce_raw_fn)
+    return list_in_pages(list_fn, reducer, _list_page_size, raw)
+
+
+def iter_record_pages(
+    kind: str,
+    list_fn: partial,
+    reduce_fn: Callable[[object], ObjectRecord],
+    reduce_raw_fn: Callable[[dict], ObjectRecord],
+) -> Iterator[List[ObjectRecord]]:
+    """
+    Lists every object of a kind, yielding the records of each page as soon as it arrives. If the listing has to start
+    again part way through, objects from the earlier pages are yielded again.
+    """
+    reducer, raw = _get_reducer(kind, reduce_fn, reduce_raw_fn)
+    for records, _ in iter_pages(list_fn, reducer, _list_page_size, raw):
+        yield records
+
+
+def _get_reducer(
+    kind: str,
+    reduce_fn: Callable[[object], ObjectRecord],
+    reduce_raw_fn: Callable[[dict], ObjectRecord],
+) -> Tuple[Callable[[Any], ObjectRecord], bool]:
+    """
+    The reducer for the listed objects of a kind, and whether they are to be listed as raw JSON.
+    """
+    if _record_object_fn:
+        # Recorded objects are kept as the API server's JSON, so the raw listing is used whatever the setting
+        record_object_fn = _record_object_fn
+        return lambda item: record_object_fn(kind, item) or reduce_raw_fn(item), True
+    if _raw_lists:
+        return reduce_raw_fn, True
+    return reduce_fn, False
+
+
+class ClusterSnapshot(object):
+    """
+    A point-in-time listing of the workloads, replica sets and pods in a cluster (or namespace), with pods and replica
+    sets indexed by the UID of each object's owner. Each running container is given the platform of its node, so that
+    multi-arch images can be compared with the image manifest for that platform. Top level resources are joined to their
+    pods in memory, so building the resource map costs a fixed number of API calls regardless of how many workloads
+    there are.
+    """
+
+    def __init__(
+        self,
+        deployments: List[ObjectRecord],
+        daemon_sets: List[ObjectRecord],
+        stateful_sets: List[ObjectRecord],
+        cron_jobs: List[ObjectRecord],
+        pods: List[ObjectRecord],
+        replica_sets: List[ObjectRecord],
+        nodes: List[ObjectRecord] = (),
+        cluster: str = "",
+    ):
+        self.cluster = cluster
+        self.deployments = deployments
+        self.daemon_sets = daemon_sets
+        self.stateful_sets = stateful_sets
+        self.cron_jobs = cron_jobs
+        self.node_platforms = {node.name: node.platform for node in nodes}
+        self.pods = with_node_platforms(pods, self.node_platforms)
+        self.replica_sets = replica_sets
+        self._pods_by_owner = index_by_owner_uid(pods)
+        self._replica_sets_by_owner = index_by_owner_uid(replica_sets)
+
+    def get_pods_for_owner(self, owner_uid: str) -> List[ObjectRecord]:
+        return self._pods_by_owner.get(owner_uid, [])
+
+    def get_replica_sets_for_owner(self, owner_uid: str) -> List[ObjectRecord]:
+        return self._replica_sets_by_owner.get(owner_uid, [])
+
+
+def iter_listings(
+    k8s_fetcher_functions: List[K8sFetcherFunctions]
+) -> Iterator[
+    Tuple[
+        str,
+        partial,
+        str,
+        Callable[[object], ObjectRecord],
+        Callable[[dict], ObjectRecord],
+    ]
+]:
+    """
+    Yields the kind, list function, model type and reducers of every listing that goes into a snapshot of the given
+    namespaces' fetcher functions. Cluster scoped kinds are only listed with the first namespace's functions.
+    """
+    for index, fetcher_functions in enumerate(k8s_fetcher_functions):
+        for (
+            kind,
+            (fetcher_function_name, return_type, reduce_fn, reduce_raw_fn),
+        ) in SNAPSHOT_KINDS.items():
+            list_fn = getattr(fetcher_functions, fetcher_function_name)
+            if list_fn is None or (index and kind in CLUSTER_SCOPED_KINDS):
+                continue
+            yield kind, list_fn, return_type, reduce_fn, reduce_raw_fn
+
+
+def with_node_platforms(
+    pods: List[ObjectRecord], node_platforms: Dict[str, str]
+) -> List[ObjectRecord]:
+    """
+    Fills in the platform of each pod's containers from the node the pod is running on.
+    """
+    if not node_platforms:
+        return pods
+    return [
+        attr.evolve(
+            pod,
+            containers=tuple(
+                attr.evolve(container, platform=node_platforms[container.server])
+                if container.server in node_platforms
+                else container
+                for container in pod.containers
+            ),
+        )
+        if pod.containers
+        else pod
+        for pod in pods
+    ]
+
+
+def index_by_owner_uid(records: List[ObjectRecord]) -> Dict[str, List[ObjectRecord]]:
+    index = defaultdict(list)
+    for record in records:
+        for owner_uid in record.owner_uids:
+            index[owner_uid].append(record)
+    return dict(index)
+
+
+def take_snapshot(
+    k8s_fetcher_functions: List[K8sFetcherFunctions],
+    max_api_requests: int = 1,
+    cluster: str = "",
+) -> ClusterSnapshot:
+    """
+    Lists every kind of object in each namespace's fetcher functions into a single snapshot. The listings are
+    independent, so they are run concurrently, with at most `max_api_requests` of them in flight at once.
+    """
+    listings = [
+        (kind, list_fn, reduce_fn, reduce_raw_fn)
+        for kind, list_fn, _, reduce_fn, reduce_raw_fn in iter_listings(
+            k8s_fetcher_functions
+        )
+    ]
+    records_by_kind = {kind: [] for kind in SNAPSHOT_KINDS}
+    with timed("phases", "k8s listing"), ThreadPoolExecutor(
+        max_workers=max_api_requests
+    ) as executor:
+        listed_records = executor.map(
+            lambda listing: list_records(*listing)[0], listings
+        )
+        for (kind, _, _, _), records in zip(listings, listed_records):
+            records_by_kind[kind].extend(records)
+    snapshot = ClusterSnapshot(**records_by_kind, cluster=cluster)
+    logger.info(
+        "Snapshot taken{of_cluster}: {pod_count} pods, {replica_set_count} replica sets".format(
+            of_cluster=" of {cluster}".format(cluster=cluster) if cluster else "",
+            pod_count=len(snapshot.pods),
+            replica_set_count=len(snapshot.replica_sets),
+        )
+    )
+    return snapshot
@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from functools import partial
+from typing import Dict, Callable, List, Optional
+
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+from version_checker.k8s.model import K8sFetcherFunctions, ObjectRecord
+from version_checker.k8s.snapshot import (
+    ClusterSnapshot,
+    SNAPSHOT_KINDS,
+    iter_listings,
+    list_records,
+)
+
+logger = logging.getLogger(__name__)
+
+# How long a single watch request is held open before it is re-established from the last seen resource version
+watch_timeout_seconds = 300
+# How long to wait before relisting after a watch fails unexpectedly
+watch_retry_seconds = 5
+
+
+class KindWatcher(threading.Thread):
+    """
+    Keeps an in-memory copy of every object of one kind up to date. The objects are listed once, and then changes are
+    streamed with a watch from the list's resource version. If the resource version expires (`410 Gone`) the objects
+    are listed again.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        list_fn: partial,
+        return_type: str,
+        reduce_fn: Callable[[object], ObjectRecord],
+        reduce_raw_fn: Callable[[dict], ObjectRecord],
+        changed: threading.Event,
+    ):
+        super().__init__(name="watch-{kind}".format(kind=kind), daemon=True)
+        self.kind = kind
+        self.list_fn = list_fn
+        self.return_type = return_type
+        self.reduce_fn = reduce_fn
+        self.reduce_raw_fn = reduce_raw_fn
+        self.changed = changed
+        self.synced = threading.Event()
+        self._objects: Dict[str, ObjectRecord] = {}
+        self._lock = threading.Lock()
+        self._watch = None
+        self._stopped = False
+
+    def items(self) -> List[ObjectRecord]:
+        with self._lock:
+            return list(self._objects.values())
+
+    def stop(self) -> None:
+        self._stopped = True
+        if self._watch:
+            self._watch.stop()
+
+    def run(self) -> None:
+        while not self._stopped:
+            try:
+                resource_version = self._list()
+                if resource_version is None:
+                    return
+                self._watch_from(resource_version)
+            except Exception:
+                logger.exception(
+                    "Error watching {kind}, relisting".format(kind=self.kind)
+                )
+                time.sleep(watch_retry_seconds)
+
+    def _list(self) -> Optional[str]:
+        records, resource_version = list_records(
+            self.kind, self.list_fn, self.reduce_fn, self.reduce_raw_fn
+        )
+        with self._lock:
+            self._objects = {record.uid: record for record in records}
+        logger.info("Listed {count} {kind}".format(count=len(records), kind=self.kind))
+        self.synced.set()
+        self.changed.set()
+        return resource_version
+
+    def _watch_from(self, resource_version: str) -> None:
+        while not self._stopped:
+            self._watch = watch.Watch(return_type=self.return_type)
+            try:
+                for event in self._watch.stream(
+                    self.list_fn,
+                    resource_version=resource_version,
+                    timeout_seconds=watch_timeout_seconds,
+                ):
+                    if event["type"] == "ERROR":
+                        if event["raw_object"].get("code") == 410:
+                            logger.info(
+                                "Watch of {kind} expired, relisting".format(
+                                    kind=self.kind
+                                )
+                            )
+                            return
+                        raise Exception(
+                            "Error event watching {kind}: {event}".format(
+                                kind=self.kind, event=event["raw_object"]
+                            )
+                        )
+                    item = event["object"]
+                    resource_version = item.metadata.resource_version
+                    if event["type"] == "BOOKMARK":
+                        continue
+                    with self._lock:
+                        if event["type"] == "DELETED":
+                            changed = (
+                                self._objects.pop(item.metadata.uid, None) is not None
+                            )
+                        else:
+                            record = self.reduce_fn(item)
+                            changed = self._objects.get(item.metadata.uid) != record
+                            self._objects[item.metadata.uid] = record
+                    # Most updates (e.g. to a node's status) don't change any field that is kept
+                    if changed:
+                        self.changed.set()
+            except ApiException as e:
+                if e.status == 410:
+                    logger.info(
+                        "Watch of {kind} expired, relisting".format(kind=self.kind)
+                    )
+                    return
+                raise
+
+
+class ClusterModel(object):
+    """
+    An in-memory model of the cluster, kept up to date by a watcher for each namespace and kind of object that goes
+    into a `ClusterSnapshot`. `changed` is set whenever any of the watched objects change.
+    """
+
+    def __init__(
+        self,
+        k8s_fetcher_functions: List[K8sFetcherFunctions],
+        cluster: str = "",
+        changed: threading.Event = None,
+    ):
+        self.cluster = cluster
+        self.changed = changed or threading.Event()
+        self._watchers = [
+            KindWatcher(
+                kind, list_fn, return_type, reduce_fn, reduce_raw_fn, self.changed
+            )
+            for kind, list_fn, return_type, reduce_fn, reduce_raw_fn in iter_listings(
+                k8s_fetcher_functions
+            )
+        ]
+
+    def start(self) -> None:
+        for watcher in self._watchers:
+            watcher.start()
+
+    def stop(self) -> None:
+        for watcher in self._watchers:
+            watcher.stop()
+
+    def wait_until_synced(self) -> None:
+        for watcher in self._watchers:
+            watcher.synced.wait()
+
+    def snapshot(self) -> ClusterSnapshot:
+        records_by_kind = {kind: [] for kind in SNAPSHOT_KINDS}
+        for watcher in self._watchers:
+            records_by_kind[watcher.kind].extend(watcher.items())
+        return ClusterSnapshot(**records_by_kind, cluster=self.cluster)
@@ -0,0 +1,198 @@
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple, Optional
+
+from prometheus_client import (
+    CollectorRegistry,
+    Gauge,
+    Histogram,
+    start_http_server,
+    write_to_textfile,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from version_checker.cache import RegistryCache
+from version_checker.k8s.model import Resource
+from version_checker.notification import (
+    Notification,
+    NewTagNotification,
+    OutOfDateContainerNotification,
+)
+from version_checker.timing import add_timing_observer
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = CollectorRegistry()
+
+RESOURCE_LABELS = ["cluster", "namespace", "kind", "resource", "image"]
+
+out_of_date_containers = Gauge(
+    "version_checker_out_of_date_containers",
+    "Running containers whose image tag now points at a different digest on the registry",
+    RESOURCE_LABELS,
+    registry=REGISTRY,
+)
+newer_tag_available = Gauge(
+    "version_checker_newer_tag_available",
+    "Whether a newer version tag is available for an image in a resource's spec",
+    RESOURCE_LABELS,
+    registry=REGISTRY,
+)
+registry_request_seconds = Histogram(
+    "version_checker_registry_request_seconds",
+    "Latency of requests to container registries",
+    ["host", "operation"],
+    registry=REGISTRY,
+)
+k8s_request_seconds = Histogram(
+    "version_checker_k8s_request_seconds",
+    "Latency of kubernetes API list requests",
+    ["call"],
+    registry=REGISTRY,
+)
+phase_seconds = Histogram(
+    "version_checker_phase_seconds",
+    "Time spent in each phase of a check",
+    ["phase"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, float("inf")),
+    registry=REGISTRY,
+)
+run_duration_seconds = Histogram(
+    "version_checker_run_duration_seconds",
+    "Time taken to check every resource against its registries",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, float("inf")),
+    registry=REGISTRY,
+)
+last_run_timestamp_seconds = Gauge(
+    "version_checker_last_run_timestamp_seconds",
+    "When the last check of every resource finished",
+    registry=REGISTRY,
+)
+
+# The gauge series currently set for each resource, keyed by cluster and UID, so that series can be removed when a
+# resource is fixed or deleted without rebuilding every gauge
+_series: Dict[Tuple[str, str], Dict[Tuple[Gauge, Tuple[str, ...]], float]] = {}
+_lock = threading.Lock()
+
+
+class RegistryCacheCollector(object):
+    """
+    Exposes the hit and miss counts of the registry cache, and the hit ratio, as they are at scrape time.
+    """
+
+    def __init__(self, cache: RegistryCache):
+        self.cache = cache
+
+    def collect(self):
+        hits = CounterMetricFamily(
+            "version_checker_registry_cache_hits", "Registry cache lookups that hit"
+        )
+        hits.add_metric([], self.cache.hits)
+        misses = CounterMetricFamily(
+            "version_checker_registry_cache_misses",
+            "Registry cache lookups that missed",
+        )
+        misses.add_metric([], self.cache.misses)
+        lookups = self.cache.hits + self.cache.misses
+        ratio = GaugeMetricFamily(
+            "version_checker_registry_cache_hit_ratio",
+            "Fraction of registry cache lookups that hit",
+        )
+        ratio.add_metric([], self.cache.hits / lookups if lookups else 0)
+        return [hits, misses, ratio]
+
+
+def configure_metrics(port: Optional[int], cache: Optional[RegistryCache]) -> None:
+    """
+    Starts recording latencies into the histograms and, if a port is given, serves the metrics on `/metrics`.
+    """
+    add_timing_observer(observe_timing)
+    if cache:
+        REGISTRY.register(RegistryCacheCollector(cache))
+    if port:
+        start_http_server(port, registry=REGISTRY)
+        logger.info("Serving metrics on port {port}".format(port=port))
+
+
+def observe_timing(category: str, name: str, seconds: float) -> None:
+    if category == "registry":
+        host, _, operation = name.rpartition(" ")
+        registry_request_seconds.labels(host, operation).observe(seconds)
+    elif category == "k8s":
+        k8s_request_seconds.labels(name).observe(seconds)
+    elif category == "phases":
+        phase_seconds.labels(name).observe(seconds)
+
+
+def get_notification_series(
+    notification: Notification
+) -> Optional[Tuple[Resource, Gauge, str]]:
+    if isinstance(notification, OutOfDateContainerNotification):
+        return notification.owner, out_of_date_containers, notification.container.image
+    if isinstance(notification, NewTagNotification) and notification.owner:
+        return (
+            notification.owner,
+            newer_tag_available,
+            "{image}:{tag}".format(image=notification.image, tag=notification.tag),
+        )
+    return None
+
+
+def update_resource_metrics(
+    resources: Iterable[Resource], notifications: List[Notification]
+) -> None:
+    """
+    Sets the gauges for the given resources, which have just been checked and produced the given notifications. Only
+    the series of these resources are touched, and any series they no longer have are removed.
+    """
+    series_by_resource = {
+        (resource.cluster, resource.uid): {} for resource in resources
+    }
+    for notification in notifications:
+        notification_series = get_notification_series(notification)
+        if notification_series is None:
+            continue
+        owner, gauge, image = notification_series
+        labels = (owner.cluster, owner.namespace, owner.kind, owner.name, image)
+        resource_series = series_by_resource.setdefault((owner.cluster, owner.uid), {})
+        resource_series[(gauge, labels)] = resource_series.get((gauge, labels), 0) + 1
+    with _lock:
+        for key, resource_series in series_by_resource.items():
+            _set_resource_series(key, resource_series)
+
+
+def remove_missing_resources(resources: Iterable[Resource]) -> None:
+    """
+    Removes the series of every resource that is not among the given ones, e.g. because it has been deleted.
+    """
+    present = {(resource.cluster, resource.uid) for resource in resources}
+    with _lock:
+        for key in [key for key in _series if key not in present]:
+            _set_resource_series(key, {})
+
+
+def _set_resource_series(
+    key: Tuple[str, str], resource_series: Dict[Tuple[Gauge, Tuple[str, ...]], float]
+) -> None:
+    for gauge, labels in _series.get(key, {}).keys() - resource_series.keys():
+        gauge.remove(*labels)
+    for (gauge, labels), value in resource_series.items():
+        gauge.labels(*labels).set(value)
+    if resource_series:
+        _series[key] = resource_series
+    else:
+        _series.pop(key, None)
+
+
+def record_run(duration_seconds: float) -> None:
+    run_duration_seconds.observe(duration_seconds)
+    last_run_timestamp_seconds.set(time.time())
+
+
+def write_metrics_textfile(path: str) -> None:
+    """
+    Writes the metrics in the text format, for the node exporter's textfile collector or for pushing to a Pushgateway.
+    """
+    write_to_textfile(path, REGISTRY)
+    logger.info("Wrote metrics to {path}".format(path=path))
@@ -0,0 +1,161 @@
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Callable, TypeVar
+
+from attr import dataclass
+
+from version_checker.images import DOCKER_HUB_ALIASES, DOCKER_HUB_HOST
+from version_checker.ratelimit import has_budget
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class RegistrySource:
+    """
+    A registry host that lookups for an upstream host's images can be sent to. Mirrors that keep each upstream's
+    repositories under a project of their own, such as a Harbor proxy cache, are given that project as a path prefix.
+    """
+
+    host: str
+    path_prefix: str = ""
+
+    def get_repository(self, repository: str) -> str:
+        if not self.path_prefix:
+            return repository
+        return "{prefix}/{repository}".format(
+            prefix=self.path_prefix, repository=repository
+        )
+
+    def __str__(self):
+        return "/".join(part for part in (self.host, self.path_prefix) if part)
+
+
+_mirrors: Dict[str, List[RegistrySource]] = {}
+_sources: Dict[str, Counter] = {}
+_lock = threading.Lock()
+
+
+def normalise_registry_host(host: str) -> str:
+    """
+    Strips any scheme and path from a registry address, and gives Docker Hub's aliases the host its API is served from.
+    """
+    host = host.split("://", 1)[-1].split("/", 1)[0]
+    return DOCKER_HUB_HOST if host in DOCKER_HUB_ALIASES else host
+
+
+def parse_registry_source(mirror: str) -> RegistrySource:
+    host, _, path_prefix = mirror.split("://", 1)[-1].partition("/")
+    return RegistrySource(host, path_prefix.strip("/"))
+
+
+def configure_mirrors(mirrors: Dict[str, List[str]]) -> None:
+    """
+    Sets the mirrors of each upstream registry host, each given as `host` or `host/path-prefix`. Lookups for an
+    upstream's images are tried against its mirrors in the order given, before the upstream itself.
+    """
+    global _mirrors
+    with _lock:
+        _mirrors = {
+            normalise_registry_host(upstream): [
+                parse_registry_source(mirror) for mirror in upstream_mirrors
+            ]
+            for upstream, upstream_mirrors in mirrors.items()
+        }
+        _sources.clear()
+
+
+def get_sources(host: str) -> List[RegistrySource]:
+    """
+    The sources to look up an upstream host's images on, in the order they are tried. The upstream is always last.
+    """
+    return _mirrors.get(host, []) + [RegistrySource(host)]
+
+
+def lookup_through_mirrors(
+    host: str,
+    lookup: Callable[[RegistrySource], T],
+    is_usable: Callable[[T], bool],
+    description: str,
+) -> T:
+    """
+    Runs a lookup against each of an upstream host's mirrors in turn, returning the first result that `is_usable`
+    accepts. Mirrors that fail, don't have the image, give a result that looks stale or are low on their rate limit
+    budget are passed over, and the lookup falls back to the upstream, whose result is returned whatever it is.
+    """
+    sources = get_sources(host)
+    for source in sources[:-1]:
+        if not has_budget(source.host):
+            logger.debug(
+                "Skipping mirror {source} for {description}, as it is low on budget".format(
+                    source=source, description=description
+                )
+            )
+            continue
+        try:
+            result = lookup(source)
+        except Exception as e:
+            logger.debug(
+                "Mirror {source} failed for {description}: {error}".format(
+                    source=source, description=description, error=e
+                )
+            )
+            continue
+        if is_usable(result):
+            record_source(host, str(source))
+            return result
+        logger.debug(
+            "Mirror {source} has no usable result for {description}, falling back".format(
+                source=source, description=description
+            )
+        )
+    result = lookup(sources[-1])
+    record_source(host, host)
+    return result
+
+
+def record_source(upstream: str, source: str) -> None:
+    with _lock:
+        _sources.setdefault(upstream, Counter())[source] += 1
+
+
+def get_source_report() -> Dict[str, Dict[str, int]]:
+    """
+    The number of registry results that came from each source, keyed by the upstream host they were looked up for.
+    Results that were served from the cache aren't counted.
+    """
+    with _lock:
+        return {
+            upstream: dict(sources.most_common())
+            for upstream, sources in sorted(_sources.items())
+        }
+
+
+def log_source_summary() -> None:
+    """
+    Logs where the registry results for each upstream host came from, for the hosts that have mirrors.
+    """
+    for upstream, sources in get_source_report().items():
+        if upstream not in _mirrors:
+            continue
+        logger.info(
+            "{upstream}: {mirrored} of {total} results came from mirrors ({sources})".format(
+                upstream=upstream,
+                mirrored=sum(
+                    count for source, count in sources.items() if source != upstream
+                ),
+                total=sum(sources.values()),
+                sources=", ".join(
+                    "{source}: {count}".format(source=source, count=count)
+                    for source, count in sources.items()
+                ),
+            )
+        )
+
+
+def reset_sources() -> None:
+    with _lock:
+        _sources.clear()
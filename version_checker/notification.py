@@ -1,46 +1,374 @@
+import abc
+import datetime
 import logging
+import queue
+import threading
+import time
+from typing import List, Dict, Optional
+
+import requests
+from kubernetes import client
 
 from version_checker.k8s.model import Resource, Container
 
 logger = logging.getLogger(__name__)
 
+# Number of attempts made to deliver a batch to a sink before it is dropped
+max_delivery_attempts = 3
+# Delay before retrying a failed delivery, doubling with each attempt
+delivery_backoff_seconds = 1
+# How long a webhook request may take before it is treated as failed
+delivery_timeout_seconds = 10
+# How long to wait for more notifications to arrive before sending a batch that isn't full
+batch_linger_seconds = 1
+
+
+class Notification(abc.ABC):
+    cluster = ""
+    owner: Resource = None
+    reason = ""
+
+    def cluster_prefix(self) -> str:
+        return "[{cluster}] ".format(cluster=self.cluster) if self.cluster else ""
+
+    @abc.abstractmethod
+    def get_key(self) -> str:
+        """
+        A stable identity for the finding, which stays the same between runs for as long as the finding does.
+        """
 
-class Notification(object):
-    pass
+    def to_dict(self) -> Dict[str, str]:
+        details = {"reason": self.reason, "message": str(self), "cluster": self.cluster}
+        if self.owner:
+            details.update(
+                namespace=self.owner.namespace,
+                kind=self.owner.kind,
+                resource=self.owner.name,
+                uid=self.owner.uid,
+            )
+        return details
 
 
 class NewTagNotification(Notification):
-    def __init__(self, image: str, tag: str, newest_tag: str):
+    reason = "NewerTagAvailable"
+
+    def __init__(
+        self,
+        image: str,
+        tag: str,
+        newest_tag: str,
+        cluster: str = "",
+        owner: Resource = None,
+    ):
         self.image = image
         self.tag = tag
         self.newest_tag = newest_tag
+        self.cluster = cluster
+        self.owner = owner
 
     def __str__(self):
-        return "Newer tag available for {image}:{tag} -> {new_tag}".format(
-            image=self.image, tag=self.tag, new_tag=self.newest_tag
+        return "{cluster}Newer tag available for {image}:{tag} -> {new_tag}".format(
+            cluster=self.cluster_prefix(),
+            image=self.image,
+            tag=self.tag,
+            new_tag=self.newest_tag,
         )
 
+    def get_key(self) -> str:
+        return "{prefix}{new_tag}".format(
+            prefix=self.get_key_prefix(self.image, self.tag), new_tag=self.newest_tag
+        )
+
+    @staticmethod
+    def get_key_prefix(image: str, tag: str) -> str:
+        """
+        The start of the key of any finding of a newer tag for the image, whichever tag is newer.
+        """
+        return "new-tag|{image}:{tag}|".format(image=image, tag=tag)
+
 
 class OutOfDateContainerNotification(Notification):
+    reason = "RegistryImageUpdated"
+
     def __init__(self, owner: Resource, container: Container, registry_digest: str):
         self.owner = owner
         self.container = container
         self.registry_digest = registry_digest
+        self.cluster = owner.cluster
 
     def __str__(self):
-        return "Registry image has been updated ({registry_digest}) for pod {status} on {server} (owned by {owner})".format(
+        return "{cluster}Registry image has been updated ({registry_digest}) for pod {status} on {server} (owned by {owner})".format(
+            cluster=self.cluster_prefix(),
             registry_digest=self.registry_digest,
             status=self.container.image,
             server=self.container.server,
             owner=self.owner,
         )
 
+    def get_key(self) -> str:
+        return "{prefix}{registry_digest}".format(
+            prefix=self.get_key_prefix(self.container),
+            registry_digest=self.registry_digest,
+        )
+
+    @staticmethod
+    def get_key_prefix(container: Container) -> str:
+        """
+        The start of the key of any finding that the container is out of date, whatever the registry digest is.
+        """
+        return "out-of-date|{image}|{server}|".format(
+            image=container.image, server=container.server
+        )
+
+
+class ResolvedNotification(Notification):
+    """
+    A finding from an earlier run that no longer applies.
+    """
+
+    reason = "Resolved"
+
+    def __init__(self, description: str):
+        self.description = description
+
+    def __str__(self):
+        return "Resolved: {description}".format(description=self.description)
+
+    def get_key(self) -> str:
+        return "resolved|{description}".format(description=self.description)
+
+
+class RecordedNotification(Notification):
+    """
+    A notification read back from the findings written by another run, such as one of the shards of a sharded check.
+    """
+
+    def __init__(self, finding: Dict[str, str]):
+        self.finding = finding
+        self.reason = finding["reason"]
+        self.cluster = finding.get("cluster", "")
+
+    def __str__(self):
+        return self.finding["message"]
+
+    def get_key(self) -> str:
+        return self.finding["key"]
+
+    def to_dict(self) -> Dict[str, str]:
+        return {key: value for key, value in self.finding.items() if key != "key"}
+
 
 def log_notifications(notifications: list) -> None:
     """
-    Outputs a list of notifications to stderr. Useful when running standalone
+    Outputs a list of notifications to stderr, and queues them for delivery to any configured sinks
     :param notifications:
     :return:
     """
     for notification in notifications:
         logger.warning(notification)
+    if _dispatcher and notifications:
+        _dispatcher.submit(notifications)
+
+
+class NotificationSink(abc.ABC):
+    """
+    Somewhere notifications are delivered to. Sinks are sent batches of notifications from a background thread, and
+    should raise if a batch could not be delivered so that it can be retried.
+    """
+
+    name = "sink"
+
+    @abc.abstractmethod
+    def send(self, notifications: List[Notification]) -> None:
+        pass
+
+
+class WebhookSink(NotificationSink):
+    """
+    POSTs each batch as JSON: `{"notifications": [{"reason": ..., "message": ..., ...}, ...]}`. Each webhook has a
+    session of its own, apart from the registry sessions, so that it is never throttled with registry traffic nor
+    redirected or recorded along with it by `--replay` and `--record`.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.name = "webhook {url}".format(url=url)
+        self.session = requests.Session()
+
+    def send(self, notifications: List[Notification]) -> None:
+        response = self.session.post(
+            self.url,
+            timeout=delivery_timeout_seconds,
+            json={
+                "notifications": [
+                    notification.to_dict() for notification in notifications
+                ]
+            },
+        )
+        response.raise_for_status()
+
+
+class SlackSink(NotificationSink):
+    """
+    POSTs each batch to a Slack (or Slack compatible) incoming webhook as a single message, one line per notification.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.name = "slack webhook"
+        self.session = requests.Session()
+
+    def send(self, notifications: List[Notification]) -> None:
+        response = self.session.post(
+            self.url,
+            timeout=delivery_timeout_seconds,
+            json={
+                "text": "\n".join(str(notification) for notification in notifications)
+            },
+        )
+        response.raise_for_status()
+
+
+class KubernetesEventSink(NotificationSink):
+    """
+    Records each notification as a kubernetes Event on the resource it is about, in the resource's own cluster, so that
+    it shows up in `kubectl describe`. Notifications that aren't about a resource are skipped.
+    """
+
+    name = "kubernetes events"
+
+    def __init__(self, api_clients: Dict[str, Optional[client.ApiClient]]):
+        self.apis = {
+            cluster: client.CoreV1Api(api_client)
+            for cluster, api_client in api_clients.items()
+        }
+
+    def send(self, notifications: List[Notification]) -> None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for notification in notifications:
+            if not notification.owner or notification.cluster not in self.apis:
+                continue
+            self.apis[notification.cluster].create_namespaced_event(
+                notification.owner.namespace,
+                client.V1Event(
+                    metadata=client.V1ObjectMeta(generate_name="version-checker-"),
+                    involved_object=client.V1ObjectReference(
+                        kind=notification.owner.kind.replace(" ", ""),
+                        name=notification.owner.name,
+                        namespace=notification.owner.namespace,
+                        uid=notification.owner.uid,
+                    ),
+                    reason=notification.reason,
+                    message=str(notification),
+                    type="Warning",
+                    source=client.V1EventSource(component="version-checker"),
+                    first_timestamp=now,
+                    last_timestamp=now,
+                    count=1,
+                ),
+            )
+
+
+class NotificationDispatcher(threading.Thread):
+    """
+    Delivers notifications to sinks from a background thread, so that a slow or unavailable sink never holds up
+    checking. Notifications are queued, up to `max_queued` of them, beyond which new ones are dropped. They are sent to
+    each sink in batches of up to `batch_size`, and a failed batch is retried with backoff.
+    """
+
+    def __init__(
+        self,
+        sinks: List[NotificationSink],
+        batch_size: int = 50,
+        max_queued: int = 1000,
+    ):
+        super().__init__(name="notification-dispatcher", daemon=True)
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.dropped = 0
+        # Drops are counted from the checking threads as well as the dispatcher's own
+        self._dropped_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._closing = threading.Event()
+        self._deadline = None
+
+    def submit(self, notifications: List[Notification]) -> None:
+        for notification in notifications:
+            try:
+                self._queue.put_nowait(notification)
+            except queue.Full:
+                self._record_dropped(1)
+
+    def close(self, timeout: float) -> None:
+        """
+        Waits up to `timeout` seconds for the queued notifications to be delivered, and then gives up on any that are
+        left, so that delivery can't make the run overrun its deadline.
+        """
+        self._deadline = time.monotonic() + timeout
+        self._closing.set()
+        self.join(timeout)
+        with self._dropped_lock:
+            undelivered = self._queue.qsize() + self.dropped
+        if self.is_alive() or undelivered:
+            logger.warning(
+                "{count} notifications were not delivered".format(count=undelivered)
+            )
+
+    def run(self) -> None:
+        while not (self._closing.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                for sink in self.sinks:
+                    self._deliver(sink, batch)
+
+    def _next_batch(self) -> List[Notification]:
+        batch = []
+        linger_until = None
+        while len(batch) < self.batch_size:
+            timeout = (
+                batch_linger_seconds
+                if linger_until is None
+                else linger_until - time.monotonic()
+            )
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                if batch or self._closing.is_set():
+                    break
+                continue
+            if linger_until is None:
+                linger_until = time.monotonic() + batch_linger_seconds
+        return batch
+
+    def _deliver(self, sink: NotificationSink, batch: List[Notification]) -> None:
+        for attempt in range(1, max_delivery_attempts + 1):
+            try:
+                sink.send(batch)
+                return
+            except Exception:
+                logger.exception(
+                    "Error delivering {count} notifications to {sink} (attempt {attempt})".format(
+                        count=len(batch), sink=sink.name, attempt=attempt
+                    )
+                )
+            backoff = delivery_backoff_seconds * 2 ** (attempt - 1)
+            if attempt == max_delivery_attempts or (
+                self._deadline and time.monotonic() + backoff > self._deadline
+            ):
+                break
+            time.sleep(backoff)
+        self._record_dropped(len(batch))
+
+    def _record_dropped(self, count: int) -> None:
+        with self._dropped_lock:
+            self.dropped += count
+
+
+_dispatcher: Optional[NotificationDispatcher] = None
+
+
+def configure_dispatcher(dispatcher: Optional[NotificationDispatcher]) -> None:
+    global _dispatcher
+    _dispatcher = dispatcher
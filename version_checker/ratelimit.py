@@ -0,0 +1,208 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, List, Tuple
+
+from requests import Response
+
+logger = logging.getLogger(__name__)
+
+# Status codes that mean the registry is overloaded or limiting us, and that the request is worth retrying later
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# Number of times a request is retried after a retryable response before it is given up on
+max_retries = 4
+# First backoff delay after a retryable response, doubling with each consecutive failure
+backoff_base_seconds = 1
+# Longest we are prepared to wait before retrying, whether backing off or told to by `Retry-After`
+max_backoff_seconds = 60
+# Longest gap left between requests when spreading a low budget over its window
+max_request_spacing_seconds = 10
+
+
+class HostBudget(object):
+    """
+    What a registry host has told us about its rate limit, and when we may next send it a request.
+    """
+
+    def __init__(self):
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.window_seconds: Optional[float] = None
+        self.next_request_at = 0.0
+        self.consecutive_failures = 0
+        self.requests_made = 0
+        self.rate_limited_responses = 0
+
+
+_low_budget = 20
+_budgets: Dict[str, HostBudget] = {}
+_skipped: Dict[str, List[str]] = {}
+_lock = threading.Lock()
+
+
+def configure_rate_limits(low_budget: int) -> None:
+    """
+    Sets the number of remaining requests below which a host's budget is treated as low. Once it is, requests to the
+    host are spread out over the rest of its window, and lookups for images without running containers are skipped.
+    """
+    global _low_budget
+    with _lock:
+        _low_budget = low_budget
+        _budgets.clear()
+        _skipped.clear()
+
+
+def _get_budget(host: str) -> HostBudget:
+    if host not in _budgets:
+        _budgets[host] = HostBudget()
+    return _budgets[host]
+
+
+def parse_rate_limit_header(value: str) -> Tuple[Optional[int], Optional[float]]:
+    """
+    Parses a `RateLimit-Limit` or `RateLimit-Remaining` header such as `76;w=21600` into the count and the window in
+    seconds, if one is given.
+    """
+    count, *parameters = value.split(";")
+    window = None
+    for parameter in parameters:
+        key, _, parameter_value = parameter.strip().partition("=")
+        if key == "w" and parameter_value.isdigit():
+            window = float(parameter_value)
+    count = count.strip()
+    return (int(count) if count.isdigit() else None), window
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """
+    Parses a `Retry-After` header, which is either a number of seconds or an HTTP date, into a number of seconds.
+    """
+    if value.strip().isdigit():
+        return float(value.strip())
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def wait_for_turn(host: str) -> None:
+    """
+    Blocks until the host may be sent another request, and claims the slot. Slots are handed out in order, so requests
+    from many threads are spaced out rather than all sent as soon as a backoff ends.
+    """
+    with _lock:
+        budget = _get_budget(host)
+        now = time.monotonic()
+        request_at = max(now, budget.next_request_at)
+        budget.next_request_at = request_at + _get_request_spacing(budget)
+        budget.requests_made += 1
+    if request_at > now:
+        time.sleep(request_at - now)
+
+
+def _get_request_spacing(budget: HostBudget) -> float:
+    if budget.remaining is None or budget.remaining > _low_budget:
+        return 0
+    if not budget.window_seconds:
+        return max_request_spacing_seconds
+    return min(
+        max_request_spacing_seconds, budget.window_seconds / max(budget.remaining, 1)
+    )
+
+
+def record_response(host: str, response: Response, attempt: int) -> Optional[float]:
+    """
+    Updates the host's budget from the rate limit headers on a response. If the response is worth retrying, returns
+    how long to wait before doing so (the host is held back for that long too), otherwise None.
+    """
+    with _lock:
+        budget = _get_budget(host)
+        if "RateLimit-Remaining" in response.headers:
+            budget.remaining, window = parse_rate_limit_header(
+                response.headers["RateLimit-Remaining"]
+            )
+            budget.window_seconds = window or budget.window_seconds
+        if "RateLimit-Limit" in response.headers:
+            budget.limit, window = parse_rate_limit_header(
+                response.headers["RateLimit-Limit"]
+            )
+            budget.window_seconds = budget.window_seconds or window
+        if "RateLimit-Reset" in response.headers:
+            budget.window_seconds = parse_retry_after(
+                response.headers["RateLimit-Reset"]
+            )
+
+        if response.status_code not in RETRYABLE_STATUS_CODES:
+            budget.consecutive_failures = 0
+            return None
+
+        if response.status_code == 429:
+            budget.rate_limited_responses += 1
+        budget.consecutive_failures += 1
+        retry_after = parse_retry_after(response.headers.get("Retry-After", ""))
+        if retry_after is None:
+            # Full jitter, so that threads backing off from the same host don't all retry at once
+            retry_after = random.uniform(
+                0,
+                min(
+                    max_backoff_seconds,
+                    backoff_base_seconds * 2 ** budget.consecutive_failures,
+                ),
+            )
+        if attempt >= max_retries or retry_after > max_backoff_seconds:
+            return None
+        budget.next_request_at = max(
+            budget.next_request_at, time.monotonic() + retry_after
+        )
+    logger.info(
+        "{host} returned {status}, retrying in {delay:.1f}s".format(
+            host=host, status=response.status_code, delay=retry_after
+        )
+    )
+    return retry_after
+
+
+def has_budget(host: str) -> bool:
+    """
+    Whether the host's remaining budget is above the low budget threshold, or unknown.
+    """
+    with _lock:
+        budget = _budgets.get(host)
+        return (
+            budget is None or budget.remaining is None or budget.remaining > _low_budget
+        )
+
+
+def record_skipped(host: str, image: str) -> None:
+    with _lock:
+        _skipped.setdefault(host, []).append(image)
+
+
+def log_rate_limit_summary() -> None:
+    """
+    Logs how much of each registry host's budget was used, and which images were not checked because of it since the
+    last summary.
+    """
+    with _lock:
+        for host, budget in sorted(_budgets.items()):
+            logger.info(
+                "{host}: {requests} requests made, {rate_limited} rate limited, {remaining} of {limit} remaining".format(
+                    host=host,
+                    requests=budget.requests_made,
+                    rate_limited=budget.rate_limited_responses,
+                    remaining="unknown"
+                    if budget.remaining is None
+                    else budget.remaining,
+                    limit="unknown" if budget.limit is None else budget.limit,
+                )
+            )
+        for host, images in sorted(_skipped.items()):
+            logger.warning(
+                "Skipped {count} lookups on {host} due to its rate limit: {images}".format(
+                    count=len(images), host=host, images=", ".join(sorted(set(images)))
+                )
+            )
+        _skipped.clear()
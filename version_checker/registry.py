@@ -1,143 +1,464 @@
-import functools
 import logging
 import re
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Dict, Iterable, Iterator
+from urllib.parse import urlparse, urljoin, urlencode
 
-import requests
-from packaging.version import Version, parse
+import attr
+from attr import dataclass
+from packaging.version import Version
 from requests import Response
 
+from version_checker.cache import get_or_revalidate
+from version_checker.images import ImageRef, parse_image_ref, DIGEST
+from version_checker.mirrors import get_sources, lookup_through_mirrors
+from version_checker.ratelimit import wait_for_turn, record_response
+from version_checker.sessions import get_session
+from version_checker.tags import find_newest_tag, parse_version_tag
+from version_checker.timing import timed
+from version_checker.tokens import (
+    BearerChallenge,
+    get_basic_authorization_header,
+    get_credentials,
+    get_known_challenge,
+    get_token,
+    invalidate_token,
+    parse_bearer_challenge,
+    register_repositories,
+    remember_basic_auth,
+    remember_challenge,
+    repository_pull_scope,
+    uses_basic_auth,
+)
+
 logger = logging.getLogger(__name__)
 
 # List of hosts that return the correct docker digest even on schema v1
 digest_correct_hosts = ["quay.io"]
 
+# Number of tags to ask for in each page of a tag listing
+tag_page_size = 1000
+
+# List of hosts whose HEAD manifest responses can't be trusted, so a full GET is always made instead
+head_unsupported_hosts = []
+
+# Manifest types that we can take a digest from, including multi-arch manifest lists and OCI indexes
+MANIFEST_MEDIA_TYPES = [
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+]
+
+# Manifest types that list the image manifest of each platform that a multi-arch image is built for
+MANIFEST_LIST_MEDIA_TYPES = [
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.index.v1+json",
+]
+
+# The scheme that some container runtimes prefix image IDs with, e.g. `docker-pullable://` or `docker://`
+IMAGE_ID_SCHEME = re.compile(r"^[a-z][a-z0-9+.-]*://")
 
-def get_newest_tag(image_name: str, match_pattern: str = "") -> Optional[str]:
+REGISTRY_REPOSITORY_PATH = re.compile(r"^/v2/(.+)/(tags|manifests|blobs)/")
+
+
+def get_newest_tag(image: ImageRef, match_pattern: str = "") -> Optional[Version]:
+    """
+    Finds the newest tag of an image, looking through the host's mirrors first. A mirror only knows the tags that have
+    been pulled through it, so if its newest tag is older than the one found last time, it is taken to be stale and
+    the upstream is asked instead.
+    """
+    host = image.host
     try:
-        registry_tags = get_docker_registry_tags(image_name)
+        newest_tag = get_or_revalidate(
+            host,
+            "newest:{host}/{image}:{pattern}".format(
+                host=host, image=image.repository, pattern=match_pattern
+            ),
+            lambda previous_tag: lookup_through_mirrors(
+                host,
+                lambda source: str(
+                    find_newest_tag(
+                        iter_docker_registry_tags(
+                            source.host, source.get_repository(image.repository)
+                        ),
+                        match_pattern,
+                    )
+                    or ""
+                ),
+                lambda tag: is_newest_tag_current(tag, previous_tag),
+                "tags of {image}".format(image=image.name),
+            ),
+        )
     except Exception:
-        logging.exception("Error fetching tags for {image}".format(image=image_name))
+        logging.exception("Error fetching tags for {image}".format(image=image))
         return
-
-    logger.debug("Available registry tags: {tags}".format(tags=registry_tags))
-    if match_pattern:
-        logger.info(
-            "Only matching tags against {pattern}".format(pattern=match_pattern)
-        )
-    mapped_tags = sorted(
-        [
-            parse(tag)
-            for tag in registry_tags
-            if isinstance(parse(tag), Version) and re.match(match_pattern, tag)
-        ],
-        reverse=True,
-    )
-    logger.debug("Filtered version tags: {tags}".format(tags=list(mapped_tags)))
-    if len(mapped_tags) > 0:
-        newest_tag = mapped_tags[0]
-        return newest_tag
+    if newest_tag:
+        return parse_version_tag(newest_tag)
     return None
 
 
+def is_newest_tag_current(newest_tag: str, previous_tag: Optional[str]) -> bool:
+    if not newest_tag:
+        return False
+    previous_version = parse_version_tag(previous_tag) if previous_tag else None
+    return previous_version is None or parse_version_tag(newest_tag) >= previous_version
+
+
 def docker_registry_api_get(url: str, headers=None) -> Response:
+    return docker_registry_api_request("GET", url, headers)
+
+
+def docker_registry_api_request(method: str, url: str, headers=None) -> Response:
+    """
+    Performs a request against a registry API url. Once a host has challenged us for a bearer token, later requests to
+    it are sent with a cached token for the repository already attached, so the unauthenticated round trip is skipped.
+    Hosts that we have credentials for may instead challenge us for basic auth, which is then sent with every request.
+    """
     if headers is None:
         headers = {}
-    logger.debug("Fetching {url}".format(url=url))
-    response = requests.get(url, headers=headers)
-    if response.status_code == 401:
-        authenticate_header = response.headers["WWW-Authenticate"]
-        if not authenticate_header.startswith("Bearer "):
-            raise Exception("Invalid authentication header in registry response")
-        header_dictionary = dict(
-            part.split("=", 1)
-            for part in authenticate_header[len("Bearer ") :].strip().split(",")
-        )
-
-        token = docker_registry_auth(
-            header_dictionary["realm"].strip('"'),
-            header_dictionary["service"].strip('"'),
-            header_dictionary["scope"].strip('"'),
-        )
-        response = requests.get(
+    logger.debug("Fetching {method} {url}".format(method=method, url=url))
+    host = urlparse(url).netloc
+    scope = get_repository_scope_from_url(url)
+    challenge = get_known_challenge(host)
+    if uses_basic_auth(host):
+        return send_registry_request(
+            method, url, headers={**headers, **get_basic_authorization_header(host)}
+        )
+    if challenge and scope:
+        response = send_registry_request(
+            method,
+            url,
+            headers={**headers, **get_authorization_header(host, challenge, scope)},
+        )
+    else:
+        response = send_registry_request(method, url, headers=headers)
+    if response.status_code == 401 and is_basic_challenge(host, response):
+        remember_basic_auth(host)
+        response = send_registry_request(
+            method, url, headers={**headers, **get_basic_authorization_header(host)}
+        )
+    elif response.status_code == 401:
+        challenge, challenged_scope = parse_bearer_challenge(
+            response.headers["WWW-Authenticate"]
+        )
+        remember_challenge(host, challenge)
+        invalidate_token(challenge, challenged_scope)
+        response = send_registry_request(
+            method,
             url,
             headers={
-                "authorization": "Bearer {token}".format(token=token),
-                "Accept": "application/vnd.docker.distribution.manifest.v2+json",
+                **headers,
+                **get_authorization_header(host, challenge, challenged_scope),
             },
         )
     return response
 
 
-def get_registry_host_and_image(image: str) -> Tuple[str, str]:
-    host = "registry-1.docker.io"
-    image_name = image
-    if image.count("/") == 0:
-        image_name = "library/{image}".format(image=image)
-    elif image.count("/") == 2:
-        host, image_name = image.split("/", 1)
-    elif image.count("/") == 1 and "." in image.split("/", 1)[0]:
-        host, image_name = image.split("/", 1)
-    elif image.count("/") > 2:
-        raise Exception("Illegal docker image name: {image}".format(image=image))
-
-    return host, image_name
-
-
-def get_docker_registry_tags(image: str) -> dict:
-    host, image_name = get_registry_host_and_image(image)
-    response = docker_registry_api_get(
-        "https://{host}/v2/{image}/tags/list".format(host=host, image=image_name)
+def is_basic_challenge(host: str, response: Response) -> bool:
+    return bool(get_credentials(host)) and response.headers.get(
+        "WWW-Authenticate", ""
+    ).startswith("Basic ")
+
+
+def send_registry_request(method: str, url: str, headers: Dict[str, str]) -> Response:
+    """
+    Sends a request once the host's rate limit allows it, retrying with backoff while the registry responds that it is
+    rate limiting us or is unavailable.
+    """
+    host = urlparse(url).netloc
+    attempt = 0
+    while True:
+        wait_for_turn(host)
+        with timed("registry", get_request_timing_name(url)):
+            response = get_session(url).request(method, url, headers=headers)
+        attempt += 1
+        if record_response(host, response, attempt) is None:
+            return response
+
+
+def get_request_timing_name(url: str) -> str:
+    """
+    Names a registry request by its host and the kind of object asked for, e.g. `quay.io manifests`.
+    """
+    parsed_url = urlparse(url)
+    match = REGISTRY_REPOSITORY_PATH.match(parsed_url.path)
+    return "{host} {operation}".format(
+        host=parsed_url.netloc, operation=match.group(2) if match else "other"
     )
-    if response.status_code != 200:
-        raise Exception("Error fetching tags list", response)
-    if "tags" not in response.json():
-        raise Exception("Registry response did not contain tags structure")
-    return response.json()["tags"]
 
 
-@functools.lru_cache()
-def get_docker_tag_digest(image: str, tag: str) -> str:
-    host, image_name = get_registry_host_and_image(image)
-    response = docker_registry_api_get(
-        "https://{host}/v2/{image}/manifests/{tag}".format(
-            host=host, image=image_name, tag=tag
+def get_authorization_header(
+    host: str, challenge: BearerChallenge, scope: str
+) -> Dict[str, str]:
+    return {
+        "authorization": "Bearer {token}".format(
+            token=get_token(host, challenge, scope)
         )
+    }
+
+
+def get_repository_scope_from_url(url: str) -> str:
+    match = REGISTRY_REPOSITORY_PATH.match(urlparse(url).path)
+    if not match:
+        return ""
+    return repository_pull_scope(match.group(1))
+
+
+def get_registry_host_and_image(image: str) -> Tuple[str, str]:
+    image_ref = parse_image_ref(image)
+    return image_ref.host, image_ref.repository
+
+
+def register_images(images: Iterable[ImageRef]) -> None:
+    """
+    Tells the token cache which repositories are about to be queried, on their hosts and on any mirrors of them, so
+    tokens can be requested for several of them at once.
+    """
+    repositories_by_host = {}
+    for image in images:
+        for source in get_sources(image.host):
+            repositories_by_host.setdefault(source.host, []).append(
+                source.get_repository(image.repository)
+            )
+    for host, repositories in repositories_by_host.items():
+        register_repositories(host, repositories)
+
+
+def iter_docker_registry_tags(
+    host: str, image_name: str, page_size: int = tag_page_size
+) -> Iterator[str]:
+    """
+    Yields the tags of an image a page at a time. Pages are followed using the `Link` header where the registry sends
+    one, and otherwise by asking for the tags after the last one seen (`last=`) until a short page is returned, or a
+    page ends where an earlier one did.
+    """
+    url = "https://{host}/v2/{image}/tags/list?n={page_size}".format(
+        host=host, image=image_name, page_size=page_size
+    )
+    page_last_tags = set()
+    while url:
+        response = docker_registry_api_get(url)
+        if response.status_code != 200:
+            raise Exception("Error fetching tags list", response)
+        tag_list = response.json()
+        if "tags" not in tag_list:
+            raise Exception("Registry response did not contain tags structure")
+        tags = tag_list["tags"] or []
+        if tags and tags[-1] in page_last_tags:
+            # Pagination is optional, and a registry that ignores it sends the same page again
+            logger.debug(
+                "Tag listing at {url} did not move past {tag}, stopping".format(
+                    url=url, tag=tags[-1]
+                )
+            )
+            return
+        page_last_tags.update(tags[-1:])
+        yield from tags
+        if "next" in response.links:
+            url = urljoin(url, response.links["next"]["url"])
+        elif len(tags) == page_size:
+            url = "https://{host}/v2/{image}/tags/list?{query}".format(
+                host=host,
+                image=image_name,
+                query=urlencode({"n": page_size, "last": tags[-1]}),
+            )
+        else:
+            url = None
+
+
+@dataclass(frozen=True)
+class TagDigests:
+    """
+    The digest of a tag's manifest and, when that is a manifest list or OCI index, the digest of the image manifest
+    for each platform it lists, keyed by `os/architecture` (with `/variant` where the image has one).
+    """
+
+    digest: str
+    platform_digests: Dict[str, str] = attr.ib(factory=dict)
+
+    def get_platform_digest(self, platform: str) -> str:
+        """
+        The digest that a node of the given `os/architecture` platform would pull for the tag. Nodes don't report a
+        variant, so the first variant listed for their architecture is taken.
+        """
+        if platform in self.platform_digests:
+            return self.platform_digests[platform]
+        for image_platform, digest in self.platform_digests.items():
+            if image_platform.startswith(platform + "/"):
+                return digest
+        return self.digest
+
+    def is_current(self, running_digest: str, platform: str = "") -> bool:
+        """
+        Whether a container running the given digest is running what the tag points at. Depending on the container
+        runtime, multi-arch images are reported by either the digest of the list or that of the platform's manifest,
+        so both are accepted. Without a platform, any of the listed manifests is accepted.
+        """
+        if running_digest == self.digest:
+            return True
+        if platform:
+            return running_digest == self.get_platform_digest(platform)
+        return running_digest in self.platform_digests.values()
+
+
+def get_docker_tag_digest(image: ImageRef, tag: str) -> str:
+    return get_docker_tag_digests(image, tag).digest
+
+
+def get_docker_tag_digests(image: ImageRef, tag: str) -> TagDigests:
+    """
+    Looks up the digests of a tag. For a multi-arch image the index is fetched once, and serves the nodes of every
+    platform. The host's mirrors are asked first, and a mirror's digest is only trusted if it is the one found last
+    time; a mirror that doesn't have the tag, or whose digest has changed, may be serving a stale copy, so the upstream
+    is asked to confirm it.
+    """
+    host, image_name = image.host, image.repository
+    manifest = get_or_revalidate(
+        host,
+        "digest:{host}/{image}:{tag}".format(host=host, image=image_name, tag=tag),
+        lambda cached_manifest: lookup_through_mirrors(
+            host,
+            lambda source: fetch_docker_tag_digest(
+                source.host, source.get_repository(image_name), tag, cached_manifest
+            ),
+            lambda manifest: is_manifest_current(manifest, cached_manifest),
+            "{image}:{tag}".format(image=image.name, tag=tag),
+        ),
     )
-    logger.debug(response.json())
+    return TagDigests(manifest["digest"], manifest.get("platforms", {}))
+
+
+def is_manifest_current(manifest: dict, cached_manifest: Optional[dict]) -> bool:
+    return bool(manifest["digest"]) and (
+        cached_manifest is None or manifest["digest"] == cached_manifest["digest"]
+    )
+
+
+def fetch_docker_tag_digest(
+    host: str, image_name: str, tag: str, cached_manifest: Optional[dict] = None
+) -> dict:
+    """
+    Finds the digest of a tag's manifest with a HEAD request, which only returns headers. If the manifest was seen on
+    a previous run the request is made conditional on its ETag, and a `304 Not Modified` reuses the cached digest.
+    Registries that do not give a digest in response to HEAD, or that don't say which type of manifest it is the digest
+    of, are asked with a full GET instead, as are manifest lists, whose body gives the digest of each platform's
+    manifest.
+    """
+    url = "https://{host}/v2/{image}/manifests/{tag}".format(
+        host=host, image=image_name, tag=tag
+    )
+    headers = {"Accept": ", ".join(MANIFEST_MEDIA_TYPES)}
+    if host in head_unsupported_hosts:
+        return get_manifest_digest_from_response(
+            host, docker_registry_api_get(url, headers)
+        )
+
+    if cached_manifest and cached_manifest["etag"]:
+        headers["If-None-Match"] = cached_manifest["etag"]
+    response = docker_registry_api_request("HEAD", url, headers)
+    if response.status_code == 304:
+        logger.debug("Manifest for {url} is unchanged".format(url=url))
+        return cached_manifest
+    if response.status_code == 200 and "Docker-Content-Digest" not in response.headers:
+        logger.debug(
+            "No digest returned for HEAD {url}, falling back to GET".format(url=url)
+        )
+        return get_manifest_digest_from_response(
+            host, docker_registry_api_get(url, {"Accept": headers["Accept"]})
+        )
+    if response.status_code == 200 and (
+        get_media_type(response) in MANIFEST_LIST_MEDIA_TYPES
+        or (
+            host not in digest_correct_hosts
+            and get_media_type(response) not in MANIFEST_MEDIA_TYPES
+        )
+    ):
+        # A manifest of an unknown type, or without a type at all, can only be told apart by its body
+        return get_manifest_digest_from_response(
+            host, docker_registry_api_get(url, {"Accept": headers["Accept"]})
+        )
+    return get_manifest_digest_from_response(host, response)
+
+
+def get_media_type(response: Response) -> str:
+    return response.headers.get("Content-Type", "").split(";", 1)[0]
+
+
+def get_manifest_digest_from_response(host: str, response: Response) -> dict:
     if response.status_code != 200:
         raise Exception(
             "Registry response did not contain manifest: {response}".format(
-                response=response.text
+                response=response.text or response.status_code
             )
         )
-    if host in digest_correct_hosts or response.json()["schemaVersion"] == 2:
-        return response.headers["Docker-Content-Digest"]
+    media_type = get_media_type(response)
+    if host in digest_correct_hosts or media_type in MANIFEST_MEDIA_TYPES:
+        digest = response.headers["Docker-Content-Digest"]
+    elif response.request.method == "GET" and media_type in ["", "application/json"]:
+        # Registries that don't set a content type are sniffed from the manifest body instead
+        digest = (
+            response.headers["Docker-Content-Digest"]
+            if response.json().get("schemaVersion") == 2
+            else ""
+        )
     else:
-        return ""
+        digest = ""
+    return {
+        "digest": digest,
+        "etag": response.headers.get("ETag")
+        or ('"{digest}"'.format(digest=digest) if digest else ""),
+        "platforms": get_platform_digests(response.json())
+        if response.request.method == "GET" and media_type in MANIFEST_LIST_MEDIA_TYPES
+        else {},
+    }
 
 
-def docker_registry_auth(realm: str, service: str, scope: str) -> str:
-    client_id = "growse/k8s-version-checker"
-    response = requests.get(
-        realm, params={"service": service, "scope": scope, "client_id": client_id}
-    )
-    if response.status_code != 200:
-        raise Exception(
-            "Error received from token service: {response}".format(response=response)
+def get_platform_digests(manifest_list: dict) -> Dict[str, str]:
+    """
+    Maps each platform in a manifest list or OCI index to the digest of its image manifest. Entries for an unknown
+    platform, such as build attestations, are left out.
+    """
+    platform_digests = {}
+    for manifest in manifest_list.get("manifests") or []:
+        platform = manifest.get("platform") or {}
+        if platform.get("os", "unknown") == "unknown":
+            continue
+        key = "/".join(
+            part
+            for part in (
+                platform["os"],
+                platform.get("architecture"),
+                platform.get("variant"),
+            )
+            if part
         )
-    return response.json()["token"]
+        platform_digests.setdefault(key, manifest["digest"])
+    return platform_digests
 
 
-def is_versioned_tag(tag: str) -> bool:
-    return isinstance(parse(tag), Version)
+def parse_image_id(image_id: str) -> Tuple[str, str]:
+    """
+    Splits the image ID that a container runtime reports for a running container into the repository the image was
+    pulled from and its digest. Docker reports `docker-pullable://{repository}@{digest}`, while containerd and CRI-O
+    report `{repository}@{digest}`. An ID without a repository, such as `docker://sha256:...` or a bare `sha256:...`,
+    is the digest of the image's config rather than of its manifest, and is returned with an empty repository.
+    """
+    reference = IMAGE_ID_SCHEME.sub("", image_id, count=1)
+    repository, _, digest = reference.rpartition("@")
+    if re.fullmatch(r"[0-9a-f]{64}", digest):
+        # CRI-O has been known to report bare image IDs, without the algorithm
+        digest = "sha256:{digest}".format(digest=digest)
+    if not DIGEST.match(digest):
+        raise Exception(
+            "Given image status is not a valid status: {status}".format(status=image_id)
+        )
+    return repository, digest
 
 
 def get_digest_from_image_status(image_status: str) -> str:
-    if not ("@" in image_status and image_status.startswith("docker-pullable://")):
-        raise Exception(
-            "Given image status is not a valid status: {status}".format(
-                status=image_status
-            )
-        )
-    return image_status.split("@", 1)[1]
+    """
+    The manifest digest of a running container's image, or an empty string if the container runtime only reported the
+    ID of the image's config, which can't be compared with a registry's manifest digests.
+    """
+    repository, digest = parse_image_id(image_status)
+    return digest if repository else ""
@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import threading
+from functools import partial
+from typing import Dict, List, Callable, Tuple
+from urllib.parse import urlparse
+
+from kubernetes.client import ApiClient, Configuration
+from requests import Response
+from requests.adapters import HTTPAdapter
+
+from version_checker.fakes import FakeApiServer, FakeRegistry
+from version_checker.k8s.snapshot import SNAPSHOT_KINDS
+from version_checker.registry import REGISTRY_REPOSITORY_PATH
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_FIXTURE = "cluster.json"
+REGISTRY_FIXTURE = "registry.json"
+
+
+class Recorder(object):
+    """
+    Collects the objects listed from the cluster and the tags and manifests fetched from registries during a run, so
+    that they can be saved as fixtures and served back by `FakeApiServer` and `FakeRegistry`.
+    """
+
+    def __init__(self):
+        self.kinds: Dict[str, Dict[str, dict]] = {kind: {} for kind in SNAPSHOT_KINDS}
+        self.hosts: Dict[str, Dict[str, dict]] = {}
+        self._lock = threading.Lock()
+
+    def record_object(self, kind: str, item: dict) -> None:
+        with self._lock:
+            self.kinds[kind][item["metadata"]["uid"]] = item
+
+    def record_registry_response(self, response: Response) -> None:
+        if response.status_code != 200:
+            return
+        url = urlparse(response.request.url)
+        match = REGISTRY_REPOSITORY_PATH.match(url.path)
+        if not match:
+            return
+        repository, operation = match.groups()
+        with self._lock:
+            repository_fixture = self.hosts.setdefault(url.netloc, {}).setdefault(
+                repository, {"tags": [], "manifests": {}}
+            )
+            if operation == "tags":
+                known_tags = set(repository_fixture["tags"])
+                repository_fixture["tags"].extend(
+                    tag
+                    for tag in response.json()["tags"] or []
+                    if tag not in known_tags
+                )
+            elif (
+                operation == "manifests" and "Docker-Content-Digest" in response.headers
+            ):
+                manifest = {
+                    "digest": response.headers["Docker-Content-Digest"],
+                    "media_type": response.headers.get("Content-Type", "").split(";")[
+                        0
+                    ],
+                }
+                if response.request.method == "GET" and response.content:
+                    manifest["body"] = response.json()
+                reference = url.path.rsplit("/", 1)[1]
+                repository_fixture["manifests"][reference] = {
+                    **repository_fixture["manifests"].get(reference, {}),
+                    **manifest,
+                }
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            save_fixtures(
+                directory,
+                {kind: list(items.values()) for kind, items in self.kinds.items()},
+                self.hosts,
+            )
+        logger.info("Recorded fixtures to {directory}".format(directory=directory))
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    A transport adapter that passes each registry response it receives to a recorder.
+    """
+
+    def __init__(self, recorder: Recorder, **kwargs):
+        self.recorder = recorder
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        self.recorder.record_registry_response(response)
+        return response
+
+
+class RedirectingAdapter(HTTPAdapter):
+    """
+    A transport adapter that sends requests for `https://{host}/{path}` to `{base_url}/{host}/{path}` instead, so that
+    a `FakeRegistry` can stand in for every registry host.
+    """
+
+    def __init__(self, base_url: str, **kwargs):
+        self.base_url = base_url
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if request.url.startswith("https://"):
+            request.url = "{base_url}/{rest}".format(
+                base_url=self.base_url, rest=request.url[len("https://") :]
+            )
+        return super().send(request, **kwargs)
+
+
+def recording_adapter_factory(recorder: Recorder) -> Callable[..., HTTPAdapter]:
+    return partial(RecordingAdapter, recorder)
+
+
+def redirecting_adapter_factory(base_url: str) -> Callable[..., HTTPAdapter]:
+    return partial(RedirectingAdapter, base_url)
+
+
+def save_fixtures(
+    directory: str, kinds: Dict[str, List[dict]], hosts: Dict[str, Dict[str, dict]]
+) -> None:
+    with open(os.path.join(directory, CLUSTER_FIXTURE), "w") as cluster_file:
+        json.dump({"kinds": kinds}, cluster_file)
+    with open(os.path.join(directory, REGISTRY_FIXTURE), "w") as registry_file:
+        json.dump({"hosts": hosts}, registry_file)
+
+
+def load_fixtures(
+    directory: str
+) -> Tuple[Dict[str, List[dict]], Dict[str, Dict[str, dict]]]:
+    with open(os.path.join(directory, CLUSTER_FIXTURE)) as cluster_file:
+        kinds = json.load(cluster_file)["kinds"]
+    with open(os.path.join(directory, REGISTRY_FIXTURE)) as registry_file:
+        hosts = json.load(registry_file)["hosts"]
+    return kinds, hosts
+
+
+def get_fake_api_client(api_server: FakeApiServer) -> ApiClient:
+    configuration = Configuration()
+    configuration.host = api_server.url
+    return ApiClient(configuration)
+
+
+def start_replay(
+    kinds: Dict[str, List[dict]], hosts: Dict[str, Dict[str, dict]]
+) -> Tuple[FakeApiServer, FakeRegistry]:
+    """
+    Starts a fake API server and a fake registry serving the given fixtures.
+    """
+    api_server = FakeApiServer(kinds)
+    fake_registry = FakeRegistry(hosts)
+    api_server.start()
+    fake_registry.start()
+    logger.info(
+        "Replaying cluster from {api_server} and registries from {registry}".format(
+            api_server=api_server.url, registry=fake_registry.url
+        )
+    )
+    return api_server, fake_registry
@@ -0,0 +1,49 @@
+import threading
+from typing import Dict, Callable
+from urllib.parse import urlparse
+
+import requests
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+_max_connections_per_host = 4
+_adapter_factory: Callable[..., HTTPAdapter] = HTTPAdapter
+_sessions: Dict[str, Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def configure_sessions(
+    max_connections_per_host: int,
+    adapter_factory: Callable[..., HTTPAdapter] = HTTPAdapter,
+) -> None:
+    """
+    Sets the connection pool size used for each registry host, and the transport adapter class (e.g. one that records
+    or redirects requests) that sessions are built with. Sessions that have already been created are discarded so that
+    the new settings apply to all subsequent requests.
+    """
+    global _max_connections_per_host, _adapter_factory
+    with _sessions_lock:
+        _max_connections_per_host = max_connections_per_host
+        _adapter_factory = adapter_factory
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get_session(url: str) -> Session:
+    """
+    Returns the pooled, keep-alive session for the host of the given url, creating it on first use.
+    """
+    host = urlparse(url).netloc
+    with _sessions_lock:
+        if host not in _sessions:
+            session = requests.Session()
+            adapter = _adapter_factory(
+                pool_connections=1,
+                pool_maxsize=_max_connections_per_host,
+                pool_block=True,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+        return _sessions[host]
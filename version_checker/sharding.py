@@ -0,0 +1,206 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import List, Iterator, Tuple, Optional, Callable
+
+from attr import dataclass
+from kubernetes.client import ApiClient
+
+from version_checker.images import parse_image_ref
+from version_checker.k8s import get_namespaces
+from version_checker.k8s.model import Resource, Container
+from version_checker.notification import Notification
+
+logger = logging.getLogger(__name__)
+
+FINDINGS_FORMAT_VERSION = 1
+
+# The ways a check can be split between shards
+SHARD_BY_NAMESPACE = "namespace"
+SHARD_BY_IMAGE = "image"
+
+
+@dataclass(frozen=True)
+class Shard:
+    """
+    One of `count` workers that a check is split between, numbered from 0.
+    """
+
+    index: int
+    count: int
+
+    def owns(self, key: str) -> bool:
+        return get_shard_index(key, self.count) == self.index
+
+    def __str__(self):
+        return "{index}/{count}".format(index=self.index, count=self.count)
+
+
+def get_shard_index(key: str, count: int) -> int:
+    """
+    Assigns a key to one of `count` shards by rendezvous hashing: the key goes to the shard that it hashes highest
+    with. The assignment is the same in every process, and changing the number of shards only moves the keys that the
+    new shards take, or that the removed shards had.
+    """
+    return max(
+        range(count),
+        key=lambda index: hashlib.sha256(
+            "{index}:{key}".format(index=index, key=key).encode()
+        ).digest(),
+    )
+
+
+def get_namespace_shard_key(cluster: str, namespace: str) -> str:
+    return "{cluster}/{namespace}".format(cluster=cluster, namespace=namespace)
+
+
+def get_shard_namespaces(
+    shard: Shard,
+    cluster: str,
+    api_client: Optional[ApiClient],
+    namespaces: Optional[List[str]] = None,
+) -> List[str]:
+    """
+    The namespaces of a cluster that belong to a shard, out of those given or otherwise all of the cluster's.
+    """
+    return [
+        namespace
+        for namespace in namespaces or get_namespaces(api_client)
+        if shard.owns(get_namespace_shard_key(cluster, namespace))
+    ]
+
+
+def get_image_shard_key(resource: Resource) -> str:
+    """
+    The image that decides which shard a resource is checked by. Resources that share their images are checked by the
+    same shard, so that each image is mostly only looked up by one of them.
+    """
+    if not resource.image_spec:
+        return resource.uid
+    keys = []
+    for image in resource.image_spec:
+        try:
+            keys.append(str(parse_image_ref(image).repository_ref))
+        except Exception:
+            keys.append(image)
+    return min(keys)
+
+
+def is_shard_resource(shard: Shard, resource: Resource) -> bool:
+    return shard.owns(get_image_shard_key(resource))
+
+
+def get_shard_scope(
+    shard: Shard, in_scope: Callable[[Resource], bool]
+) -> Callable[[Resource], bool]:
+    """
+    Narrows a scope to the resources that a check split by image gives to the shard.
+    """
+    return lambda resource: in_scope(resource) and is_shard_resource(shard, resource)
+
+
+def iter_shard_resources(
+    resources: Iterator[Tuple[Resource, List[Container]]], shard: Shard
+) -> Iterator[Tuple[Resource, List[Container]]]:
+    for resource, containers in resources:
+        if is_shard_resource(shard, resource):
+            yield resource, containers
+
+
+def get_finding(notification: Notification) -> dict:
+    return {**notification.to_dict(), "key": notification.get_key()}
+
+
+def write_findings(
+    path: str,
+    shard: Optional[Shard],
+    resource_count: int,
+    notifications: List[Notification],
+) -> None:
+    """
+    Writes the notifications a run reported to a JSON file, for `merge_findings` to combine with those of the other
+    shards.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temporary_path = "{path}.tmp".format(path=path)
+    with open(temporary_path, "w") as findings_file:
+        json.dump(
+            {
+                "version": FINDINGS_FORMAT_VERSION,
+                "shard": {"index": shard.index, "count": shard.count}
+                if shard
+                else None,
+                "finished_at": time.time(),
+                "resources": resource_count,
+                "notifications": [
+                    get_finding(notification) for notification in notifications
+                ],
+            },
+            findings_file,
+        )
+    os.replace(temporary_path, path)
+
+
+def merge_findings(paths: List[str]) -> dict:
+    """
+    Combines the findings files written by the shards of a check into one. If a shard wrote more than one file, e.g.
+    because its pod was retried, the last one written is used. Shards that didn't write a file are listed in
+    `missing_shards`, so that an incomplete check can be told apart from a clean one.
+    """
+    findings_by_shard = {}
+    for path in paths:
+        with open(path) as findings_file:
+            findings = json.load(findings_file)
+        if findings.get("version") != FINDINGS_FORMAT_VERSION:
+            raise Exception(
+                "Findings file {path} was written in a different format".format(
+                    path=path
+                )
+            )
+        shard = Shard(**findings["shard"]) if findings["shard"] else Shard(0, 1)
+        previous = findings_by_shard.get(shard)
+        if previous is None or previous["finished_at"] < findings["finished_at"]:
+            findings_by_shard[shard] = findings
+    shard_counts = {shard.count for shard in findings_by_shard}
+    if len(shard_counts) > 1:
+        raise Exception(
+            "Findings files are from checks split into different numbers of shards: {counts}".format(
+                counts=sorted(shard_counts)
+            )
+        )
+    shard_count = shard_counts.pop() if shard_counts else 0
+    shards = sorted(shard.index for shard in findings_by_shard)
+    missing_shards = sorted(set(range(shard_count)) - set(shards))
+    if missing_shards:
+        logger.warning(
+            "No findings from shards {missing} of {count}".format(
+                missing=", ".join(map(str, missing_shards)), count=shard_count
+            )
+        )
+
+    notifications = {}
+    for shard in sorted(findings_by_shard, key=lambda shard: shard.index):
+        for finding in findings_by_shard[shard]["notifications"]:
+            notifications.setdefault(
+                (finding.get("cluster"), finding.get("uid"), finding["key"]), finding
+            )
+    return {
+        "version": FINDINGS_FORMAT_VERSION,
+        "shard_count": shard_count,
+        "shards": shards,
+        "missing_shards": missing_shards,
+        "resources": sum(
+            findings["resources"] for findings in findings_by_shard.values()
+        ),
+        "notifications": list(notifications.values()),
+    }
+
+
+def write_merged_findings(path: str, merged: dict) -> None:
+    temporary_path = "{path}.tmp".format(path=path)
+    with open(temporary_path, "w") as findings_file:
+        json.dump(merged, findings_file)
+    os.replace(temporary_path, path)
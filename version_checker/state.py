@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Set, Callable
+
+import attr
+
+from version_checker.k8s.model import Resource
+from version_checker.notification import Notification, ResolvedNotification
+
+logger = logging.getLogger(__name__)
+
+STATE_FORMAT_VERSION = 2
+
+
+def get_resource_key(resource: Resource) -> str:
+    return "{cluster}/{uid}".format(
+        cluster=resource.cluster if resource else "",
+        uid=resource.uid if resource else "",
+    )
+
+
+def get_listed_scope(
+    cluster_namespaces: Dict[str, List[str]]
+) -> Callable[[Resource], bool]:
+    """
+    Whether a resource is in one of the namespaces that were listed of its cluster. Clusters listed without any
+    namespaces were listed in full, and resources of clusters that weren't listed are never in scope.
+    """
+
+    def is_listed(resource: Resource) -> bool:
+        if resource.cluster not in cluster_namespaces:
+            return False
+        namespaces = cluster_namespaces[resource.cluster]
+        return not namespaces or resource.namespace in namespaces
+
+    return is_listed
+
+
+class NotificationState(object):
+    """
+    The findings reported by previous runs, stored as a JSON file and grouped by the resource they belong to. Each run's
+    notifications are diffed against it, so that only findings that are new or have been resolved are reported.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._findings: Dict[str, Dict[str, str]] = {}
+        # The resource each set of findings belongs to, so that they can be scoped to what a run listed
+        self._resources: Dict[str, Resource] = {}
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as state_file:
+                contents = json.load(state_file)
+        except (OSError, ValueError):
+            logger.warning(
+                "Ignoring unreadable notification state at {path}".format(
+                    path=self.path
+                )
+            )
+            return
+        if contents.get("version") != STATE_FORMAT_VERSION:
+            logger.info("Ignoring notification state written in an older format")
+            return
+        self._findings = {
+            resource_key: stored["findings"]
+            for resource_key, stored in contents["resources"].items()
+        }
+        self._resources = {
+            resource_key: Resource(
+                **{
+                    **stored["resource"],
+                    "image_spec": frozenset(stored["resource"]["image_spec"]),
+                }
+            )
+            for resource_key, stored in contents["resources"].items()
+        }
+        logger.info(
+            "Loaded {count} previously reported findings from {path}".format(
+                count=sum(len(findings) for findings in self._findings.values()),
+                path=self.path,
+            )
+        )
+
+    def save(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temporary_path = "{path}.tmp".format(path=self.path)
+        with open(temporary_path, "w") as state_file:
+            json.dump(
+                {
+                    "version": STATE_FORMAT_VERSION,
+                    "resources": {
+                        resource_key: {
+                            "resource": {
+                                **attr.asdict(self._resources[resource_key]),
+                                "image_spec": sorted(
+                                    self._resources[resource_key].image_spec
+                                ),
+                            },
+                            "findings": findings,
+                        }
+                        for resource_key, findings in self._findings.items()
+                    },
+                },
+                state_file,
+            )
+        os.replace(temporary_path, self.path)
+
+    def diff(
+        self,
+        resources: Iterable[Resource],
+        notifications: List[Notification],
+        unchecked: Optional[Dict[Resource, Set[str]]] = None,
+    ) -> List[Notification]:
+        """
+        Records the notifications produced by checking the given resources, returning those that were not reported
+        before followed by a `ResolvedNotification` for each earlier finding on these resources that has gone away.
+        Findings of resources that weren't checked are left alone, as are earlier findings whose keys start with one
+        of the prefixes in `unchecked` for their resource, which the check couldn't evaluate.
+        """
+        unchecked_prefixes = {
+            get_resource_key(resource): tuple(prefixes)
+            for resource, prefixes in (unchecked or {}).items()
+        }
+        current_resources = {
+            get_resource_key(resource): resource for resource in resources
+        }
+        current_findings = {resource_key: {} for resource_key in current_resources}
+        for notification in notifications:
+            resource_key = get_resource_key(notification.owner)
+            current_resources.setdefault(resource_key, notification.owner)
+            current_findings.setdefault(resource_key, {})[notification.get_key()] = str(
+                notification
+            )
+
+        new_notifications = []
+        resolved_notifications = []
+        for notification in notifications:
+            if notification.get_key() not in self._findings.get(
+                get_resource_key(notification.owner), {}
+            ):
+                new_notifications.append(notification)
+        for resource_key, findings in current_findings.items():
+            prefixes = unchecked_prefixes.get(resource_key, ())
+            for key, description in self._findings.get(resource_key, {}).items():
+                if key in findings:
+                    continue
+                if prefixes and key.startswith(prefixes):
+                    findings[key] = description
+                else:
+                    resolved_notifications.append(ResolvedNotification(description))
+            if findings:
+                self._findings[resource_key] = findings
+                self._resources[resource_key] = current_resources[resource_key]
+            else:
+                self._findings.pop(resource_key, None)
+                self._resources.pop(resource_key, None)
+        return new_notifications + resolved_notifications
+
+    def resolve_missing(
+        self,
+        resources: Iterable[Resource],
+        in_scope: Optional[Callable[[Resource], bool]] = None,
+    ) -> List[Notification]:
+        """
+        Forgets the findings of every resource in scope that is not among the given ones, e.g. because it has been
+        deleted, returning a `ResolvedNotification` for each. Resources out of scope, such as those of namespaces that
+        weren't listed, are left alone.
+        """
+        present = {get_resource_key(resource) for resource in resources}
+        resolved_notifications = []
+        for resource_key in [
+            key
+            for key in self._findings
+            if key not in present
+            and (in_scope is None or in_scope(self._resources[key]))
+        ]:
+            del self._resources[resource_key]
+            resolved_notifications.extend(
+                ResolvedNotification(description)
+                for description in self._findings.pop(resource_key).values()
+            )
+        return resolved_notifications
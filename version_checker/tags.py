@@ -0,0 +1,50 @@
+import functools
+import logging
+import re
+from typing import Optional, Iterable, Pattern
+
+from packaging.version import Version, InvalidVersion
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_version_tag(tag: str) -> Optional[Version]:
+    """
+    Parses a tag as a PEP 440 version, returning None for tags that aren't versions (e.g. `latest`). Results are
+    memoised, as the same tags turn up across many images and runs of the check.
+    """
+    try:
+        return Version(tag)
+    except InvalidVersion:
+        return None
+
+
+@functools.lru_cache(maxsize=256)
+def compile_tag_pattern(pattern: str) -> Pattern:
+    return re.compile(pattern)
+
+
+def is_versioned_tag(tag: str) -> bool:
+    return parse_version_tag(tag) is not None
+
+
+def find_newest_tag(tags: Iterable[str], match_pattern: str = "") -> Optional[Version]:
+    """
+    Finds the highest version tag matching the pattern in a single pass, so that only the current best tag is held in
+    memory however many tags there are.
+    """
+    if match_pattern:
+        logger.info(
+            "Only matching tags against {pattern}".format(pattern=match_pattern)
+        )
+    pattern = compile_tag_pattern(match_pattern)
+    newest_tag = None
+    for tag in tags:
+        if match_pattern and not pattern.match(tag):
+            continue
+        version = parse_version_tag(tag)
+        if version is not None and (newest_tag is None or version > newest_tag):
+            newest_tag = version
+    logger.debug("Newest matching version tag: {tag}".format(tag=newest_tag))
+    return newest_tag
@@ -0,0 +1,163 @@
+import cProfile
+import json
+import logging
+import math
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Iterator, Any, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_timings: Dict[str, Dict[str, List[float]]] = {}
+_observers: List[Callable[[str, str, float], None]] = []
+_lock = threading.Lock()
+
+
+def reset_timings() -> None:
+    with _lock:
+        _timings.clear()
+
+
+def add_timing_observer(observer: Callable[[str, str, float], None]) -> None:
+    """
+    Registers a function to be called with the category, name and duration of every timing as it is recorded.
+    """
+    with _lock:
+        _observers.append(observer)
+
+
+def record_timing(category: str, name: str, seconds: float) -> None:
+    with _lock:
+        _timings.setdefault(category, {}).setdefault(name, []).append(seconds)
+        observers = list(_observers)
+    for observer in observers:
+        observer(category, name, seconds)
+
+
+@contextmanager
+def timed(category: str, name: str) -> Iterator[None]:
+    """
+    Records how long the body of the `with` block takes under the given category and name, whether or not it raises.
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(category, name, time.perf_counter() - started_at)
+
+
+def percentile(sorted_samples: List[float], fraction: float) -> float:
+    """
+    The nearest-rank percentile of some already sorted samples.
+    """
+    return sorted_samples[max(0, math.ceil(fraction * len(sorted_samples)) - 1)]
+
+
+def summarise(samples: List[float]) -> Dict[str, float]:
+    sorted_samples = sorted(samples)
+    return {
+        "count": len(sorted_samples),
+        "total_seconds": sum(sorted_samples),
+        "p50_seconds": percentile(sorted_samples, 0.5),
+        "p95_seconds": percentile(sorted_samples, 0.95),
+    }
+
+
+def get_timing_report() -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Summarises the count, total and 50th and 95th percentile of every timing recorded, by category and name.
+    """
+    with _lock:
+        return {
+            category: {
+                name: summarise(samples) for name, samples in sorted(names.items())
+            }
+            for category, names in sorted(_timings.items())
+        }
+
+
+def log_timing_report() -> None:
+    for category, names in get_timing_report().items():
+        for name, summary in names.items():
+            logger.info(
+                "{category} {name}: {count} calls, {total:.3f}s total, p50 {p50:.3f}s, p95 {p95:.3f}s".format(
+                    category=category,
+                    name=name,
+                    count=summary["count"],
+                    total=summary["total_seconds"],
+                    p50=summary["p50_seconds"],
+                    p95=summary["p95_seconds"],
+                )
+            )
+
+
+def write_run_report(path: str, extra: Dict[str, Any] = None) -> None:
+    """
+    Writes the timing report, along with any other details of the run, to a JSON file.
+    """
+    with open(path, "w") as report_file:
+        json.dump(
+            {**(extra or {}), "timings": get_timing_report()}, report_file, indent=2
+        )
+    logger.info("Wrote run report to {path}".format(path=path))
+
+
+class ThreadProfiler(object):
+    """
+    Profiles the calling thread and every thread started while it is running, such as the workers that list clusters
+    and look up images, with a `cProfile` profiler for each. Their stats are merged when they are written.
+
+    A profiler can only be switched off from its own thread, so only the calling thread and the threads that have
+    finished by the time the stats are written are included. Threads that are still running are left out.
+    """
+
+    def __init__(self):
+        self._profiles: List[Tuple[threading.Thread, cProfile.Profile]] = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        threading.setprofile(self._profile_thread)
+        self._profile_thread()
+
+    def _profile_thread(self, *args) -> None:
+        # Called as the first profiling event of each new thread, and replaced by the thread's own profiler
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12 onwards only allows one profiler at a time, so only the first thread is profiled there
+            threading.setprofile(None)
+            return
+        with self._lock:
+            self._profiles.append((threading.current_thread(), profile))
+
+    def stop(self, path: str) -> None:
+        threading.setprofile(None)
+        with self._lock:
+            thread_profiles = list(self._profiles)
+        profiles = []
+        for thread, profile in thread_profiles:
+            if thread is threading.current_thread():
+                profile.disable()
+            elif thread.is_alive():
+                logger.warning(
+                    "Leaving thread {name} out of the profile, as it is still running".format(
+                        name=thread.name
+                    )
+                )
+                continue
+            profiles.append(profile)
+        stats: Optional[pstats.Stats] = None
+        for profile in profiles:
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        stats.dump_stats(path)
+        logger.info(
+            "Wrote profile of {count} threads to {path}".format(
+                count=len(profiles), path=path
+            )
+        )
@@ -0,0 +1,235 @@
+import base64
+import json
+import logging
+import threading
+import time
+from typing import Dict, Tuple, List, Set, Optional
+
+from attr import dataclass
+from dateutil.parser import isoparse
+
+from version_checker.mirrors import normalise_registry_host
+from version_checker.sessions import get_session
+from version_checker.timing import timed
+
+logger = logging.getLogger(__name__)
+
+CLIENT_ID = "growse/k8s-version-checker"
+
+# Token services that accept several `scope` parameters in one request, so a single token can cover many repositories
+multi_scope_token_hosts = ["registry-1.docker.io"]
+max_scopes_per_token = 10
+
+# Lifetime assumed for tokens that do not say how long they last, as per the docker token specification
+default_token_lifetime_seconds = 60
+# Tokens are treated as expired this long before they actually expire, to allow for request latency and clock skew
+token_expiry_margin_seconds = 10
+
+
+@dataclass(frozen=True)
+class BearerChallenge:
+    realm: str
+    service: str
+
+
+@dataclass(frozen=True)
+class Token:
+    value: str
+    expires_at: float
+
+    def is_valid(self) -> bool:
+        return time.time() < self.expires_at - token_expiry_margin_seconds
+
+
+_challenges: Dict[str, BearerChallenge] = {}
+_tokens: Dict[Tuple[str, str, str], Token] = {}
+_repositories: Dict[str, Set[str]] = {}
+_credentials: Dict[str, Tuple[str, str]] = {}
+_basic_auth_hosts: Set[str] = set()
+_lock = threading.Lock()
+
+
+def configure_credentials(credentials: Dict[str, Tuple[str, str]]) -> None:
+    """
+    Sets the username and password to authenticate to each registry host with, for registries and mirrors that don't
+    allow anonymous pulls.
+    """
+    global _credentials
+    with _lock:
+        _credentials = {
+            normalise_registry_host(host): host_credentials
+            for host, host_credentials in credentials.items()
+        }
+        _basic_auth_hosts.clear()
+
+
+def get_credentials(host: str) -> Optional[Tuple[str, str]]:
+    return _credentials.get(host)
+
+
+def load_docker_credentials(path: str) -> Dict[str, Tuple[str, str]]:
+    """
+    Reads registry credentials from a docker `config.json`, or the `.dockerconfigjson` of a kubernetes image pull
+    secret. Each entry of `auths` gives either a base64 encoded `username:password` as its `auth`, or a `username` and
+    `password`.
+    """
+    with open(path) as config_file:
+        auths = json.load(config_file).get("auths", {})
+    credentials = {}
+    for host, entry in auths.items():
+        if entry.get("auth"):
+            username, _, password = (
+                base64.b64decode(entry["auth"]).decode().partition(":")
+            )
+        elif entry.get("username"):
+            username, password = entry["username"], entry.get("password", "")
+        else:
+            raise Exception(
+                "No credentials given for {host} in {path}".format(host=host, path=path)
+            )
+        credentials[normalise_registry_host(host)] = (username, password)
+    return credentials
+
+
+def remember_basic_auth(host: str) -> None:
+    with _lock:
+        _basic_auth_hosts.add(host)
+
+
+def uses_basic_auth(host: str) -> bool:
+    with _lock:
+        return host in _basic_auth_hosts
+
+
+def get_basic_authorization_header(host: str) -> Dict[str, str]:
+    username, password = _credentials[host]
+    return {
+        "authorization": "Basic {credentials}".format(
+            credentials=base64.b64encode(
+                "{username}:{password}".format(
+                    username=username, password=password
+                ).encode()
+            ).decode()
+        )
+    }
+
+
+def repository_pull_scope(repository: str) -> str:
+    return "repository:{repository}:pull".format(repository=repository)
+
+
+def register_repositories(host: str, repositories: List[str]) -> None:
+    """
+    Records repositories that are going to be queried on a host, so that tokens fetched for one of them can be widened
+    to cover the others.
+    """
+    with _lock:
+        _repositories.setdefault(host, set()).update(repositories)
+
+
+def parse_bearer_challenge(authenticate_header: str) -> Tuple[BearerChallenge, str]:
+    """
+    Parses a `WWW-Authenticate: Bearer realm="...",service="...",scope="..."` header into the challenge and the scope
+    it asks for.
+    """
+    if not authenticate_header.startswith("Bearer "):
+        raise Exception("Invalid authentication header in registry response")
+    header_dictionary = {
+        key.strip(): value.strip('"')
+        for key, value in (
+            part.split("=", 1)
+            for part in authenticate_header[len("Bearer ") :].strip().split(",")
+        )
+    }
+    return (
+        BearerChallenge(
+            header_dictionary["realm"], header_dictionary.get("service", "")
+        ),
+        header_dictionary.get("scope", ""),
+    )
+
+
+def remember_challenge(host: str, challenge: BearerChallenge) -> None:
+    with _lock:
+        _challenges[host] = challenge
+
+
+def get_known_challenge(host: str) -> Optional[BearerChallenge]:
+    with _lock:
+        return _challenges.get(host)
+
+
+def get_token(host: str, challenge: BearerChallenge, scope: str) -> str:
+    """
+    Returns a token for the given scope, using a cached one if it has not yet expired. Newly fetched tokens are widened
+    to the other registered repositories on the host where the token service supports it.
+    """
+    with _lock:
+        token = _tokens.get((challenge.realm, challenge.service, scope))
+        if token and token.is_valid():
+            return token.value
+        scopes = [scope]
+        if host in multi_scope_token_hosts:
+            scopes.extend(
+                sorted(
+                    other_scope
+                    for other_scope in map(
+                        repository_pull_scope, _repositories.get(host, set())
+                    )
+                    if other_scope != scope
+                    and not _has_valid_token(challenge, other_scope)
+                )[: max_scopes_per_token - 1]
+            )
+
+    with timed("registry", "{host} auth".format(host=host)):
+        token = docker_registry_auth(
+            challenge.realm, challenge.service, scopes, get_credentials(host)
+        )
+    with _lock:
+        for granted_scope in scopes:
+            _tokens[(challenge.realm, challenge.service, granted_scope)] = token
+    return token.value
+
+
+def _has_valid_token(challenge: BearerChallenge, scope: str) -> bool:
+    token = _tokens.get((challenge.realm, challenge.service, scope))
+    return token is not None and token.is_valid()
+
+
+def invalidate_token(challenge: BearerChallenge, scope: str) -> None:
+    with _lock:
+        _tokens.pop((challenge.realm, challenge.service, scope), None)
+
+
+def docker_registry_auth(
+    realm: str,
+    service: str,
+    scopes: List[str],
+    credentials: Optional[Tuple[str, str]] = None,
+) -> Token:
+    """
+    Fetches a token from a registry's token service, authenticating with the registry's credentials if it has any.
+    """
+    logger.debug(
+        "Fetching token from {realm} for {scopes}".format(realm=realm, scopes=scopes)
+    )
+    response = get_session(realm).get(
+        realm,
+        params={"service": service, "scope": scopes, "client_id": CLIENT_ID},
+        auth=credentials,
+    )
+    if response.status_code != 200:
+        raise Exception(
+            "Error received from token service: {response}".format(response=response)
+        )
+    token_response = response.json()
+    expires_in = token_response.get("expires_in") or default_token_lifetime_seconds
+    issued_at = (
+        isoparse(token_response["issued_at"]).timestamp()
+        if token_response.get("issued_at")
+        else time.time()
+    )
+    return Token(
+        value=token_response.get("token") or token_response["access_token"],
+        expires_at=min(issued_at, time.time()) + expires_in,
+    )